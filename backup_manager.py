@@ -1,28 +1,112 @@
+import io
 import os
+import gzip
+import json
 import time
-import shutil
+import hashlib
+import tarfile
 import datetime
 import logging
+import tempfile
 import threading
+from collections import namedtuple
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, gzip from the standard library is the fallback
+    zstandard = None
+
+from snapshot_file import check_snapshot, replace_atomically
+
+DB_SNAPSHOT_FILE = 'bot_database.pkl'
+DB_JOURNAL_FILE = 'bot_database.journal'
+MANIFEST_FILE = 'manifest.json'
+CODEC_EXTENSIONS = {'zstd': '.zst', 'gzip': '.gz'}
+PARTS_SUFFIX = '.parts.json'
+# Bots may upload up to 50 MB but only download up to 20 MB, so parts stay below
+# the download limit to be accepted back by the restore command
+PART_SIZE = 19 * 1024 * 1024
+COPY_BUFFER = 1024 * 1024
+
+# received/total: parts of a split upload; archive: reassembled tar once complete
+UploadStatus = namedtuple('UploadStatus', 'received total archive')
+
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_BUFFER), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _upload_name(name):
+    """
+    File name from an uploaded parts manifest, which must not point outside incoming_dir.
+
+    Raises:
+        ValueError: The name contains a directory component or is empty
+    """
+    if not isinstance(name, str) or os.path.basename(name) != name or name in ('', '.', '..'):
+        raise ValueError(f"Invalid file name in backup manifest: {name!r}")
+    return name
+
+
+def _compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("This backup is zstd-compressed and requires the zstandard package")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
 
 class BackupManager:
-    def __init__(self, backup_interval=3600, max_backups=5):
+    def __init__(self, backup_interval=3600, max_backups=5, restore_handler=None, codec=None,
+                 snapshot_source=None):
         """
         Initialize the backup manager with the specified interval and max number of backups.
-        
+
+        Backups are kept in a content-addressed store: every snapshot or journal segment
+        is compressed once into ``objects/<sha256>`` and ``manifest.json`` lists the
+        backups and the objects each one is made of. An unchanged snapshot is therefore
+        never stored twice; while the snapshot stays the same (journal mode), a new
+        backup only stores the journal records appended since the previous one.
+
         Args:
             backup_interval (int): Time between backups in seconds (default: 1 hour)
             max_backups (int): Maximum number of backups to keep (default: 5)
+            restore_handler (callable, optional): Loads a validated backup into the running
+                database, called as ``restore_handler(snapshot_path, journal_path)`` (e.g.
+                ``db.restore_snapshot``) and returning True on success. Without it the
+                backup is written over the database files and takes effect on the next start.
+            codec (str, optional): "zstd" or "gzip"; defaults to zstd when the zstandard
+                package is installed
+            snapshot_source (callable, optional): Returns the current database as snapshot
+                bytes (``encode_snapshot``) for backends that do not keep their data in the
+                snapshot file, e.g. SQLite. When set, the database files are not read.
         """
         self.backup_interval = backup_interval  # Default: backup every hour
         self.max_backups = max_backups
+        self.restore_handler = restore_handler
+        self.snapshot_source = snapshot_source
+        self.codec = codec or ('zstd' if zstandard is not None else 'gzip')
         self.backup_dir = "database_backups"
+        self.objects_dir = os.path.join(self.backup_dir, "objects")
+        self.manifest_path = os.path.join(self.backup_dir, MANIFEST_FILE)
         self.running = False
         self.logger = logging.getLogger('backup_manager')
-        
-        # Create backup directory if it doesn't exist
-        if not os.path.exists(self.backup_dir):
-            os.makedirs(self.backup_dir)
+        self._lock = threading.RLock()
+
+        # Create backup directories if they don't exist
+        os.makedirs(self.objects_dir, exist_ok=True)
+        self._manifest = self._load_manifest()
+        self._import_legacy_backups()
 
     def start_backup_thread(self):
         """Start the background thread for automatic backups."""
@@ -47,102 +131,469 @@ class BackupManager:
                 self.cleanup_old_backups()
             except Exception as e:
                 self.logger.error(f"Error during automatic backup: {e}")
-            
+
             # Sleep until next backup
             time.sleep(self.backup_interval)
 
+    # --- manifest and object store ---
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {"backups": [], "objects": {}}
+        except Exception as e:
+            self.logger.error(f"Failed to read backup manifest, starting a new one: {e}")
+            return {"backups": [], "objects": {}}
+        manifest.setdefault("backups", [])
+        manifest.setdefault("objects", {})
+        return manifest
+
+    def _save_manifest(self):
+        replace_atomically(self.manifest_path,
+                           json.dumps(self._manifest, ensure_ascii=False, indent=1).encode('utf-8'))
+
+    def _object_path(self, digest):
+        codec = self._manifest["objects"][digest]["codec"]
+        return os.path.join(self.objects_dir, digest + CODEC_EXTENSIONS[codec])
+
+    def _store_object(self, data):
+        """
+        Compress and store data unless an object with the same content already exists.
+
+        Returns:
+            str: SHA-256 of the uncompressed data (the object name)
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        info = self._manifest["objects"].get(digest)
+        if info is not None and os.path.exists(self._object_path(digest)):
+            return digest
+
+        stored = _compress(data, self.codec)
+        self._manifest["objects"][digest] = {
+            "codec": self.codec,
+            "size": len(data),
+            "stored_size": len(stored),
+        }
+        replace_atomically(self._object_path(digest), stored)
+        return digest
+
+    def _read_object(self, digest):
+        """Read, decompress and verify one object."""
+        with open(self._object_path(digest), 'rb') as f:
+            data = _decompress(f.read(), self._manifest["objects"][digest]["codec"])
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Backup object {digest[:12]} is corrupted")
+        return data
+
+    def _find_backup(self, backup_id=None):
+        backups = self._manifest["backups"]
+        if backup_id is None:
+            return backups[0] if backups else None
+        return next((entry for entry in backups if entry["id"] == backup_id), None)
+
+    def _import_legacy_backups(self):
+        """Move plain ``bot_database_<timestamp>.pkl`` backups into the object store."""
+        legacy = [name for name in os.listdir(self.backup_dir)
+                  if name.startswith("bot_database_") and name.endswith(".pkl")]
+        if not legacy:
+            return
+        with self._lock:
+            for filename in legacy:
+                file_path = os.path.join(self.backup_dir, filename)
+                try:
+                    with open(file_path, 'rb') as f:
+                        payload = f.read()
+                    check_snapshot(payload)
+                    backup_id = filename[len("bot_database_"):-len(".pkl")]
+                    if self._find_backup(backup_id) is None:
+                        self._manifest["backups"].append(
+                            self._make_entry(backup_id, os.path.getctime(file_path), "full",
+                                             self._store_object(payload), [], b""))
+                    self._save_manifest()
+                    os.remove(file_path)
+                    self.logger.info(f"Imported legacy backup {filename}")
+                except Exception as e:
+                    self.logger.error(f"Failed to import legacy backup {filename}: {e}")
+            self._manifest["backups"].sort(key=lambda entry: entry["created"], reverse=True)
+            self._save_manifest()
+
+    def _make_entry(self, backup_id, created, kind, snapshot_digest, segments, journal):
+        objects = self._manifest["objects"]
+        return {
+            "id": backup_id,
+            "created": created,
+            "kind": kind,
+            "snapshot": snapshot_digest,
+            "journal": segments,
+            # Used to recognise the next backup as a continuation of this journal
+            "journal_size": len(journal),
+            "journal_sha": hashlib.sha256(journal).hexdigest(),
+            "size": sum(objects[digest]["size"] for digest in [snapshot_digest] + segments),
+            "stored_size": sum(objects[digest]["stored_size"] for digest in [snapshot_digest] + segments),
+        }
+
+    # --- backups ---
+
     def create_backup(self):
         """
-        Create a backup of the database file.
-        
+        Create a backup of the database file and its journal (or of the snapshot returned
+        by snapshot_source).
+
+        The journal is read before the snapshot: if the database compacts in between,
+        the newer snapshot already contains every record that was read, and records
+        already merged into a snapshot are skipped when the journal is replayed.
+
         Returns:
-            str: Path to the created backup file
+            str: Id of the created backup (or of the latest one if nothing changed)
         """
         try:
-            source_file = 'bot_database.pkl'
-            if not os.path.exists(source_file):
-                self.logger.warning(f"Database file {source_file} not found, skipping backup")
-                return None
-                
-            # Create timestamp for the backup filename
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            backup_filename = f"bot_database_{timestamp}.pkl"
-            backup_path = os.path.join(self.backup_dir, backup_filename)
-            
-            # Copy the database file
-            shutil.copy2(source_file, backup_path)
-            
-            self.logger.info(f"Database backup created: {backup_path}")
-            return backup_path
+            if self.snapshot_source is not None:
+                payload, journal = self.snapshot_source(), b""
+            else:
+                payload, journal = self._read_database_files()
+                if payload is None:
+                    return None
+            check_snapshot(payload)
+
+            with self._lock:
+                snapshot_digest = self._store_object(payload)
+                latest = self._find_backup()
+                if (latest is not None and latest["snapshot"] == snapshot_digest
+                        and len(journal) >= latest["journal_size"]
+                        and hashlib.sha256(journal[:latest["journal_size"]]).hexdigest() == latest["journal_sha"]):
+                    # Same snapshot and the journal only grew: store just the new records
+                    tail = journal[latest["journal_size"]:]
+                    if not tail:
+                        self.logger.info(f"Database unchanged since backup {latest['id']}, skipping")
+                        return latest["id"]
+                    kind, segments = "incremental", latest["journal"] + [self._store_object(tail)]
+                else:
+                    kind, segments = "full", [self._store_object(journal)] if journal else []
+
+                # Create timestamp for the backup id
+                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+                backup_id, suffix = timestamp, 1
+                while self._find_backup(backup_id) is not None:
+                    suffix += 1
+                    backup_id = f"{timestamp}_{suffix}"
+
+                entry = self._make_entry(backup_id, time.time(), kind, snapshot_digest, segments, journal)
+                self._manifest["backups"].insert(0, entry)
+                self._save_manifest()
+
+            self.logger.info(f"Database backup created: {backup_id} ({kind}, "
+                             f"{entry['stored_size']} of {entry['size']} bytes stored)")
+            return backup_id
         except Exception as e:
             self.logger.error(f"Failed to create backup: {e}")
             raise
 
-    def restore_backup(self, backup_file=None):
+    def _read_database_files(self):
+        """
+        Read the snapshot and journal files of the pickle backend.
+
+        Returns:
+            tuple: (snapshot bytes, journal bytes), snapshot is None if the file is missing
+        """
+        source_file = DB_SNAPSHOT_FILE
+        if not os.path.exists(source_file):
+            self.logger.warning(f"Database file {source_file} not found, skipping backup")
+            return None, b""
+
+        journal = b""
+        if os.path.exists(DB_JOURNAL_FILE):
+            with open(DB_JOURNAL_FILE, 'rb') as f:
+                journal = f.read()
+        # The snapshot is only ever replaced atomically, so one read sees a single generation
+        with open(source_file, 'rb') as f:
+            payload = f.read()
+        return payload, journal
+
+    def restore_backup(self, backup_id=None):
         """
         Restore database from backup.
-        
+
         Args:
-            backup_file (str, optional): Specific backup file to restore. 
-                                         If None, restores the most recent backup.
-        
+            backup_id (str, optional): Specific backup to restore.
+                                       If None, restores the most recent backup.
+
         Returns:
             bool: True if successful, False otherwise
         """
         try:
-            if backup_file is None:
-                # Find the most recent backup
-                backups = self.list_backups()
-                if not backups:
+            with self._lock:
+                entry = self._find_backup(backup_id)
+                if entry is None:
                     self.logger.warning("No backups found to restore")
                     return False
-                backup_file = backups[0][1]  # Get the path from the most recent backup
-            
-            # بررسی اعتبار فایل بکاپ قبل از بازیابی
-            import pickle
-            try:
-                with open(backup_file, 'rb') as test_file:
-                    pickle.load(test_file)
-            except Exception as pickle_error:
-                self.logger.error(f"فایل بکاپ معتبر نیست: {pickle_error}")
-                return False
-                
-            # Restore the database
-            shutil.copy2(backup_file, 'bot_database.pkl')
-            self.logger.info(f"Database restored from {backup_file}")
+
+                # بررسی اعتبار اشیای بکاپ (هش محتوا و چک‌سام اسنپ‌شات) قبل از بازیابی
+                try:
+                    payload = self._read_object(entry["snapshot"])
+                    check_snapshot(payload)
+                    journal = b"".join(self._read_object(digest) for digest in entry["journal"])
+                except Exception as backup_error:
+                    self.logger.error(f"بکاپ {entry['id']} معتبر نیست: {backup_error}")
+                    return False
+
+            if self.restore_handler is not None:
+                # The running database swaps its state and writes the files itself
+                with tempfile.TemporaryDirectory(dir=self.backup_dir) as tmp_dir:
+                    snapshot_path = os.path.join(tmp_dir, DB_SNAPSHOT_FILE)
+                    with open(snapshot_path, 'wb') as f:
+                        f.write(payload)
+                    journal_path = None
+                    if journal:
+                        journal_path = os.path.join(tmp_dir, DB_JOURNAL_FILE)
+                        with open(journal_path, 'wb') as f:
+                            f.write(journal)
+                    if not self.restore_handler(snapshot_path, journal_path):
+                        self.logger.error(f"Failed to load backup {entry['id']} into the database")
+                        return False
+            else:
+                # Restore the database (atomic replace, a crash leaves the old files intact)
+                replace_atomically(DB_JOURNAL_FILE, journal)
+                replace_atomically(DB_SNAPSHOT_FILE, payload)
+            self.logger.info(f"Database restored from backup {entry['id']}")
             return True
         except Exception as e:
             self.logger.error(f"Failed to restore backup: {e}")
             return False
 
+    def verify_backup(self, backup_id=None, deep=False):
+        """
+        Check that a backup can be restored.
+
+        The quick check only compares the stored objects' sizes with the manifest;
+        ``deep`` decompresses every object and verifies its SHA-256 (nothing is unpickled).
+
+        Returns:
+            bool: True if the backup is intact
+        """
+        with self._lock:
+            entry = self._find_backup(backup_id)
+            if entry is None:
+                return False
+            try:
+                for digest in [entry["snapshot"]] + entry["journal"]:
+                    if deep:
+                        self._read_object(digest)
+                    elif os.path.getsize(self._object_path(digest)) != \
+                            self._manifest["objects"][digest]["stored_size"]:
+                        return False
+                return True
+            except Exception as e:
+                self.logger.error(f"Backup {entry['id']} failed verification: {e}")
+                return False
+
+    def backup_info(self, backup_id=None):
+        """
+        Returns:
+            dict: Manifest entry of a backup (id, created, kind, size, stored_size, ...)
+                or None
+        """
+        with self._lock:
+            entry = self._find_backup(backup_id)
+            return dict(entry) if entry is not None else None
+
+    def export_backup(self, backup_id=None, dest_path=None):
+        """
+        Pack one backup into a single tar archive (its manifest entry plus the compressed
+        objects it needs), e.g. to send it to the admin.
+
+        Returns:
+            str: Path to the archive, or None if the backup does not exist
+        """
+        with self._lock:
+            entry = self._find_backup(backup_id)
+            if entry is None:
+                return None
+            digests = [entry["snapshot"]] + entry["journal"]
+            manifest = {
+                "backups": [entry],
+                "objects": {digest: self._manifest["objects"][digest] for digest in digests},
+            }
+            dest_path = dest_path or os.path.join(self.backup_dir, f"bot_database_{entry['id']}.tar")
+            with tarfile.open(dest_path, 'w') as archive:
+                data = json.dumps(manifest, ensure_ascii=False).encode('utf-8')
+                info = tarfile.TarInfo(MANIFEST_FILE)
+                info.size = len(data)
+                info.mtime = int(entry["created"])
+                archive.addfile(info, fileobj=io.BytesIO(data))
+                for digest in digests:
+                    path = self._object_path(digest)
+                    archive.add(path, arcname=f"objects/{os.path.basename(path)}")
+            return dest_path
+
+    def split_archive(self, archive_path, part_size=PART_SIZE):
+        """
+        Split an exported archive into numbered parts plus a ``.parts.json`` manifest
+        (name, size and SHA-256 of the whole file and of every part).
+
+        The archive is streamed through a fixed buffer, never loaded into memory. An
+        archive that already fits in one part is returned unchanged.
+
+        Returns:
+            list: Paths to send in order: the parts followed by the manifest, or just
+                the archive
+        """
+        total_size = os.path.getsize(archive_path)
+        if total_size <= part_size:
+            return [archive_path]
+
+        name = os.path.basename(archive_path)
+        parts, paths = [], []
+        whole = hashlib.sha256()
+        with open(archive_path, 'rb') as source:
+            while True:
+                part_path = f"{archive_path}.{len(parts) + 1:03d}"
+                part_digest, written = hashlib.sha256(), 0
+                with open(part_path, 'wb') as part:
+                    while written < part_size:
+                        chunk = source.read(min(COPY_BUFFER, part_size - written))
+                        if not chunk:
+                            break
+                        part.write(chunk)
+                        part_digest.update(chunk)
+                        whole.update(chunk)
+                        written += len(chunk)
+                if not written:
+                    os.remove(part_path)
+                    break
+                parts.append({"name": os.path.basename(part_path), "size": written,
+                              "sha256": part_digest.hexdigest()})
+                paths.append(part_path)
+
+        manifest_path = archive_path + PARTS_SUFFIX
+        with open(manifest_path, 'w', encoding='utf-8') as f:
+            json.dump({"name": name, "size": total_size, "sha256": whole.hexdigest(), "parts": parts}, f)
+        os.remove(archive_path)
+        return paths + [manifest_path]
+
+    @property
+    def incoming_dir(self):
+        """Directory collecting uploaded backup archives or parts until they are complete."""
+        return os.path.join(self.backup_dir, "incoming")
+
+    def assemble_upload(self):
+        """
+        Check the uploaded files in incoming_dir and reassemble a split archive once
+        every part has arrived (each part and the result are verified by SHA-256).
+
+        Returns:
+            UploadStatus: archive is the path of a complete tar, otherwise None
+
+        Raises:
+            ValueError: A part or the reassembled archive does not match the manifest
+        """
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        names = os.listdir(self.incoming_dir)
+        manifests = [name for name in names if name.endswith(PARTS_SUFFIX)]
+        if not manifests:
+            archives = [name for name in names if name.endswith('.tar')]
+            if archives:
+                return UploadStatus(1, 1, os.path.join(self.incoming_dir, archives[0]))
+            # Parts received before the manifest
+            return UploadStatus(len(names), None, None)
+
+        with open(os.path.join(self.incoming_dir, manifests[0]), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        part_names = [_upload_name(part["name"]) for part in manifest["parts"]]
+        archive_name = _upload_name(manifest["name"])
+        if archive_name in part_names:
+            raise ValueError(f"Invalid file name in backup manifest: {archive_name!r}")
+        present = [name for name in part_names
+                   if os.path.exists(os.path.join(self.incoming_dir, name))]
+        if len(present) < len(part_names):
+            return UploadStatus(len(present), len(part_names), None)
+
+        archive_path = os.path.join(self.incoming_dir, archive_name)
+        whole = hashlib.sha256()
+        with open(archive_path, 'wb') as target:
+            for part in manifest["parts"]:
+                part_path = os.path.join(self.incoming_dir, part["name"])
+                if _file_sha256(part_path) != part["sha256"]:
+                    raise ValueError(f"Backup part {part['name']} is corrupted")
+                with open(part_path, 'rb') as source:
+                    for chunk in iter(lambda: source.read(COPY_BUFFER), b''):
+                        target.write(chunk)
+                        whole.update(chunk)
+        if whole.hexdigest() != manifest["sha256"]:
+            os.remove(archive_path)
+            raise ValueError("Reassembled backup does not match its manifest")
+        return UploadStatus(len(present), len(part_names), archive_path)
+
+    def clear_upload(self):
+        """Remove every file received for an upload."""
+        if os.path.isdir(self.incoming_dir):
+            for name in os.listdir(self.incoming_dir):
+                os.remove(os.path.join(self.incoming_dir, name))
+
+    def import_backup(self, archive_path):
+        """
+        Add a backup exported by export_backup to this store (objects are verified
+        and deduplicated against the existing ones).
+
+        Returns:
+            str: Id of the imported backup
+
+        Raises:
+            ValueError: The archive is not a valid backup export
+        """
+        with tarfile.open(archive_path, 'r') as archive:
+            try:
+                manifest = json.load(archive.extractfile(MANIFEST_FILE))
+                entry = manifest["backups"][0]
+            except (KeyError, IndexError, TypeError, ValueError) as e:
+                raise ValueError(f"Not a backup archive: {e}")
+
+            with self._lock:
+                for digest in [entry["snapshot"]] + entry["journal"]:
+                    info = manifest["objects"][digest]
+                    member = archive.extractfile(f"objects/{digest}{CODEC_EXTENSIONS[info['codec']]}")
+                    data = _decompress(member.read(), info["codec"])
+                    if hashlib.sha256(data).hexdigest() != digest:
+                        raise ValueError(f"Backup object {digest[:12]} is corrupted")
+                    self._store_object(data)
+                if self._find_backup(entry["id"]) is None:
+                    self._manifest["backups"].append(dict(entry))
+                    self._manifest["backups"].sort(key=lambda item: item["created"], reverse=True)
+                    self._save_manifest()
+                self.logger.info(f"Imported backup {entry['id']} from {archive_path}")
+                return entry["id"]
+
     def list_backups(self):
         """
         List all available backups, sorted by creation time (newest first).
-        
+
         Returns:
-            list: List of tuples (timestamp, file_path) of available backups
-        """
-        if not os.path.exists(self.backup_dir):
-            return []
-            
-        backups = []
-        for filename in os.listdir(self.backup_dir):
-            if filename.startswith("bot_database_") and filename.endswith(".pkl"):
-                file_path = os.path.join(self.backup_dir, filename)
-                created_time = os.path.getctime(file_path)
-                backups.append((created_time, file_path))
-        
-        # Sort by creation time (newest first)
-        backups.sort(reverse=True)
-        return backups
+            list: List of tuples (timestamp, backup_id) of available backups
+        """
+        with self._lock:
+            return [(entry["created"], entry["id"]) for entry in self._manifest["backups"]]
 
     def cleanup_old_backups(self):
-        """Remove old backups to keep only the specified maximum number."""
-        backups = self.list_backups()
-        if len(backups) > self.max_backups:
-            for _, file_path in backups[self.max_backups:]:
+        """Remove old backups to keep only the specified maximum number, then delete unused objects."""
+        with self._lock:
+            backups = self._manifest["backups"]
+            if len(backups) <= self.max_backups:
+                return
+            for entry in backups[self.max_backups:]:
+                self.logger.info(f"Removed old backup: {entry['id']}")
+            del backups[self.max_backups:]
+
+            referenced = {digest for entry in backups for digest in [entry["snapshot"]] + entry["journal"]}
+            unused = [digest for digest in self._manifest["objects"] if digest not in referenced]
+            for digest in unused:
                 try:
-                    os.remove(file_path)
-                    self.logger.info(f"Removed old backup: {file_path}")
+                    os.remove(self._object_path(digest))
+                except FileNotFoundError:
+                    pass
                 except Exception as e:
-                    self.logger.error(f"Failed to remove old backup {file_path}: {e}")
+                    self.logger.error(f"Failed to remove backup object {digest[:12]}: {e}")
+                    continue
+                del self._manifest["objects"][digest]
+            self._save_manifest()
+
@@ -0,0 +1,279 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+
+from telegram.error import RetryAfter, TimedOut, NetworkError, Unauthorized, BadRequest
+
+from db_manager import DELIVERY_BLOCKED, DELIVERY_CHAT_NOT_FOUND, DELIVERY_DEACTIVATED
+from rate_limiter import TokenBucket
+from save_scheduler import SaveScheduler
+
+BROADCAST_STATE_FILE = 'broadcast_jobs.json'
+
+
+def classify_delivery_error(error):
+    """
+    Map a send_message error to a permanent delivery state.
+
+    Returns:
+        str: DELIVERY_* status for users that can no longer be reached, None for other errors
+    """
+    message = str(error).lower()
+    if isinstance(error, Unauthorized):
+        # "Forbidden: user is deactivated" / "Forbidden: bot was blocked by the user"
+        if 'deactivated' in message:
+            return DELIVERY_DEACTIVATED
+        return DELIVERY_BLOCKED
+    if isinstance(error, BadRequest) and 'chat not found' in message:
+        return DELIVERY_CHAT_NOT_FOUND
+    return None
+
+
+class BroadcastManager:
+    def __init__(self, state_file=BROADCAST_STATE_FILE, rate=25.0, progress_interval=3.0,
+                 max_retries=3, on_unreachable=None):
+        """
+        Send broadcast messages from a background thread.
+
+        Jobs are processed one at a time. Every send takes a token from a shared bucket so
+        the bot stays under Telegram's global limit (~30 msg/s), and flood-wait errors pause
+        the whole queue. The job list and each job's cursor are written to disk, so
+        unfinished broadcasts continue from where they stopped after a restart.
+
+        Args:
+            state_file (str): JSON file holding unfinished jobs
+            rate (float): Messages per second across all jobs (default: 25)
+            progress_interval (float): Minimum time between status message edits in seconds
+            max_retries (int): Attempts per recipient on network errors
+            on_unreachable (callable): Called with (user_id, status, reason) when a recipient
+                has blocked the bot or no longer exists
+        """
+        self.state_file = state_file
+        self.progress_interval = progress_interval
+        self.max_retries = max_retries
+        self.on_unreachable = on_unreachable
+        self.bucket = TokenBucket(rate, capacity=rate)
+        self.bot = None
+        self.running = False
+        self.jobs = deque()
+        self._condition = threading.Condition()
+        self._scheduler = SaveScheduler(self._save_state, interval=1.0)
+        self.logger = logging.getLogger('broadcast')
+        self._load_state()
+
+    def start(self, bot):
+        """Start the sender thread; jobs left over from the previous run are resumed."""
+        self.bot = bot
+        if not self.running:
+            self.running = True
+            self._scheduler.start()
+            self.worker_thread = threading.Thread(target=self._worker_loop, daemon=True)
+            self.worker_thread.start()
+            if self.jobs:
+                self.logger.info(f"Resuming {len(self.jobs)} unfinished broadcast job(s).")
+            self.logger.info("Broadcast sender started.")
+
+    def stop(self):
+        """Stop the sender after the current message and persist the cursor."""
+        with self._condition:
+            self.running = False
+            self._condition.notify_all()
+        if hasattr(self, 'worker_thread') and self.worker_thread.is_alive():
+            self.worker_thread.join(timeout=5.0)
+        self._scheduler.stop()
+        self.logger.info("Broadcast sender stopped.")
+
+    def submit(self, messages, recipients, status_chat_id=None, status_message_id=None,
+               parse_mode=None, title="پیام همگانی"):
+        """
+        Queue a broadcast.
+
+        Args:
+            messages (str or list): Text (or list of texts sent in order) for each recipient
+            recipients (iterable): Chat ids; the list is fixed when the job is created
+            status_chat_id (int): Chat of the status message that receives progress edits
+            status_message_id (int): Id of that status message
+            parse_mode (str): Telegram parse mode for the messages
+            title (str): Name shown in progress reports
+
+        Returns:
+            str: Job id
+        """
+        if isinstance(messages, str):
+            messages = [messages]
+        job = {
+            "id": uuid.uuid4().hex[:8],
+            "title": title,
+            "messages": list(messages),
+            "parse_mode": parse_mode,
+            "recipients": list(recipients),
+            "cursor": 0,
+            "success": 0,
+            "failed": 0,
+            "unreachable": 0,
+            "status_chat_id": status_chat_id,
+            "status_message_id": status_message_id,
+            "created": time.time(),
+        }
+        with self._condition:
+            self.jobs.append(job)
+            self._condition.notify_all()
+        self._scheduler.mark_dirty()
+        return job["id"]
+
+    def pending_count(self):
+        """Number of queued or running jobs."""
+        with self._condition:
+            return len(self.jobs)
+
+    def _worker_loop(self):
+        """Background process that sends queued jobs in order."""
+        while True:
+            with self._condition:
+                while self.running and not self.jobs:
+                    self._condition.wait()
+                if not self.running:
+                    return
+                job = self.jobs[0]
+
+            try:
+                finished = self._run_job(job)
+            except Exception as e:
+                self.logger.error(f"Broadcast job {job['id']} crashed: {e}")
+                finished = True
+
+            if finished:
+                with self._condition:
+                    if self.jobs and self.jobs[0] is job:
+                        self.jobs.popleft()
+                self._scheduler.mark_dirty()
+                self._report(job, final=True)
+
+    def _run_job(self, job):
+        """
+        Send the remaining messages of a job.
+
+        Returns:
+            bool: True when the job is complete, False if the sender was stopped
+        """
+        last_report = 0.0
+        recipients = job["recipients"]
+        while job["cursor"] < len(recipients):
+            if not self.running:
+                return False
+            chat_id = recipients[job["cursor"]]
+            result = self._deliver(chat_id, job)
+            if result is True:
+                job["success"] += 1
+            elif result is False:
+                job["failed"] += 1
+            else:
+                job["unreachable"] = job.get("unreachable", 0) + 1
+            job["cursor"] += 1
+            self._scheduler.mark_dirty()
+
+            now = time.monotonic()
+            if now - last_report >= self.progress_interval:
+                last_report = now
+                self._report(job)
+        return True
+
+    def _deliver(self, chat_id, job):
+        """
+        Send every message of the job to one recipient, waiting out flood limits.
+
+        Returns:
+            True on success, False on a temporary failure, or the DELIVERY_* status when
+            the recipient can no longer be reached
+        """
+        for text in job["messages"]:
+            attempt = 0
+            while True:
+                self.bucket.acquire()
+                try:
+                    self.bot.send_message(chat_id=chat_id, text=text, parse_mode=job["parse_mode"])
+                    break
+                except RetryAfter as e:
+                    # Flood wait applies to the whole bot, so every send is paused
+                    self.logger.warning(f"Flood limit hit, pausing broadcast for {e.retry_after}s")
+                    self.bucket.pause(e.retry_after)
+                except (Unauthorized, BadRequest) as e:
+                    # BadRequest subclasses NetworkError but is permanent, never retry it
+                    status = classify_delivery_error(e)
+                    if status is None:
+                        self.logger.error(f"Broadcast to {chat_id} failed: {e}")
+                        return False
+                    self._mark_unreachable(chat_id, status, str(e))
+                    return status
+                except (TimedOut, NetworkError) as e:
+                    attempt += 1
+                    if attempt >= self.max_retries:
+                        self.logger.error(f"Broadcast to {chat_id} failed: {e}")
+                        return False
+                    time.sleep(2 ** attempt)
+                except Exception as e:
+                    self.logger.error(f"Broadcast to {chat_id} failed: {e}")
+                    return False
+        return True
+
+    def _mark_unreachable(self, chat_id, status, reason):
+        if self.on_unreachable is None:
+            return
+        try:
+            self.on_unreachable(chat_id, status, reason)
+        except Exception as e:
+            self.logger.error(f"Failed to record delivery state for {chat_id}: {e}")
+
+    def _report(self, job, final=False):
+        """Edit the admin's status message with the job's progress."""
+        if not job.get("status_message_id") or self.bot is None:
+            return
+        total = len(job["recipients"])
+        done = job["cursor"]
+        percent = done * 100 // total if total else 100
+        if final:
+            text = (f"✅ {job['title']} ارسال شد.\n\n"
+                    f"📊 آمار ارسال:\n"
+                    f"✅ موفق: {job['success']}\n"
+                    f"❌ ناموفق: {job['failed']}\n"
+                    f"🚫 غیرقابل دسترس: {job.get('unreachable', 0)}\n"
+                    f"📋 کل: {total}")
+        else:
+            text = (f"🔄 در حال ارسال {job['title']}... {done}/{total} ({percent}%)\n\n"
+                    f"✅ موفق: {job['success']}\n"
+                    f"❌ ناموفق: {job['failed']}\n"
+                    f"🚫 غیرقابل دسترس: {job.get('unreachable', 0)}")
+        try:
+            self.bot.edit_message_text(chat_id=job["status_chat_id"],
+                                       message_id=job["status_message_id"],
+                                       text=text)
+        except Exception as e:
+            self.logger.debug(f"Could not update broadcast status message: {e}")
+
+    def _load_state(self):
+        """Load unfinished jobs from the state file."""
+        if not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                self.jobs.extend(json.load(f))
+        except Exception as e:
+            self.logger.error(f"Failed to load broadcast state: {e}")
+
+    def _save_state(self):
+        """Write unfinished jobs (with their cursors) to the state file."""
+        with self._condition:
+            jobs = [dict(job) for job in self.jobs]
+        temp_path = f"{self.state_file}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(jobs, f, ensure_ascii=False)
+            os.replace(temp_path, self.state_file)
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to save broadcast state: {e}")
+            return False
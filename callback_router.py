@@ -0,0 +1,200 @@
+import base64
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+CALLBACK_VERSION = 1
+CALLBACK_MAX_BYTES = 64  # Telegram limit for callback_data
+CALLBACK_MARK = '~'
+CALLBACK_SEP = '|'
+OVERFLOW_LIMIT = 4096
+
+CallbackAction = namedtuple('CallbackAction', 'action args')
+
+# Arguments of buttons that do not fit in 64 bytes, keyed by a short hash
+_overflow = OrderedDict()
+_overflow_lock = threading.Lock()
+
+
+class ExpiredCallback(Exception):
+    """Callback data written by another codec version or pointing at forgotten arguments."""
+
+
+def encode_callback(action, *args):
+    """
+    Build compact callback data: ``~1|action|arg1|arg2``.
+
+    Arguments are stored as strings, so values such as country keys with underscores
+    are passed through unchanged. When the result would exceed Telegram's 64 byte
+    limit (or an argument contains the separator) the arguments are kept in memory and
+    the button carries a short reference to them instead.
+
+    Returns:
+        str: Callback data of at most CALLBACK_MAX_BYTES bytes
+    """
+    args = tuple(str(arg) for arg in args)
+    head = f"{CALLBACK_MARK}{CALLBACK_VERSION}{CALLBACK_SEP}{action}"
+    data = CALLBACK_SEP.join((head, ) + args)
+    if len(data.encode('utf-8')) <= CALLBACK_MAX_BYTES and not any(CALLBACK_SEP in arg for arg in args):
+        return data
+
+    # The reference is derived from the content so re-rendering the same button
+    # (e.g. from a cached keyboard) reuses the same entry
+    digest = hashlib.blake2b("\0".join((action, ) + args).encode('utf-8'), digest_size=6).digest()
+    ref = base64.urlsafe_b64encode(digest).decode('ascii')
+    with _overflow_lock:
+        _overflow[ref] = args
+        _overflow.move_to_end(ref)
+        while len(_overflow) > OVERFLOW_LIMIT:
+            _overflow.popitem(last=False)
+    return f"{head}{CALLBACK_SEP}#{ref}"
+
+
+def decode_callback(data):
+    """
+    Parse callback data created by encode_callback.
+
+    Returns:
+        CallbackAction: (action, args) or None for legacy ``prefix_value`` data
+
+    Raises:
+        ExpiredCallback: Data from an unknown codec version or an unknown reference
+    """
+    if not data or not data.startswith(CALLBACK_MARK):
+        return None
+    head, _, rest = data[len(CALLBACK_MARK):].partition(CALLBACK_SEP)
+    if head != str(CALLBACK_VERSION):
+        raise ExpiredCallback(data)
+    action, _, rest = rest.partition(CALLBACK_SEP)
+    args = tuple(rest.split(CALLBACK_SEP)) if rest else ()
+    if len(args) == 1 and args[0].startswith('#'):
+        with _overflow_lock:
+            args = _overflow.get(args[0][1:])
+        if args is None:
+            raise ExpiredCallback(data)
+    return CallbackAction(action, args)
+
+
+def callback_args(data, legacy_prefix):
+    """
+    Arguments of a button in either format.
+
+    Returns:
+        tuple: Decoded arguments for codec data; for legacy data the text after
+            legacy_prefix as a single argument (empty if the prefix does not match)
+    """
+    decoded = decode_callback(data)
+    if decoded is not None:
+        return decoded.args
+    return (data[len(legacy_prefix):], ) if data.startswith(legacy_prefix) else ()
+
+
+class CallbackRouter:
+    def __init__(self, expired_text="⌛️ این دکمه منقضی شده است، لطفاً منو را دوباره باز کنید."):
+        """
+        Route every callback query through dictionary lookups instead of a chain of
+        regex CallbackQueryHandlers.
+
+        Codec data (encode_callback) is routed by its action name. Legacy data is
+        matched exactly first and then against registered ``prefix_`` routes from the
+        longest candidate down, so ``country_page_`` always wins over ``country_``
+        regardless of registration order. Time spent in each route is recorded.
+
+        Args:
+            expired_text (str): Answer shown for buttons from an older codec version
+        """
+        self.expired_text = expired_text
+        self._exact = {}
+        self._prefixes = {}
+        self._actions = {}
+        self._stats = {}  # route -> [calls, total seconds, max seconds]
+        self._stats_lock = threading.Lock()
+        self.logger = logging.getLogger('callback_router')
+
+    def exact(self, data, handler):
+        """Route callback data equal to data."""
+        self._exact[data] = handler
+
+    def prefix(self, prefix, handler):
+        """Route legacy callback data starting with prefix (which must end with '_')."""
+        if not prefix.endswith('_'):
+            raise ValueError("prefix routes must end with '_'")
+        self._prefixes[prefix] = handler
+
+    def action(self, name, handler):
+        """Route codec callback data with the given action name."""
+        self._actions[name] = handler
+
+    def resolve(self, data):
+        """
+        Returns:
+            tuple: (route name, handler) or (None, None) if nothing matches
+
+        Raises:
+            ExpiredCallback: See decode_callback
+        """
+        decoded = decode_callback(data)
+        if decoded is not None:
+            handler = self._actions.get(decoded.action)
+            return (decoded.action, handler) if handler else (None, None)
+
+        handler = self._exact.get(data)
+        if handler is not None:
+            return data, handler
+        end = data.rfind('_')
+        while end >= 0:
+            prefix = data[:end + 1]
+            handler = self._prefixes.get(prefix)
+            if handler is not None:
+                return prefix, handler
+            end = data.rfind('_', 0, end)
+        return None, None
+
+    def dispatch(self, update, context):
+        """Callback for a single CallbackQueryHandler that receives every button press."""
+        query = update.callback_query
+        try:
+            route, handler = self.resolve(query.data or '')
+        except ExpiredCallback:
+            query.answer(self.expired_text, show_alert=True)
+            return
+        if handler is None:
+            self.logger.debug(f"No route for callback data: {query.data}")
+            query.answer()
+            return
+
+        start = time.perf_counter()
+        try:
+            return handler(update, context)
+        finally:
+            self._record(route, time.perf_counter() - start)
+
+    def _record(self, route, elapsed):
+        with self._stats_lock:
+            stats = self._stats.get(route)
+            if stats is None:
+                self._stats[route] = [1, elapsed, elapsed]
+            else:
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] = max(stats[2], elapsed)
+
+    def latency_stats(self):
+        """
+        Returns:
+            dict: route -> {calls, avg_ms, max_ms, total_ms}, slowest total first
+        """
+        with self._stats_lock:
+            items = [(route, list(stats)) for route, stats in self._stats.items()]
+        items.sort(key=lambda item: item[1][1], reverse=True)
+        return {
+            route: {
+                "calls": calls,
+                "avg_ms": round(total * 1000 / calls, 1),
+                "max_ms": round(peak * 1000, 1),
+                "total_ms": round(total * 1000, 1),
+            }
+            for route, (calls, total, peak) in items
+        }
@@ -0,0 +1,113 @@
+"""داده‌های ثابت کشورها که بین ماژول‌های ربات مشترک است"""
+
+from typing import Optional
+
+# نگاشت کشورهای خاص به کد ISO (در IPProcessor و ایندکس نام‌های مستعار DBManager)
+SPECIAL_COUNTRY_CODES = {
+    "Qatar": "QA", "UAE": "AE", "United Arab Emirates": "AE",
+    "Saudi Arabia": "SA", "Saudi": "SA", "KSA": "SA",
+    "Iran": "IR", "Iraq": "IQ", "Kuwait": "KW", 
+    "Bahrain": "BH", "Oman": "OM", "Egypt": "EG", 
+    "Turkey": "TR", "Russia": "RU", "United States": "US", 
+    "USA": "US", "Germany": "DE", "United Kingdom": "GB", 
+    "UK": "GB", "France": "FR", "China": "CN", 
+    "India": "IN", "Japan": "JP", "Canada": "CA", 
+    "Pakistan": "PK", "Georgia": "GE"
+}
+
+# نام فارسی کشورها -> نام انگلیسی (برای جستجو)
+PERSIAN_COUNTRY_NAMES = {
+    "ایران": "Iran",
+    "عربستان": "Saudi Arabia", "عربستان سعودی": "Saudi Arabia", "سعودی": "Saudi Arabia",
+    "آمریکا": "United States", "امریکا": "United States",
+    "انگلیس": "United Kingdom", "انگلستان": "United Kingdom", "آلمان": "Germany", "روسیه": "Russia",
+    "فرانسه": "France", "چین": "China", "هند": "India", "ژاپن": "Japan", "کانادا": "Canada",
+    "پاکستان": "Pakistan", "قطر": "Qatar", "امارات": "UAE", "عراق": "Iraq", "کویت": "Kuwait",
+    "بحرین": "Bahrain", "عمان": "Oman", "مصر": "Egypt", "ترکیه": "Turkey", "گرجستان": "Georgia"
+}
+
+# نام نمایشی قاره‌ها
+CONTINENT_MAP = {
+    'AS': 'آسیا 🌏', 'EU': 'اروپا 🇪🇺', 'AF': 'آفریقا 🌍',
+    'NA': 'آمریکای شمالی 🌎', 'SA': 'آمریکای جنوبی 🌎',
+    'OC': 'اقیانوسیه 🏝️', 'AN': 'جنوبگان 🏔️'
+}
+
+# کد کشور -> کد قاره (شامل کلیدهای قدیمی عربستان)
+COUNTRY_TO_CONTINENT = {
+    # آسیا - Asia
+    'IR': 'AS', 'SA': 'AS', 'AE': 'AS', 'QA': 'AS', 'TR': 'AS', 'IQ': 'AS',
+    'KW': 'AS', 'OM': 'AS', 'BH': 'AS', 'CN': 'AS', 'JP': 'AS', 'ID': 'AS',
+    'IN': 'AS', 'KR': 'AS', 'SG': 'AS', 'PK': 'AS', 'MY': 'AS', 'TH': 'AS',
+    'KSA': 'AS', 'SAUDI': 'AS', 'SAUDI ARABIA': 'AS', 'SAUDI_ARABIA': 'AS',
+    'GE': 'AS', 'IL': 'AS', 'JO': 'AS', 'LB': 'AS', 'SY': 'AS',
+    'AF': 'AS', 'BD': 'AS', 'LK': 'AS', 'NP': 'AS', 'VN': 'AS', 'HK': 'AS',
+    'YE': 'AS', 'UZ': 'AS', 'TW': 'AS', 'TJ': 'AS', 'TM': 'AS', 'KZ': 'AS',
+    'KG': 'AS', 'MO': 'AS', 'LA': 'AS', 'KH': 'AS', 'MM': 'AS', 'MN': 'AS',
+    'MV': 'AS', 'BT': 'AS', 'BN': 'AS', 'TL': 'AS', 'PS': 'AS', 'PH': 'AS',
+   
+    # اروپا - Europe
+    'DE': 'EU', 'GB': 'EU', 'FR': 'EU', 'IT': 'EU', 'ES': 'EU', 'RU': 'EU',
+    'NL': 'EU', 'CH': 'EU', 'SE': 'EU', 'PL': 'EU', 'BE': 'EU', 'AT': 'EU',
+    'NO': 'EU', 'DK': 'EU', 'FI': 'EU', 'PT': 'EU', 'IE': 'EU', 'GR': 'EU',
+    'UA': 'EU', 'CZ': 'EU', 'RO': 'EU', 'BG': 'EU', 'HU': 'EU', 'HR': 'EU',
+    'RS': 'EU', 'SK': 'EU', 'SI': 'EU', 'EE': 'EU', 'LV': 'EU', 'LT': 'EU',
+    'IS': 'EU', 'LU': 'EU', 'MT': 'EU', 'CY': 'EU', 'ME': 'EU', 'MK': 'EU',
+    'AL': 'EU', 'BA': 'EU', 'MD': 'EU', 'MC': 'EU', 'LI': 'EU', 'SM': 'EU',
+    'VA': 'EU', 'BY': 'EU', 'GI': 'EU', 'JE': 'EU', 'IM': 'EU', 'FO': 'EU',
+   
+    # آفریقا - Africa
+    'EG': 'AF', 'ZA': 'AF', 'NG': 'AF', 'MA': 'AF', 'KE': 'AF', 'TN': 'AF',
+    'DZ': 'AF', 'GH': 'AF', 'CM': 'AF', 'CI': 'AF', 'LY': 'AF', 'SD': 'AF',
+    'ET': 'AF', 'AO': 'AF', 'TZ': 'AF', 'UG': 'AF', 'ZM': 'AF', 'ZW': 'AF',
+    'SN': 'AF', 'ML': 'AF', 'MR': 'AF', 'NE': 'AF', 'TD': 'AF', 'SO': 'AF',
+    'MG': 'AF', 'RW': 'AF', 'BF': 'AF', 'GA': 'AF', 'BJ': 'AF', 'BI': 'AF',
+    'DJ': 'AF', 'ER': 'AF', 'GM': 'AF', 'GN': 'AF', 'GQ': 'AF', 'GW': 'AF',
+    'LR': 'AF', 'LS': 'AF', 'MW': 'AF', 'MU': 'AF', 'MZ': 'AF', 'NA': 'AF',
+    'SC': 'AF', 'SL': 'AF', 'SS': 'AF', 'ST': 'AF', 'SZ': 'AF', 'TG': 'AF',
+   
+    # آمریکای شمالی - North America
+    'US': 'NA', 'CA': 'NA', 'MX': 'NA', 'PA': 'NA', 'CR': 'NA', 'CU': 'NA',
+    'DO': 'NA', 'GT': 'NA', 'HN': 'NA', 'SV': 'NA', 'NI': 'NA', 'JM': 'NA',
+    'HT': 'NA', 'BS': 'NA', 'TT': 'NA', 'BB': 'NA', 'BZ': 'NA', 'PR': 'NA',
+    'DM': 'NA', 'LC': 'NA', 'VC': 'NA', 'AG': 'NA', 'KN': 'NA', 'GD': 'NA',
+   
+    # آمریکای جنوبی - South America
+    'BR': 'SA', 'AR': 'SA', 'CL': 'SA', 'CO': 'SA', 'PE': 'SA', 'VE': 'SA',
+    'EC': 'SA', 'BO': 'SA', 'PY': 'SA', 'UY': 'SA', 'GY': 'SA', 'SR': 'SA',
+    'FK': 'SA', 'GF': 'SA',
+   
+    # اقیانوسیه - Oceania
+    'AU': 'OC', 'NZ': 'OC', 'FJ': 'OC', 'PG': 'OC', 'SB': 'OC', 'VU': 'OC',
+    'KI': 'OC', 'MH': 'OC', 'WS': 'OC', 'TO': 'OC', 'TV': 'OC', 'NR': 'OC',
+    'PW': 'OC', 'FM': 'OC', 'PF': 'OC', 'NC': 'OC', 'AS': 'OC', 'CK': 'OC',
+    'GU': 'OC', 'MP': 'OC', 'NU': 'OC', 'NF': 'OC', 'TK': 'OC', 'WF': 'OC',
+   
+    # جنوبگان - Antarctica
+    'AQ': 'AN', 'BV': 'AN', 'GS': 'AN', 'HM': 'AN', 'TF': 'AN'
+}
+
+
+def _build_continent_countries():
+    countries = {continent: [] for continent in CONTINENT_MAP}
+    for country_code, continent in COUNTRY_TO_CONTINENT.items():
+        countries[continent].append(country_code)
+    return {continent: tuple(codes) for continent, codes in countries.items()}
+
+
+# ایندکس معکوس: کد قاره -> کدهای کشورهای آن (یک بار هنگام import ساخته می‌شود)
+CONTINENT_COUNTRIES = _build_continent_countries()
+
+
+def country_flag(country_code: str) -> str:
+    """ساخت ایموجی پرچم از کد ISO دو حرفی (برای کد نامعتبر پرچم سفید)"""
+    if country_code and len(country_code) == 2 and country_code.isascii() and country_code.isalpha():
+        return "".join(chr(ord(c) + 127397) for c in country_code.upper())
+    return "🏳️"
+
+
+def flag_country_code(flag: str) -> Optional[str]:
+    """کد ISO دو حرفی از ایموجی پرچم (عکس country_flag)؛ None برای پرچم‌های دیگر"""
+    if flag and len(flag) == 2 and all(0x1F1E6 <= ord(c) <= 0x1F1FF for c in flag):
+        return "".join(chr(ord(c) - 127397) for c in flag)
+    return None
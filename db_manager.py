@@ -1,16 +1,122 @@
+import os
 import pickle
 from typing import Dict, Set, List, Tuple, Optional
 from collections import defaultdict, deque
+from itertools import islice
+import threading
 import time
 
+from save_scheduler import SaveScheduler
+from ip_storage import PackedIPv4List, pack_ip_list, ip_index_key, int_to_ip
+from country_data import (SPECIAL_COUNTRY_CODES, PERSIAN_COUNTRY_NAMES, COUNTRY_TO_CONTINENT,
+                          flag_country_code)
+from search_index import IPv4PrefixTrie, CountryTokenIndex
+from snapshot_file import SnapshotCorrupted, read_snapshot, write_snapshot
+
 
 import pickle
 from typing import Dict, List, Tuple, Set
 from collections import deque
 
+DB_FILE = 'bot_database.pkl'
+JOURNAL_FILE = 'bot_database.journal'  # ژورنال افزایشی تغییرات (حالت journal)
+
+# وضعیت‌های تحویل پیام که کاربر را از ارسال‌های همگانی بعدی کنار می‌گذارند
+DELIVERY_BLOCKED = 'blocked'  # ربات توسط کاربر مسدود شده است
+DELIVERY_CHAT_NOT_FOUND = 'chat_not_found'  # گفتگو با کاربر وجود ندارد
+DELIVERY_DEACTIVATED = 'deactivated'  # حساب تلگرام کاربر حذف شده است
+
+# رکوردهای ژورنال که فهرست کشورها (و در نتیجه منوهای کشور) را تغییر می‌دهند
+CATALOG_OPS = {'country', 'ip_add', 'ip_add_many', 'ip_del'}
+CATALOG_ATTRS = {'ipv4_data', 'disabled_locations'}
+
+# کلیدهای مختلفی که برای عربستان در داده‌های قدیمی استفاده شده‌اند
+SAUDI_KEYS = ['sa', 'ksa', 'saudi', 'saudi_arabia', 'saudiarabia', 'kingdomofsaudiarabia', 'ksaudi', 'saudi arabia']
+
+
+def normalize_country_key(country_name: str) -> str:
+    """تبدیل نام کشور به کلید استاندارد ذخیره‌سازی"""
+    return country_name.lower().replace(' ', '_')
+
+
+def is_saudi_name(country_name: str) -> bool:
+    """تشخیص نام‌های مختلف عربستان (انگلیسی و فارسی)"""
+    country_name_lower = country_name.lower()
+    return 'saudi' in country_name_lower or 'عربستان' in country_name_lower or 'سعودی' in country_name_lower
+
+
+def _build_country_aliases() -> Dict[str, str]:
+    aliases = {}
+    for name, code in SPECIAL_COUNTRY_CODES.items():
+        aliases[normalize_country_key(name)] = code
+        aliases[code.lower()] = code
+    for key in SAUDI_KEYS:
+        aliases[normalize_country_key(key)] = 'SA'
+    return aliases
+
+
+# نام مستعار نرمال‌شده -> کد ISO (مثلاً uae و united_arab_emirates -> AE)
+COUNTRY_ALIASES = _build_country_aliases()
+
+
+def country_group(country_name: str) -> str:
+    """شناسه یکسان برای تمام نام‌های مستعار یک کشور"""
+    key = normalize_country_key(country_name)
+    return COUNTRY_ALIASES.get(key, key)
+
+
+def _build_search_aliases() -> Dict[str, List[str]]:
+    aliases: Dict[str, List[str]] = {}
+    for alias, group in COUNTRY_ALIASES.items():
+        aliases.setdefault(group, []).append(alias)
+    for persian_name, english_name in PERSIAN_COUNTRY_NAMES.items():
+        aliases.setdefault(country_group(english_name), []).append(persian_name)
+    return aliases
+
+
+# شناسه کشور -> نام‌های مستعار انگلیسی و فارسی برای ایندکس جستجو
+COUNTRY_SEARCH_ALIASES = _build_search_aliases()
+
+
+def country_search_aliases(country_code: str, name: str) -> List[str]:
+    """نام‌های مستعاری که جستجوی آن‌ها باید به این کشور برسد"""
+    groups = {country_group(country_code), country_group(name)}
+    if is_saudi_name(name):
+        groups.add('SA')
+    return [alias for group in groups for alias in COUNTRY_SEARCH_ALIASES.get(group, ())]
+
+
+def country_continent(country_code: str, name: str = "", flag: str = "") -> Optional[str]:
+    """کد قاره یک کشور از روی پرچم، کلید یا نام آن (None اگر ناشناخته باشد)"""
+    if is_saudi_name(name):
+        return COUNTRY_TO_CONTINENT['SA']
+    for candidate in (flag_country_code(flag), country_code, country_group(country_code), country_group(name)):
+        continent = COUNTRY_TO_CONTINENT.get(candidate.upper()) if candidate else None
+        if continent:
+            return continent
+    return None
+
+
 class DBManager:
 
-    def __init__(self):
+    def __init__(self,
+                 storage_mode: str = "snapshot",
+                 compact_threshold: int = 5000,
+                 save_interval: float = 0,
+                 compact_ips: bool = False,
+                 load: bool = True):
+        """
+        Args:
+            storage_mode (str): "snapshot" برای ذخیره کامل در هر تغییر، "journal"
+                برای افزودن رکورد تغییر به ژورنال و فشرده‌سازی دوره‌ای در اسنپ‌شات
+            compact_threshold (int): تعداد رکوردهای ژورنال پیش از ادغام در اسنپ‌شات
+            save_interval (float): اگر بزرگ‌تر از صفر باشد حالت write-behind فعال می‌شود و
+                تغییرات حداکثر یک بار در هر بازه (ثانیه) در پس‌زمینه ذخیره می‌شوند
+            compact_ips (bool): نگهداری آدرس‌های هر کشور به صورت اعداد ۴ بایتی
+                (PackedIPv4List) به جای لیست رشته‌ها برای کاهش حافظه و حجم اسنپ‌شات
+            load (bool): بارگذاری فایل پایگاه داده؛ False برای نمونه خالی بدون فایل
+                (مثلاً برای خواندن بکاپ‌ها در SQLiteDBManager)
+        """
         self.active_codes: Dict[str, Dict[str, any]] = {
         }  # code -> {type: str, tokens: int, used_count: int, created_at: time, users: list}
         self.active_users: Dict[int, Dict[str, any]] = {
@@ -18,101 +124,557 @@ class DBManager:
         self.ipv4_data: Dict[str, Tuple[str, str, List[str]]] = {
         }  # country_code -> (name, flag, [ips])
         self.disabled_users: Set[int] = set()  # مجموعه کاربران غیرفعال
+        self.delivery_state: Dict[int, Dict[str, any]] = {
+        }  # user_id -> {status: str, reason: str, since: time} برای کاربران غیرقابل دسترس
         self.disabled_locations: Dict[str, bool] = {}  # کشورهای غیرفعال شده
         self.wg_endpoints: list = []
         self.last_added_ips = deque(maxlen=20)  # آخرین IPهای اضافه شده
-        self.load_database()
+        self.storage_mode = storage_mode
+        self.compact_threshold = compact_threshold
+        self.compact_ips = compact_ips
+        # کلید ایندکس‌ها در هر دو حالت: عدد صحیح برای IPv4 (هم‌خوان با مقادیر درخت پیشوندی و
+        # مستقل از شکل نوشتاری مانند 5.2.3.04) و خود رشته برای سایر آدرس‌ها
+        self._ip_key = ip_index_key
+        self._journal_seq = 0  # شماره آخرین رکورد ژورنال که در وضعیت فعلی اعمال شده
+        self._journal_records = 0  # تعداد رکوردهای ژورنال از آخرین اسنپ‌شات
+        self._journal_file = None
+        self._io_lock = threading.RLock()  # هماهنگی نوشتن فایل‌ها با نخ ذخیره‌ساز
+        self._scheduler = None
+        self._ip_sets: Dict[str, Set[str]] = {}  # country_code -> set(ips) برای بررسی عضویت O(1)
+        # ip -> کشورهای دارای IP به ترتیب افزودن (یک IP ممکن است در چند کشور ثبت شده باشد)
+        self._ip_owners: Dict[str, List[str]] = {}
+        self._country_index: Dict[str, str] = {}  # country_group -> country_code
+        self._ip_trie = IPv4PrefixTrie()  # آدرس‌ها به ترتیب اکتت‌ها برای جستجوی پیشوندی
+        self._country_tokens = CountryTokenIndex()  # کلمات نام/کد/نام مستعار -> کشورها
+        self._continent_counts: Dict[str, Dict[str, int]] = {}  # continent -> {country_code: ip_count}
+        self._continent_ranked: Dict[str, List[Tuple[str, int]]] = {}  # continent -> مرتب بر اساس تعداد IP
+        self._country_continent: Dict[str, Optional[str]] = {}  # country_code -> continent
+        self.catalog_version = 0  # با هر تغییر کشورها/IPها/لوکیشن‌ها افزایش می‌یابد (برای کش‌ها)
+        if load:
+            self.load_database()
+
+        if save_interval > 0:
+            self._scheduler = SaveScheduler(self._flush_pending, save_interval)
+            self._scheduler.start()
 
     def load_database(self):
         try:
-            with open('bot_database.pkl', 'rb') as f:
-                data = pickle.load(f)
-                self.active_codes = data.get('active_codes', {})
-                self.active_users = data.get('active_users', {})
-                self.ipv4_data = data.get('ipv4_data', {})
-                self.disabled_users = data.get('disabled_users', set())
-                self.disabled_locations = data.get('disabled_locations', {})
-                self.wg_endpoints = data.get('wg_endpoints', [])
-                self.last_added_ips = data.get('last_added_ips', deque(maxlen=20))
-
-                # اضافه کردن فیلدهای جدید به کدهای فعالسازی موجود
-                for code in self.active_codes:
-                    if 'used_count' not in self.active_codes[code]:
-                        self.active_codes[code]['used_count'] = 0
-                    if 'created_at' not in self.active_codes[code]:
-                        self.active_codes[code]['created_at'] = time.time()
-                    if 'users' not in self.active_codes[code]:
-                        self.active_codes[code]['users'] = []
-
-                # اضافه کردن فیلدهای جدید به کاربران فعال موجود
-                for user_id in self.active_users:
-                    if 'joined_date' not in self.active_users[user_id]:
-                        self.active_users[user_id]['joined_date'] = "نامشخص"
-                    if 'activation_code' not in self.active_users[user_id]:
-                        self.active_users[user_id]['activation_code'] = "نامشخص"
+            self._apply_snapshot(read_snapshot(DB_FILE))
+        except SnapshotCorrupted as e:
+            # فایل آسیب‌دیده کنار گذاشته می‌شود تا با اولین ذخیره بازنویسی نشود
+            corrupt_path = f"{DB_FILE}.corrupt-{int(time.time())}"
+            print(f"فایل پایگاه داده آسیب دیده است ({e})، به {corrupt_path} منتقل شد")
+            os.replace(DB_FILE, corrupt_path)
         except Exception as e:
             print(f"خطا در بارگذاری پایگاه داده: {e}")
 
-    def save_database(self):
-        """ذخیره پایگاه داده"""
+        self._convert_ip_storage()
+        self.rebuild_indexes()
+        # ژورنال باقی‌مانده در حالت snapshot هم اعمال می‌شود (مثلاً پس از بازگشت از حالت journal)
+        self._replay_journal()
+
+        # کشورهایی که در داده‌های قدیمی با نام‌های مستعار مختلف ذخیره شده‌اند یک بار ادغام می‌شوند
+        if self._merge_duplicate_countries():
+            self.rebuild_indexes()
+            self.save_database()
+
+    def _apply_snapshot(self, data: dict):
+        """جایگزینی داده‌های حافظه با محتوای یک اسنپ‌شات (بدون بازسازی ایندکس‌ها)"""
+        self.active_codes = data.get('active_codes', {})
+        self.active_users = data.get('active_users', {})
+        self.ipv4_data = data.get('ipv4_data', {})
+        self.disabled_users = data.get('disabled_users', set())
+        self.delivery_state = data.get('delivery_state', {})
+        self.disabled_locations = data.get('disabled_locations', {})
+        self.wg_endpoints = data.get('wg_endpoints', [])
+        self.last_added_ips = data.get('last_added_ips', deque(maxlen=20))
+        self._journal_seq = data.get('journal_seq', 0)
+
+        # اضافه کردن فیلدهای جدید به کدهای فعالسازی موجود
+        for code in self.active_codes:
+            if 'used_count' not in self.active_codes[code]:
+                self.active_codes[code]['used_count'] = 0
+            if 'created_at' not in self.active_codes[code]:
+                self.active_codes[code]['created_at'] = time.time()
+            if 'users' not in self.active_codes[code]:
+                self.active_codes[code]['users'] = []
+
+        # اضافه کردن فیلدهای جدید به کاربران فعال موجود
+        for user_id in self.active_users:
+            if 'joined_date' not in self.active_users[user_id]:
+                self.active_users[user_id]['joined_date'] = "نامشخص"
+            if 'activation_code' not in self.active_users[user_id]:
+                self.active_users[user_id]['activation_code'] = "نامشخص"
+
+    def staged_copy(self, path: str, journal_path: Optional[str] = None) -> 'DBManager':
+        """
+        نمونه موقتی با تنظیمات این نمونه و داده‌های یک فایل اسنپ‌شات (و ژورنال آن)
+        که همه ایندکس‌هایش از نو ساخته شده‌اند؛ داده‌ها و ایندکس‌های فعلی تغییر نمی‌کنند.
+
+        Raises:
+            SnapshotCorrupted, OSError, ValueError: فایل معتبر نیست
+        """
+        data = read_snapshot(path)
+        if not isinstance(data, dict):
+            raise ValueError(f"قالب ناشناخته: {type(data).__name__}")
+
+        staged = DBManager.__new__(DBManager)
+        staged.__dict__.update(self.__dict__)
+        staged._apply_snapshot(data)
+        staged._convert_ip_storage()
+        # ایندکس‌ها پیش از اعمال ژورنال از نو ساخته می‌شوند تا ایندکس‌های مشترک با این نمونه تغییر نکنند
+        staged.rebuild_indexes()
+        if journal_path:
+            staged._apply_journal(journal_path)
+        if staged._merge_duplicate_countries():
+            staged.rebuild_indexes()
+        return staged
+
+    def restore_snapshot(self, path: str = DB_FILE, journal_path: Optional[str] = None) -> bool:
+        """
+        بازیابی داده‌ها از یک فایل اسنپ‌شات (مثلاً بکاپ) بدون راه‌اندازی مجدد ربات.
+        اگر journal_path داده شود رکوردهای آن (بکاپ افزایشی) روی اسنپ‌شات اعمال می‌شوند.
+
+        داده‌ها و همه ایندکس‌ها روی یک نمونه موقت ساخته می‌شوند و سپس در یک مرحله
+        جایگزین وضعیت فعلی می‌شوند، پس درخواست‌های همزمان یا وضعیت کامل قبلی را می‌بینند
+        یا وضعیت کامل جدید را. وضعیت بازیابی‌شده بلافاصله به عنوان اسنپ‌شات ذخیره
+        (و ژورنال خالی) می‌شود تا ذخیره‌های بعدی آن را بازنویسی نکنند.
+
+        Returns:
+            bool: False اگر فایل معتبر نباشد (داده‌های فعلی دست نمی‌خورند)
+        """
         try:
-            with open('bot_database.pkl', 'wb') as f:
-                pickle.dump({
-                    'active_codes': self.active_codes,
-                    'active_users': self.active_users,
-                    'ipv4_data': self.ipv4_data,
-                    'disabled_users': self.disabled_users,
-                    'disabled_locations': self.disabled_locations,
-                    'wg_endpoints': self.wg_endpoints,
-                    'last_added_ips': self.last_added_ips
-                }, f)
+            staged = self.staged_copy(path, journal_path)
         except Exception as e:
-            print(f"خطا در ذخیره پایگاه داده: {e}")
+            print(f"فایل اسنپ‌شات معتبر نیست: {e}")
+            return False
 
-    def get_endpoints(self):
-        """دریافت لیست endpoint های وایرگارد"""
-        return self.wg_endpoints
+        # فقط ویژگی‌هایی که در نمونه موقت از نو ساخته شده‌اند جایگزین می‌شوند
+        fields = {name: value for name, value in staged.__dict__.items()
+                  if name != 'catalog_version' and self.__dict__.get(name) is not value}
+        with self._io_lock:
+            self.__dict__.update(fields)
+            self.catalog_version += 1
+            return self.save_database()
+
+    def _make_ip_list(self, ips=()):
+        """ساخت لیست آدرس‌های یک کشور مطابق حالت ذخیره‌سازی (فشرده یا معمولی)"""
+        if self.compact_ips:
+            return pack_ip_list(ips)
+        return list(ips)
+
+    def _convert_ip_storage(self):
+        """تبدیل لیست‌های بارگذاری‌شده به قالب حالت فعلی (فشرده یا معمولی)"""
+        for country_code, (name, flag, ips) in list(self.ipv4_data.items()):
+            if isinstance(ips, PackedIPv4List) != self.compact_ips:
+                self.ipv4_data[country_code] = (name, flag, self._make_ip_list(ips))
+
+    def rebuild_indexes(self):
+        """بازسازی ایندکس‌های حافظه از روی ipv4_data (پس از بارگذاری یا تغییر مستقیم داده‌ها)"""
+        self._ip_sets = {}
+        self._ip_owners = {}
+        self._ip_trie = IPv4PrefixTrie()
+        self._continent_counts = {}
+        self._continent_ranked = {}
+        self._country_continent = {}
+        for country_code in self.ipv4_data:
+            self._index_country(country_code)
+        self._rebuild_country_index()
+        self.catalog_version += 1
+
+    def _rebuild_country_index(self):
+        self._country_index = {}
+        self._country_tokens = CountryTokenIndex()
+        for country_code in self.ipv4_data:
+            self._register_country(country_code)
+
+    def _register_country(self, country_code: str):
+        """ثبت کلید و نام کشور در ایندکس نام‌های مستعار (اولین کشور ثبت‌شده اولویت دارد)"""
+        name = self.ipv4_data[country_code][0]
+        for alias in (country_code, name):
+            group = country_group(alias)
+            if self._country_index.get(group) not in self.ipv4_data:
+                self._country_index[group] = country_code
+        self._country_tokens.add(country_code, name, country_search_aliases(country_code, name))
+
+    def _merge_duplicate_countries(self) -> bool:
+        """
+        ادغام کشورهایی که با کلیدهای مستعار مختلف ذخیره شده‌اند (مانند KSA و SA).
+
+        Returns:
+            bool: True اگر داده‌ای ادغام شده باشد
+        """
+        groups: Dict[str, List[str]] = {}
+        for country_code, (name, _, _) in self.ipv4_data.items():
+            group = 'SA' if is_saudi_name(name) else country_group(country_code)
+            groups.setdefault(group, []).append(country_code)
+
+        merged = False
+        for group, codes in groups.items():
+            # کلید استاندارد عربستان همیشه SA است
+            target = 'SA' if group == 'SA' else codes[0]
+            if codes == [target]:
+                continue
+            name, flag, _ = self.ipv4_data.get(target, self.ipv4_data[codes[0]])
+            if target in codes:
+                codes.remove(target)
+                codes.insert(0, target)
+            merged_ips = list(dict.fromkeys(ip for code in codes for ip in self.ipv4_data[code][2]))
+            for code in codes:
+                del self.ipv4_data[code]
+            self.ipv4_data[target] = (name, flag, self._make_ip_list(merged_ips))
+            print(f"کشورهای {', '.join(c for c in codes if c != target)} با {target} ادغام شدند")
+            merged = True
+        return merged
+
+    def _index_country(self, country_code: str):
+        ips = self.ipv4_data[country_code][2]
+        if self.compact_ips and isinstance(ips, PackedIPv4List):
+            keys = set(ips.int_values())
+        else:
+            keys = {self._ip_key(ip) for ip in ips}
+        self._ip_sets[country_code] = keys
+        for key in keys:
+            self._claim_ip(key, country_code)
+        self._update_continent_count(country_code)
+
+    def _unindex_country(self, country_code: str):
+        for key in self._ip_sets.pop(country_code, ()):
+            self._release_ip(key, country_code)
+        self._update_continent_count(country_code)
+        self._country_continent.pop(country_code, None)
+
+    def _update_continent_count(self, country_code: str):
+        """به‌روزرسانی تعداد IP کشور در آمار قاره آن (پس از هر افزودن/حذف)"""
+        if country_code not in self._country_continent:
+            name, flag, _ = self.ipv4_data.get(country_code, ("", "", None))
+            self._country_continent[country_code] = country_continent(country_code, name, flag)
+        continent = self._country_continent[country_code]
+        if continent is None:
+            return
+        counts = self._continent_counts.setdefault(continent, {})
+        count = len(self._ip_sets.get(country_code, ()))
+        if count:
+            counts[country_code] = count
+        else:
+            counts.pop(country_code, None)
+        self._continent_ranked.pop(continent, None)
+
+    def _claim_ip(self, key, country_code: str):
+        """ثبت کشور به عنوان یکی از دارندگان IP در ایندکس‌های سراسری"""
+        owners = self._ip_owners.setdefault(key, [])
+        if country_code not in owners:
+            owners.append(country_code)
+        if len(owners) == 1:
+            self._ip_trie.insert(key)
+
+    def _release_ip(self, key, country_code: str):
+        """حذف کشور از دارندگان IP؛ ایندکس‌های سراسری فقط وقتی هیچ کشوری IP را ندارد پاک می‌شوند"""
+        owners = self._ip_owners.get(key)
+        if not owners or country_code not in owners:
+            return
+        owners.remove(country_code)
+        if not owners:
+            del self._ip_owners[key]
+            self._ip_trie.remove(key)
+
+    def _append_ip(self, country_code: str, ipv4: str) -> bool:
+        """افزودن IP به لیست مرتب کشور در صورت تکراری نبودن (کشور باید وجود داشته باشد)"""
+        key = self._ip_key(ipv4)
+        ip_set = self._ip_sets.setdefault(country_code, set())
+        if key in ip_set:
+            return False
+        if isinstance(key, int):
+            ipv4 = int_to_ip(key)  # ذخیره به شکل استاندارد (5.2.3.04 -> 5.2.3.4)
+        name, flag, ips = self.ipv4_data[country_code]
+        try:
+            ips.append(ipv4)
+        except ValueError:
+            # آدرس غیر IPv4 در لیست فشرده جا نمی‌شود؛ این کشور به لیست معمولی برمی‌گردد
+            ips = list(ips)
+            ips.append(ipv4)
+            self.ipv4_data[country_code] = (name, flag, ips)
+        ip_set.add(key)
+        self._claim_ip(key, country_code)
+        self._update_continent_count(country_code)
+        return True
 
-    def add_endpoint(self, endpoint):
-        """اضافه کردن endpoint جدید"""
-        if endpoint not in self.wg_endpoints:
-            self.wg_endpoints.append(endpoint)
-            self.save_database()
+    def _discard_ip(self, country_code: str, ipv4: str) -> bool:
+        key = self._ip_key(ipv4)
+        ip_set = self._ip_sets.get(country_code)
+        if not ip_set or key not in ip_set:
+            return False
+        ips = self.ipv4_data[country_code][2]
+        try:
+            ips.remove(ipv4)
+        except ValueError:
+            # داده‌های قدیمی ممکن است IP را به شکل غیراستاندارد (مانند 5.2.3.04) ذخیره کرده باشند
+            ips.remove(next(ip for ip in ips if self._ip_key(ip) == key))
+        ip_set.discard(key)
+        self._release_ip(key, country_code)
+        self._update_continent_count(country_code)
+        return True
+
+    def has_ipv4_address(self, ipv4: str, country_code: Optional[str] = None) -> bool:
+        """بررسی وجود یک IP در کل پایگاه داده یا در یک کشور خاص"""
+        key = self._ip_key(ipv4)
+        if country_code is None:
+            return key in self._ip_owners
+        return key in self._ip_sets.get(country_code, ())
+
+    def find_ip_country(self, ipv4: str) -> Optional[str]:
+        """کد کشوری که IP در آن ثبت شده است (اولین کشور در صورت ثبت در چند کشور، یا None)"""
+        owners = self._ip_owners.get(self._ip_key(ipv4))
+        return owners[0] if owners else None
+
+    def search_countries(self, query: str) -> List[str]:
+        """کد کشورهایی که نام، کد یا یکی از نام‌های مستعار (انگلیسی/فارسی) آن‌ها با عبارت شروع می‌شود"""
+        return sorted(code for code in self._country_tokens.search(query) if code in self.ipv4_data)
+
+    def search_ip_prefix(self, prefix: str, limit: Optional[int] = None) -> List[Tuple[str, str]]:
+        """
+        آدرس‌هایی که با پیشوند داده‌شده (مانند "192.168." یا "5.2") شروع می‌شوند.
+
+        Returns:
+            List[Tuple[str, str]]: حداکثر limit جفت (ip، country_code) به ترتیب عددی
+        """
+        return [(ip, self._ip_owners[self._ip_key(ip)][0]) for ip in self._ip_trie.search(prefix, limit)]
+
+    def search_ip_range(self,
+                        start: int,
+                        end: int,
+                        offset: int = 0,
+                        limit: Optional[int] = None) -> Tuple[int, List[Tuple[str, str]]]:
+        """
+        آدرس‌های ذخیره‌شده در یک بازه عددی (مثلاً حاصل یک CIDR) به صورت صفحه‌بندی‌شده.
+
+        Args:
+            start (int): ابتدای بازه (شامل)
+            end (int): انتهای بازه (شامل)
+            offset (int): تعداد نتایجی که از ابتدا رد می‌شوند
+            limit (int): حداکثر تعداد نتایج
+
+        Returns:
+            Tuple[int, List[Tuple[str, str]]]: (تعداد کل، جفت‌های (ip، country_code))
+        """
+        total = self._ip_trie.count_range(start, end)
+        stop = None if limit is None else offset + limit
+        results = []
+        for value in islice(self._ip_trie.iter_range(start, end), offset, stop):
+            ip = int_to_ip(value)
+            results.append((ip, self._ip_owners[self._ip_key(ip)][0]))
+        return total, results
+
+    def _snapshot_state(self) -> dict:
+        """وضعیت کامل پایگاه داده برای نوشتن در اسنپ‌شات"""
+        return {
+            'active_codes': self.active_codes,
+            'active_users': self.active_users,
+            'ipv4_data': self.ipv4_data,
+            'disabled_users': getattr(self, 'disabled_users', set()),
+            'delivery_state': getattr(self, 'delivery_state', {}),
+            'disabled_locations': getattr(self, 'disabled_locations', {}),
+            'wg_endpoints': getattr(self, 'wg_endpoints', []),
+            'last_added_ips': getattr(self, 'last_added_ips', deque(maxlen=20)),
+            'journal_seq': self._journal_seq
+        }
+
+    def save_database(self) -> bool:
+        """ذخیره کامل پایگاه داده (اسنپ‌شات) و خالی کردن ژورنال"""
+        with self._io_lock:
+            try:
+                # نوشتن در فایل موقت و جایگزینی اتمیک؛ نسخه قبلی تا پایان کامل نوشتن دست نمی‌خورد
+                write_snapshot(DB_FILE, self._snapshot_state())
+            except Exception as e:
+                print(f"خطا در ذخیره پایگاه داده: {e}")
+                return False
+
+            if self.storage_mode == "journal":
+                self._reset_journal()
             return True
-        return False
 
-    def remove_endpoint(self, endpoint):
-        """حذف endpoint"""
-        if endpoint in self.wg_endpoints:
-            self.wg_endpoints.remove(endpoint)
-            self.save_database()
+    def _commit(self, *records, durable: bool = False):
+        """
+        ثبت یک تغییر که قبلاً روی داده‌های حافظه اعمال شده است.
+
+        در حالت snapshot کل پایگاه داده ذخیره می‌شود. در حالت journal فقط رکوردهای
+        کوچک تغییر به انتهای ژورنال اضافه می‌شوند و پس از رسیدن به compact_threshold
+        ژورنال در اسنپ‌شات ادغام می‌شود. در حالت write-behind نوشتن روی دیسک
+        (اسنپ‌شات یا fsync ژورنال) به نخ پس‌زمینه سپرده می‌شود.
+
+        Args:
+            records: تاپل‌های (op, *args) قابل اعمال با _apply_record
+            durable (bool): نوشتن همزمان روی دیسک حتی در حالت write-behind
+                (برای عملیاتی مانند مصرف توکن)
+        """
+        if any(op in CATALOG_OPS or (args and args[0] in CATALOG_ATTRS) for op, *args in records):
+            self.catalog_version += 1
+
+        scheduler = self._scheduler
+        if self.storage_mode != "journal":
+            if scheduler is None:
+                self.save_database()
+            else:
+                scheduler.mark_dirty()
+                if durable:
+                    scheduler.flush()
+            return
+
+        with self._io_lock:
+            try:
+                if self._journal_file is None:
+                    self._journal_file = open(JOURNAL_FILE, 'ab')
+                for op, *args in records:
+                    self._journal_seq += 1
+                    pickle.dump((self._journal_seq, op, tuple(args)),
+                                self._journal_file,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                self._journal_file.flush()
+                if scheduler is None or durable:
+                    os.fsync(self._journal_file.fileno())
+                else:
+                    scheduler.mark_dirty()
+                self._journal_records += len(records)
+            except Exception as e:
+                print(f"خطا در نوشتن ژورنال: {e}")
+                # در صورت خطا در ژورنال، اسنپ‌شات کامل وضعیت فعلی را حفظ می‌کند
+                self.save_database()
+                return
+
+            if self._journal_records >= self.compact_threshold:
+                self.save_database()
+
+    def _flush_pending(self) -> bool:
+        """نوشتن تغییرات معوق روی دیسک (فراخوانی‌شده توسط SaveScheduler)"""
+        if self.storage_mode != "journal":
+            return self.save_database()
+
+        with self._io_lock:
+            if self._journal_file is None:
+                return True
+            try:
+                os.fsync(self._journal_file.fileno())
+                return True
+            except Exception as e:
+                print(f"خطا در همگام‌سازی ژورنال: {e}")
+                return False
+
+    def flush(self) -> bool:
+        """ذخیره فوری تغییراتی که در حالت write-behind هنوز نوشته نشده‌اند"""
+        if self._scheduler is None:
             return True
-        return False
+        return self._scheduler.flush()
 
-    def is_location_disabled(self, country_code, ip_type="ipv4"):
-        """بررسی وضعیت فعال/غیرفعال یک لوکیشن"""
-        try:
-            location_key = f"{country_code}_{ip_type}_disabled"
-            if location_key not in self.disabled_locations:
-                self.disabled_locations[location_key] = False
-            return self.disabled_locations[location_key]
-        except FileNotFoundError:
-            self.save_database()
-            return False
+    def close(self):
+        """توقف نخ ذخیره‌ساز و نوشتن تغییرات باقی‌مانده (هنگام خروج)"""
+        scheduler, self._scheduler = self._scheduler, None
+        if scheduler is not None:
+            scheduler.stop()
 
-    def save_database(self):
-        with open('bot_database.pkl', 'wb') as f:
-            pickle.dump(
-                {
-                    'active_codes': self.active_codes,
-                    'active_users': self.active_users,
-                    'ipv4_data': self.ipv4_data,
-                    'disabled_users': getattr(self, 'disabled_users', set()),
-                    'disabled_locations': getattr(self, 'disabled_locations',
-                                                  {}),
-                    'wg_endpoints': getattr(self, 'wg_endpoints', []),
-                    'last_added_ips': getattr(self, 'last_added_ips', deque(maxlen=20))
-                }, f)
+    def _reset_journal(self):
+        """خالی کردن ژورنال پس از نوشتن اسنپ‌شات"""
+        try:
+            if self._journal_file is not None:
+                self._journal_file.close()
+                self._journal_file = None
+            with open(JOURNAL_FILE, 'wb'):
+                pass
+            self._journal_records = 0
+        except Exception as e:
+            print(f"خطا در خالی کردن ژورنال: {e}")
+
+    def _replay_journal(self):
+        """اعمال رکوردهای ژورنال که پس از آخرین اسنپ‌شات ثبت شده‌اند"""
+        if not os.path.exists(JOURNAL_FILE):
+            return
+
+        self._apply_journal(JOURNAL_FILE)
+
+        # ادغام ژورنال در اسنپ‌شات تا رکوردهای بعدی پس از داده‌ی ناقص نوشته نشوند
+        if os.path.getsize(JOURNAL_FILE) > 0 and not self.save_database():
+            return
+
+        # حالت snapshot از ژورنال استفاده نمی‌کند؛ پس از ادغام حذف می‌شود
+        if self.storage_mode != "journal":
+            try:
+                os.remove(JOURNAL_FILE)
+            except OSError as e:
+                print(f"خطا در حذف ژورنال: {e}")
+
+    def _apply_journal(self, path: str):
+        """اعمال رکوردهای یک فایل ژورنال که در اسنپ‌شات فعلی ادغام نشده‌اند"""
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    seq, op, args = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception as e:
+                    # رکورد ناقص در انتهای فایل (قطع شدن برنامه حین نوشتن)
+                    print(f"رکورد ناقص ژورنال نادیده گرفته شد: {e}")
+                    break
+                # رکوردهایی که قبلاً در اسنپ‌شات ادغام شده‌اند دوباره اعمال نمی‌شوند
+                if seq <= self._journal_seq:
+                    continue
+                try:
+                    self._apply_record(op, args)
+                except Exception as e:
+                    print(f"خطا در اعمال رکورد ژورنال {seq}: {e}")
+                self._journal_seq = seq
+
+    def _apply_record(self, op: str, args: tuple):
+        """اعمال یک رکورد ژورنال روی داده‌های حافظه"""
+        if op == 'set':
+            attr, key, value = args
+            getattr(self, attr)[key] = value
+        elif op == 'del':
+            attr, key = args
+            getattr(self, attr).pop(key, None)
+        elif op == 'add':
+            attr, item = args
+            target = getattr(self, attr)
+            if isinstance(target, set):
+                target.add(item)
+            elif item not in target:
+                target.append(item)
+        elif op == 'discard':
+            attr, item = args
+            target = getattr(self, attr)
+            if item in target:
+                target.remove(item)
+        elif op == 'recent':
+            self.last_added_ips.appendleft(args[0])
+        elif op == 'recent_many':
+            self.last_added_ips.extendleft(args[0])
+        elif op == 'country':
+            country_code, value = args
+            self._unindex_country(country_code)
+            if value is None:
+                self.ipv4_data.pop(country_code, None)
+                self._rebuild_country_index()
+            else:
+                name, flag, ips = value
+                self.ipv4_data[country_code] = (name, flag, self._make_ip_list(ips))
+                self._index_country(country_code)
+                self._register_country(country_code)
+        elif op == 'ip_add':
+            country_code, name, flag, ipv4 = args
+            if country_code not in self.ipv4_data:
+                self.ipv4_data[country_code] = (name, flag, self._make_ip_list())
+                self._register_country(country_code)
+            self._append_ip(country_code, ipv4)
+        elif op == 'ip_add_many':
+            country_code, name, flag, ips = args
+            if country_code not in self.ipv4_data:
+                self.ipv4_data[country_code] = (name, flag, self._make_ip_list())
+                self._register_country(country_code)
+            for ipv4 in ips:
+                self._append_ip(country_code, ipv4)
+        elif op == 'ip_del':
+            country_code, ipv4 = args
+            self._discard_ip(country_code, ipv4)
+        else:
+            raise ValueError(f"نوع رکورد ناشناخته: {op}")
 
     def is_user_subscribed(self, user_id: int) -> bool:
         return user_id in self.active_users and user_id not in self.disabled_users
@@ -135,7 +697,7 @@ class DBManager:
             self.active_codes[
                 code]['used_count'] = self.active_codes[code].get(
                     'used_count', 0) + 1
-            self.save_database()
+            self._commit(('set', 'active_codes', code, self.active_codes[code]))
             return True, code_data
         return False, None
 
@@ -161,7 +723,7 @@ class DBManager:
                         self.active_codes[code]['users'] = []
                     self.active_codes[code]['users'].append(user_id)
 
-                self.save_database()
+                self._commit(*self._activation_records(user_id, code), durable=True)
                 return True
             return False
 
@@ -178,20 +740,33 @@ class DBManager:
                 self.active_codes[code]['users'] = []
             self.active_codes[code]['users'].append(user_id)
 
-        self.save_database()
+        self._commit(*self._activation_records(user_id, code), durable=True)
         return True
 
+    def _activation_records(self, user_id: int, code: str) -> list:
+        """رکوردهای ژورنال مربوط به فعال‌سازی یک کاربر"""
+        records = [('set', 'active_users', user_id, self.active_users[user_id])]
+        if code in self.active_codes:
+            records.append(('set', 'active_codes', code, self.active_codes[code]))
+        return records
+
     def grant_tokens(self, user_id: int, amount: int) -> bool:
         """افزودن توکن به کاربر."""
         if user_id in self.active_users:
             current_tokens = self.active_users[user_id].get("tokens", 0)
             self.active_users[user_id]["tokens"] = current_tokens + amount
-            self.save_database()
+            self._commit(('set', 'active_users', user_id, self.active_users[user_id]), durable=True)
             return True
         return False
 
-    def use_tokens(self, user_id: int, amount: int = 1) -> bool:
-        """استفاده از توکن توسط کاربر."""
+    def use_tokens(self, user_id: int, amount: int = 1, commit: bool = True) -> bool:
+        """
+        استفاده از توکن توسط کاربر.
+
+        Args:
+            commit: اگر False باشد تغییر فقط در حافظه اعمال می‌شود و ذخیره آن با
+                commit_users (دفتر توکن) به صورت دسته‌ای انجام می‌شود
+        """
         if not self.is_user_active(user_id):
             return False
 
@@ -204,9 +779,17 @@ class DBManager:
             return False
 
         self.active_users[user_id]['tokens'] = current_tokens - amount
-        self.save_database()
+        if commit:
+            self._commit(('set', 'active_users', user_id, self.active_users[user_id]), durable=True)
         return True
 
+    def commit_users(self, user_ids) -> None:
+        """ذخیره موجودی چند کاربر در یک commit (برای تغییرات انجام‌شده با commit=False)"""
+        records = [('set', 'active_users', user_id, self.active_users[user_id])
+                   for user_id in user_ids if user_id in self.active_users]
+        if records:
+            self._commit(*records, durable=True)
+
     def add_active_code(self,
                         code: str,
                         code_type: str,
@@ -218,13 +801,13 @@ class DBManager:
             "created_at": time.time(),
             "users": []
         }
-        self.save_database()
+        self._commit(('set', 'active_codes', code, self.active_codes[code]))
 
     def remove_active_code(self, code: str) -> bool:
         """حذف یک کد فعال‌سازی"""
         if code in self.active_codes:
             del self.active_codes[code]
-            self.save_database()
+            self._commit(('del', 'active_codes', code))
             return True
         return False
 
@@ -238,7 +821,7 @@ class DBManager:
                 "type": code_type,
                 "tokens": tokens
             })
-            self.save_database()
+            self._commit(('set', 'active_codes', code, self.active_codes[code]))
             return True
         return False
 
@@ -303,84 +886,135 @@ class DBManager:
             return self.ipv4_data[country_code][2]
         return []
 
+    def get_continent_countries(self, continent: str) -> List[Tuple[str, int]]:
+        """
+        کشورهای دارای IP یک قاره از آمار زنده قاره‌ها.
+
+        Returns:
+            List[Tuple[str, int]]: (کد کشور، تعداد IP) به ترتیب نزولی تعداد IP
+        """
+        ranked = self._continent_ranked.get(continent)
+        if ranked is None:
+            counts = self._continent_counts.get(continent, {})
+            ranked = sorted(counts.items(), key=lambda item: item[1], reverse=True)
+            self._continent_ranked[continent] = ranked
+        return ranked
+
+    def _resolve_country(self, country_name: str) -> Tuple[str, str]:
+        """یافتن کلید و نام استاندارد کشور با یک جستجو در ایندکس نام‌های مستعار"""
+        # تشخیص خاص عربستان (شامل نام‌های فارسی)
+        if is_saudi_name(country_name):
+            return 'SA', 'Saudi Arabia'
+
+        group = country_group(country_name)
+        existing_country = self._country_index.get(group)
+        if existing_country in self.ipv4_data:
+            return existing_country, self.ipv4_data[existing_country][0]  # استفاده از نام موجود
+
+        # نام‌های مستعار شناخته‌شده (مانند UAE و KSA) از ابتدا با کد ISO ذخیره می‌شوند
+        if group == 'SA':
+            return 'SA', 'Saudi Arabia'
+        if normalize_country_key(country_name) in COUNTRY_ALIASES:
+            return group, country_name
+
+        # در سایر موارد، کد کشور را از نام استخراج می‌کنیم
+        return normalize_country_key(country_name), country_name
+
     def add_ipv4_address(self, country_name: str, flag: str, ipv4: str) -> None:
         # استاندارد‌سازی نام‌ها و کدها بر اساس قوانین خاص
-        country_name_lower = country_name.lower()
-
-        # تشخیص خاص عربستان
-        if 'saudi' in country_name_lower or 'عربستان' in country_name_lower or 'سعودی' in country_name_lower:
-            country_code = 'SA'
-            standard_country_name = 'Saudi Arabia'
-
-            # استاندارد کردن نام عربستان به زبان انگلیسی
-            if 'عربستان' in country_name or 'سعودی' in country_name:
-                country_name = 'Saudi Arabia'
-
-        else:
-            # در سایر موارد، کد کشور را از نام استخراج می‌کنیم
-            country_code = country_name.lower().replace(' ', '_')
-            standard_country_name = country_name
-
-            # بررسی وجود کشور با نام مشابه
-            existing_country = next((key for key in self.ipv4_data.keys() 
-                                   if key.lower().replace(' ', '_') == country_code 
-                                   or (len(key) <= 3 and key.lower() == country_code.lower())), None)
-            if existing_country:
-                country_code = existing_country
-                standard_country_name = self.ipv4_data[existing_country][0]  # استفاده از نام موجود
-
-        # Standardize Saudi Arabia country codes
-        saudi_keys = ['sa', 'ksa', 'saudi', 'saudi_arabia', 'saudiarabia', 'kingdomofsaudiarabia', 'ksaudi', 'saudi arabia']
-        for key in list(self.ipv4_data.keys()):
-            if key.lower() in saudi_keys:
-                # Merge all Saudi Arabia addresses with different keys
-                if key.upper() != 'SA' and 'SA' in self.ipv4_data:
-                    name, flag_emoji, ips = self.ipv4_data['SA']
-                    _, _, saudi_ips = self.ipv4_data[key]
-                    merged_ips = list(set(ips + saudi_ips))  # ادغام بدون تکرار
-                    self.ipv4_data['SA'] = (name, flag_emoji, merged_ips)
-                    del self.ipv4_data[key]
-                elif key != 'SA':
-                    self.ipv4_data['SA'] = self.ipv4_data[key]
-                    del self.ipv4_data[key]
-                country_code = 'SA'
-                break
+        country_code, standard_country_name = self._resolve_country(country_name)
 
         if country_code not in self.ipv4_data:
-            self.ipv4_data[country_code] = (standard_country_name, flag, [])
+            self.ipv4_data[country_code] = (standard_country_name, flag, self._make_ip_list())
+            self._register_country(country_code)
 
-        name, flag_emoji, ips = self.ipv4_data[country_code]
-        if ipv4 not in ips:
-            ips.append(ipv4)
-            self.ipv4_data[country_code] = (name, flag_emoji, ips)
+        name, flag_emoji, _ = self.ipv4_data[country_code]
+        if self._append_ip(country_code, ipv4):
             # اضافه کردن به لیست آخرین IPهای اضافه شده
-            self.last_added_ips.appendleft(f"{flag} {standard_country_name}: {ipv4}")
-            self.save_database()
+            recent_entry = f"{flag} {standard_country_name}: {ipv4}"
+            self.last_added_ips.appendleft(recent_entry)
+            self._commit(('ip_add', country_code, name, flag_emoji, ipv4),
+                         ('recent', recent_entry))
+
+    def add_ipv4_addresses_bulk(self, ip_groups: Dict[str, list]) -> Dict[str, Dict]:
+        """
+        افزودن یکجای آدرس‌ها با یک بار ذخیره‌سازی.
+
+        Args:
+            ip_groups: خروجی IPProcessor.process_bulk_ips به شکل
+                {"flag name": [{"country_name", "flag", "ip"}, ...]}
+
+        Returns:
+            Dict[str, Dict]: country_code -> {name, flag, added, duplicates}
+        """
+        report = {}
+        records = []
+        recent_entries = []
+
+        for country_info, ip_list in ip_groups.items():
+            if not ip_list:
+                continue
+            # هر کشور فقط یک بار استاندارد‌سازی می‌شود
+            first = ip_list[0] if isinstance(ip_list[0], dict) else {}
+            country_name = first.get('country_name') or (
+                country_info.split(" ", 1)[1] if " " in country_info else country_info)
+            flag = first.get('flag') or (country_info.split(" ")[0] if " " in country_info else "🏳️")
+            country_code, standard_country_name = self._resolve_country(country_name)
+
+            if country_code not in self.ipv4_data:
+                self.ipv4_data[country_code] = (standard_country_name, flag, self._make_ip_list())
+                self._register_country(country_code)
+            name, flag_emoji, _ = self.ipv4_data[country_code]
+
+            stats = report.setdefault(country_code, {
+                "name": standard_country_name,
+                "flag": flag,
+                "added": 0,
+                "duplicates": 0
+            })
+            added_ips = []
+            for ip_data in ip_list:
+                ipv4 = ip_data["ip"] if isinstance(ip_data, dict) else ip_data
+                if self._append_ip(country_code, ipv4):
+                    added_ips.append(ipv4)
+                    recent_entries.append(f"{flag} {standard_country_name}: {ipv4}")
+                else:
+                    stats["duplicates"] += 1
+            stats["added"] += len(added_ips)
+            if added_ips:
+                records.append(('ip_add_many', country_code, name, flag_emoji, tuple(added_ips)))
+
+        if records:
+            # فقط آخرین موارد در لیست IPهای اخیر جا می‌شوند
+            recent_entries = recent_entries[-(self.last_added_ips.maxlen or len(recent_entries)):]
+            self.last_added_ips.extendleft(recent_entries)
+            records.append(('recent_many', tuple(recent_entries)))
+            self._commit(*records)
+
+        return report
 
     def remove_country(self, country_code: str) -> bool:
         """حذف کامل یک کشور و تمام آدرس‌های آن"""
         if country_code in self.ipv4_data:
             del self.ipv4_data[country_code]
-            self.save_database()
+            self._unindex_country(country_code)
+            self._rebuild_country_index()
+            self._commit(('country', country_code, None))
             return True
         return False
 
     def remove_ipv4_address(self, country_code: str, ipv4: str) -> bool:
         """حذف یک آدرس IP از پایگاه داده."""
-        if country_code in self.ipv4_data:
-            name, flag, ips = self.ipv4_data[country_code]
-            if ipv4 in ips:
-                ips.remove(ipv4)
-                self.ipv4_data[country_code] = (name, flag, ips)
-                self.save_database()
-                return True
+        if self._discard_ip(country_code, ipv4):
+            self._commit(('ip_del', country_code, ipv4))
+            return True
         return False
 
     def disable_user(self, user_id: int) -> bool:
         """غیرفعال کردن یک کاربر."""
         if user_id in self.active_users and user_id not in self.disabled_users:
             self.disabled_users.add(user_id)
-            self.save_database()
+            self._commit(('add', 'disabled_users', user_id))
             return True
         return False
 
@@ -388,7 +1022,7 @@ class DBManager:
         """فعال کردن یک کاربر."""
         if user_id in self.disabled_users:
             self.disabled_users.remove(user_id)
-            self.save_database()
+            self._commit(('discard', 'disabled_users', user_id))
             return True
         return False
 
@@ -396,6 +1030,52 @@ class DBManager:
         """بررسی اینکه آیا کاربر غیرفعال شده است یا خیر."""
         return user_id in self.disabled_users
 
+    def mark_user_unreachable(self, user_id: int, status: str, reason: str = "") -> None:
+        """
+        ثبت کاربری که پیام به او قابل تحویل نیست تا در ارسال‌های بعدی نادیده گرفته شود.
+
+        Args:
+            user_id (int): شناسه کاربر
+            status (str): یکی از DELIVERY_BLOCKED، DELIVERY_CHAT_NOT_FOUND یا DELIVERY_DEACTIVATED
+            reason (str): متن خطای تلگرام
+        """
+        state = {"status": status, "reason": reason, "since": time.time()}
+        self.delivery_state[user_id] = state
+        self._commit(('set', 'delivery_state', user_id, state))
+
+    def mark_user_reachable(self, user_id: int) -> bool:
+        """حذف وضعیت غیرقابل دسترس (مثلاً وقتی کاربر دوباره ربات را استارت کرد)"""
+        if user_id in self.delivery_state:
+            del self.delivery_state[user_id]
+            self._commit(('del', 'delivery_state', user_id))
+            return True
+        return False
+
+    def is_user_reachable(self, user_id: int) -> bool:
+        return user_id not in self.delivery_state
+
+    def get_unreachable_users(self) -> Dict[int, Dict[str, any]]:
+        """کاربران غیرقابل دسترس به همراه وضعیت تحویل"""
+        return dict(self.delivery_state)
+
+    def get_broadcast_recipients(self, active_only: bool = False) -> List[int]:
+        """
+        کاربرانی که پیام همگانی برایشان ارسال می‌شود (بدون کاربران غیرقابل دسترس).
+
+        Args:
+            active_only (bool): فقط کاربرانی که غیرفعال نشده‌اند
+        """
+        return [
+            user_id for user_id in self.active_users
+            if user_id not in self.delivery_state
+            and not (active_only and user_id in self.disabled_users)
+        ]
+
+    def set_disabled_flag(self, key: str, disabled: bool) -> None:
+        """تنظیم یک پرچم ساده فعال/غیرفعال (مانند گزینه‌های تولید IPv6)"""
+        self.disabled_locations[key] = disabled
+        self._commit(('set', 'disabled_locations', key, disabled))
+
     def disable_location(self,
                          country_code: str,
                          ip_type: str = "ipv4") -> bool:
@@ -415,7 +1095,8 @@ class DBManager:
                 }
 
             self.disabled_locations[country_code][ip_type] = True
-            self.save_database()
+            self._commit(('set', 'disabled_locations', country_code,
+                          self.disabled_locations[country_code]))
             return True
         return False
 
@@ -433,7 +1114,8 @@ class DBManager:
                 }
 
             self.disabled_locations[country_code][ip_type] = False
-            self.save_database()
+            self._commit(('set', 'disabled_locations', country_code,
+                          self.disabled_locations[country_code]))
             return True
         return False
 
@@ -441,22 +1123,13 @@ class DBManager:
     def add_ipv6_address(self, country_name: str, flag: str,
                          ipv6: str) -> None:
         """اضافه کردن آدرس IPv6 به کشور"""
-        # نرمال‌سازی نام کشور برای استفاده به عنوان کلید
-        country_code = country_name.lower().replace(' ', '_')
-
-        # بررسی وجود کشور با نام‌های مشابه
-        existing_country = None
-        for key in self.ipv4_data.keys():
-            if key.lower().replace(' ', '_') == country_code:
-                existing_country = key
-                break
-
-        if existing_country:
-            country_code = existing_country
+        # یافتن کشور موجود با نام‌های مشابه
+        country_code, country_name = self._resolve_country(country_name)
 
         # اگر کشور در پایگاه داده وجود ندارد، اضافه کن
         if country_code not in self.ipv4_data:
-            self.ipv4_data[country_code] = (country_name, flag, [])
+            self.ipv4_data[country_code] = (country_name, flag, self._make_ip_list())
+            self._register_country(country_code)
 
         # افزودن پشتیبانی IPv6 به ساختار داده
         # به‌زودی پیاده‌سازی خواهد شد
@@ -464,24 +1137,12 @@ class DBManager:
     def is_location_disabled(self,
                              country_code: str,
                              ip_type: str = "ipv4") -> bool:
-        """بررسی اینکه آیا یک لوکیشن غیرفعال است"""
-        if not isinstance(self.disabled_locations, dict):
-            self.disabled_locations = {}
-
-        if country_code not in self.disabled_locations:
-            self.disabled_locations[country_code] = {
-                "ipv4": False,
-                "ipv6": False
-            }
-        elif not isinstance(self.disabled_locations[country_code], dict):
-            # تبدیل مقادیر قدیمی به فرمت جدید
-            was_disabled = self.disabled_locations[country_code]
-            self.disabled_locations[country_code] = {
-                "ipv4": was_disabled,
-                "ipv6": was_disabled
-            }
-
-        return self.disabled_locations[country_code].get(ip_type, False)
+        """بررسی اینکه آیا یک لوکیشن غیرفعال است (بدون تغییر یا ذخیره وضعیت)"""
+        state = self.disabled_locations.get(country_code, False)
+        if isinstance(state, dict):
+            return state.get(ip_type, False)
+        # مقادیر قدیمی (bool) برای هر دو نوع IP اعمال می‌شوند
+        return bool(state)
 
     def get_all_locations(self) -> Dict[str, Dict]:
         """دریافت تمام لوکیشن‌ها با وضعیت فعال/غیرفعال"""
@@ -516,6 +1177,7 @@ class DBManager:
         return {
             "کاربران فعال": len(self.active_users) - len(self.disabled_users),
             "کاربران غیرفعال": len(self.disabled_users),
+            "کاربران غیرقابل دسترس": len(self.delivery_state),
             "کدهای فعال‌سازی": len(self.active_codes),
             "تعداد کشورها": len(self.ipv4_data),
             "تعداد کل IPv4":
@@ -523,14 +1185,21 @@ class DBManager:
         }
 
     def get_endpoints(self):
+        """دریافت لیست endpoint های وایرگارد"""
         return self.wg_endpoints
 
-    def add_endpoint(self, endpoint: str):
+    def add_endpoint(self, endpoint: str) -> bool:
+        """اضافه کردن endpoint جدید"""
         if endpoint not in self.wg_endpoints:
             self.wg_endpoints.append(endpoint)
-            self.save_database()
+            self._commit(('add', 'wg_endpoints', endpoint))
+            return True
+        return False
 
-    def remove_endpoint(self, endpoint: str):
+    def remove_endpoint(self, endpoint: str) -> bool:
+        """حذف endpoint"""
         if endpoint in self.wg_endpoints:
             self.wg_endpoints.remove(endpoint)
-            self.save_database()
+            self._commit(('discard', 'wg_endpoints', endpoint))
+            return True
+        return False
@@ -0,0 +1,444 @@
+import csv
+import logging
+import os
+import pickle
+import random
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from country_data import SPECIAL_COUNTRY_CODES
+from ip_storage import ip_to_int
+from rate_limiter import TokenBucket
+from save_scheduler import SaveScheduler
+
+GEOIP_DB_FILE = 'geoip_ranges.csv'
+GEO_CACHE_FILE = 'geo_cache.pkl'
+IPLOCATION_API = "https://api.iplocation.net/"
+# پاسخ‌هایی که ارزش تلاش مجدد دارند (محدودیت نرخ و خطاهای موقت سرور)
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+logger = logging.getLogger('geoip')
+
+
+def _parse_range(first: str, second: Optional[str]) -> Optional[Tuple[int, int]]:
+    """تبدیل (شروع، پایان) یا یک CIDR به بازه عددی"""
+    if second is None:
+        if '/' not in first:
+            return None
+        network, prefix = first.split('/', 1)
+        start = ip_to_int(network)
+        if start is None or not prefix.isdigit() or int(prefix) > 32:
+            return None
+        size = 1 << (32 - int(prefix))
+        start &= ~(size - 1) & 0xFFFFFFFF
+        return start, start + size - 1
+
+    bounds = []
+    for value in (first, second):
+        number = int(value) if value.isdigit() else ip_to_int(value)
+        if number is None:
+            return None
+        bounds.append(number)
+    return bounds[0], bounds[1]
+
+
+class GeoIPDatabase:
+    """
+    جدول بازه‌های IPv4 -> کشور که از یک فایل CSV بارگذاری می‌شود.
+
+    هر سطر فایل یکی از دو قالب زیر است (سطرهای خالی و شروع‌شده با # نادیده گرفته می‌شوند):
+        start,end,country_code,country_name   (start/end به صورت IP نقطه‌دار یا عدد)
+        network/prefix,country_code,country_name
+
+    شروع و پایان بازه‌ها در آرایه‌های عددی مرتب نگه داشته می‌شوند و هر جستجو
+    با یک bisect انجام می‌شود.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._starts = array('I')
+        self._ends = array('I')
+        self._country_ids = array('H')
+        self._countries: List[Tuple[str, str]] = []
+        self._load()
+
+    def _load(self):
+        country_ids: Dict[Tuple[str, str], int] = {}
+        ranges = []
+        with open(self.path, newline='', encoding='utf-8') as f:
+            for row in csv.reader(f):
+                if not row or row[0].startswith('#'):
+                    continue
+                if len(row) >= 4 and '/' not in row[0]:
+                    bounds = _parse_range(row[0].strip(), row[1].strip())
+                    code, name = row[2], row[3]
+                elif len(row) >= 3:
+                    bounds = _parse_range(row[0].strip(), None)
+                    code, name = row[1], row[2]
+                else:
+                    bounds = None
+                if bounds is None:
+                    # سطر عنوان یا سطر نامعتبر
+                    continue
+                country = (code.strip().upper(), name.strip())
+                if country not in country_ids:
+                    country_ids[country] = len(self._countries)
+                    self._countries.append(country)
+                ranges.append((bounds[0], bounds[1], country_ids[country]))
+
+        ranges.sort()
+        for start, end, country_id in ranges:
+            self._starts.append(start)
+            self._ends.append(end)
+            self._country_ids.append(country_id)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def lookup(self, ip: str) -> Optional[Tuple[str, str]]:
+        """
+        Returns:
+            Optional[Tuple[str, str]]: (country_code, country_name) یا None
+        """
+        value = ip_to_int(ip)
+        if value is None:
+            return None
+        index = bisect_right(self._starts, value) - 1
+        if index < 0 or value > self._ends[index]:
+            return None
+        return self._countries[self._country_ids[index]]
+
+
+class MMDBDatabase:
+    """خواندن پایگاه داده MaxMind (.mmdb) در صورت نصب بودن بسته maxminddb"""
+
+    def __init__(self, path: str):
+        import maxminddb
+        self.path = path
+        self._reader = maxminddb.open_database(path)
+
+    def __len__(self):
+        return self._reader.metadata().node_count
+
+    def lookup(self, ip: str) -> Optional[Tuple[str, str]]:
+        try:
+            record = self._reader.get(ip)
+        except ValueError:
+            return None
+        country = (record or {}).get('country') or (record or {}).get('registered_country')
+        if not country:
+            return None
+        return country.get('iso_code', ''), country.get('names', {}).get('en', '')
+
+
+def open_geoip_database(path: str):
+    """بارگذاری فایل بازه‌ها (CSV یا mmdb)؛ در صورت نبود فایل None برمی‌گرداند"""
+    if not path or not os.path.exists(path):
+        logger.warning(f"GeoIP database {path} not found, using remote API only")
+        return None
+    try:
+        if path.endswith('.mmdb'):
+            database = MMDBDatabase(path)
+        else:
+            database = GeoIPDatabase(path)
+        logger.info(f"GeoIP database loaded: {path} ({len(database)} entries)")
+        return database
+    except ImportError:
+        logger.error("Reading .mmdb files requires the maxminddb package")
+    except Exception as e:
+        logger.error(f"Failed to load GeoIP database {path}: {e}")
+    return None
+
+
+class GeoCache:
+    def __init__(self,
+                 path: Optional[str] = GEO_CACHE_FILE,
+                 max_entries: int = 10000,
+                 ttl: float = 7 * 24 * 3600,
+                 negative_ttl: float = 3600,
+                 save_interval: float = 60):
+        """
+        کش نتایج تشخیص کشور با حذف LRU، انقضای هر مورد و ذخیره روی دیسک.
+
+        Args:
+            path (str): فایل ذخیره کش بین اجراها (None برای کش فقط در حافظه)
+            max_entries (int): حداکثر تعداد موارد؛ قدیمی‌ترین استفاده‌شده‌ها حذف می‌شوند
+            ttl (float): عمر نتایج موفق به ثانیه
+            negative_ttl (float): عمر نتایج ناموفق (کش منفی) به ثانیه
+            save_interval (float): حداقل فاصله ذخیره روی دیسک به ثانیه
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, Optional[dict]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._scheduler = None
+        if path:
+            self._load()
+            self._scheduler = SaveScheduler(self.save, save_interval)
+            self._scheduler.start()
+
+    def get(self, key: str) -> Tuple[bool, Optional[dict]]:
+        """
+        Returns:
+            Tuple[bool, Optional[dict]]: (found, value)؛ value برای نتیجه منفی None است
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, (dict(entry[1]) if entry[1] is not None else None)
+
+    def set(self, key: str, value: Optional[dict]):
+        """ذخیره نتیجه (None یعنی تشخیص ناموفق و با negative_ttl ذخیره می‌شود)"""
+        ttl = self.ttl if value is not None else self.negative_ttl
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, dict(value) if value is not None else None)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        if self._scheduler is not None:
+            self._scheduler.mark_dirty()
+
+    def stats(self) -> Dict[str, int]:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits * 100 / total) if total else 0
+        }
+
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                entries = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"Failed to load geo cache {self.path}: {e}")
+            return
+        now = time.time()
+        with self._lock:
+            for key, (expires_at, value) in entries:
+                if expires_at >= now:
+                    self._entries[key] = (expires_at, value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self) -> bool:
+        """نوشتن کش روی دیسک (فایل موقت و جایگزینی، تا فایل نیمه‌کاره باقی نماند)"""
+        if not self.path:
+            return True
+        with self._lock:
+            entries = list(self._entries.items())
+        temp_path = f"{self.path}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump(entries, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, self.path)
+            return True
+        except Exception as e:
+            logger.error(f"Failed to save geo cache {self.path}: {e}")
+            return False
+
+    def close(self):
+        """توقف ذخیره‌ساز پس‌زمینه و نوشتن تغییرات باقی‌مانده"""
+        scheduler, self._scheduler = self._scheduler, None
+        if scheduler is not None:
+            scheduler.stop()
+
+
+class GeoResolver:
+    def __init__(self,
+                 db_path: str = GEOIP_DB_FILE,
+                 remote_fallback: bool = True,
+                 timeout: float = 5,
+                 cache: Optional[GeoCache] = None,
+                 rate_limit: float = 10,
+                 max_retries: int = 3,
+                 backoff: float = 0.5,
+                 pool_size: int = 16):
+        """
+        تشخیص کشور IP: ابتدا از پایگاه داده محلی و در صورت نبود نتیجه از API.
+
+        Args:
+            db_path (str): مسیر فایل CSV یا mmdb بازه‌ها
+            remote_fallback (bool): استفاده از api.iplocation.net وقتی نتیجه محلی نیست
+            timeout (float): مهلت درخواست‌های API به ثانیه
+            cache (GeoCache): کش نتایج API (پیش‌فرض: کش در حافظه)
+            rate_limit (float): حداکثر درخواست API در ثانیه برای کل برنامه (0 = بدون محدودیت)
+            max_retries (int): تعداد تلاش مجدد برای خطای شبکه و پاسخ‌های 429/5xx
+            backoff (float): فاصله پایه تلاش مجدد به ثانیه (هر بار دو برابر می‌شود)
+            pool_size (int): حداکثر اتصال‌های همزمان نگه‌داشته‌شده به API
+        """
+        self.database = open_geoip_database(db_path)
+        self.remote_fallback = remote_fallback
+        self.timeout = timeout
+        self.cache = cache if cache is not None else GeoCache(path=None)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limiter = TokenBucket(rate_limit)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.pool_size = pool_size
+        self._executor = None  # اجرای lookup خارج از نخ فراخوان (submit_lookup)
+        self._request_executor = None  # درخواست‌های موازی یک lookup
+        self._executor_lock = threading.Lock()
+
+    def lookup(self, ip: str, with_isp: bool = False, parallel: bool = False) -> Optional[Dict[str, str]]:
+        """
+        Args:
+            ip (str): آدرس IPv4
+            with_isp (bool): نام ISP هم لازم است (فقط از API در دسترس است)
+            parallel (bool): ارسال همزمان درخواست اطلاعات IP و درخواست کد کشور
+                (پاسخ سریع‌تر برای درخواست‌های تعاملی به قیمت یک درخواست API بیشتر)
+
+        Returns:
+            Optional[dict]: {"country_name", "country_code", "isp"} یا None
+        """
+        result = None
+        if self.database is not None:
+            found = self.database.lookup(ip)
+            if found:
+                code, name = found
+                result = {"country_name": name, "country_code": code, "isp": "نامشخص"}
+
+        if self.remote_fallback and (result is None or with_isp):
+            remote = self._cached_remote_lookup(ip, parallel)
+            if remote and result is not None:
+                # کشور از پایگاه داده محلی، ISP از API
+                result["isp"] = remote.get("isp", "نامشخص")
+            elif remote:
+                result = remote
+
+        if result is not None:
+            result = self._normalize(result)
+        return result
+
+    def submit_lookup(self, ip: str, with_isp: bool = False, parallel: bool = True) -> Future:
+        """
+        اجرای lookup در نخ‌های resolver تا نخ فراخوان (مثلاً worker ربات) منتظر شبکه نماند.
+
+        Returns:
+            Future: نتیجه lookup (همان خروجی lookup)
+        """
+        return self._get_executor('_executor', 'geoip-lookup').submit(self.lookup, ip, with_isp, parallel)
+
+    def _get_executor(self, attr: str, name: str) -> ThreadPoolExecutor:
+        with self._executor_lock:
+            executor = getattr(self, attr)
+            if executor is None:
+                executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix=name)
+                setattr(self, attr, executor)
+            return executor
+
+    def _cached_remote_lookup(self, ip: str, parallel: bool = False) -> Optional[Dict[str, str]]:
+        found, remote = self.cache.get(ip)
+        if not found:
+            remote = self._remote_lookup(ip, parallel)
+            self.cache.set(ip, remote)
+        return remote
+
+    def stats(self) -> Dict[str, int]:
+        """آمار کش برای پنل ادمین"""
+        return self.cache.stats()
+
+    def close(self):
+        for executor in (self._executor, self._request_executor):
+            if executor is not None:
+                executor.shutdown(wait=False)
+        self.cache.close()
+        self.session.close()
+
+    def _request(self, params: Dict[str, str]):
+        """
+        درخواست GET به API با رعایت محدودیت نرخ سراسری و تلاش مجدد با تأخیر نمایی.
+
+        Returns:
+            requests.Response: آخرین پاسخ دریافتی (ممکن است کد خطا داشته باشد)
+        """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.get(IPLOCATION_API, params=params, timeout=self.timeout)
+            except requests.RequestException:
+                if last_attempt:
+                    raise
+                delay = self.backoff * (2 ** attempt)
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    return response
+                delay = self.backoff * (2 ** attempt)
+                retry_after = response.headers.get('Retry-After', '')
+                if response.status_code == 429:
+                    if retry_after.isdigit():
+                        delay = max(delay, float(retry_after))
+                    # توقف همه درخواست‌ها (نه فقط همین نخ) تا پایان محدودیت
+                    self.rate_limiter.pause(delay)
+            # کمی تصادفی‌سازی تا نخ‌های همزمان با هم تلاش مجدد نکنند
+            time.sleep(delay * random.uniform(0.8, 1.2))
+
+    def _country_code_request(self, ip: str) -> str:
+        """API ثانویه برای دریافت کد کشور"""
+        country_response = self._request({"cmd": "ip-country", "ip": ip})
+        if country_response.status_code == 200:
+            return country_response.json().get('country_code', '')
+        return ''
+
+    def _remote_lookup(self, ip: str, parallel: bool = False) -> Optional[Dict[str, str]]:
+        country_future = None
+        try:
+            if parallel:
+                # درخواست کد کشور همزمان با درخواست اصلی ارسال می‌شود (از استخر جدا تا
+                # نخ‌های submit_lookup منتظر یکدیگر نمانند)
+                country_future = self._get_executor('_request_executor', 'geoip-request').submit(
+                    self._country_code_request, ip)
+            response = self._request({"ip": ip})
+            if response.status_code != 200:
+                return None
+            data = response.json()
+            country_code = data.get('country_code') or data.get('country_code2') or ''
+            if not country_code:
+                country_code = (country_future.result() if country_future is not None
+                                else self._country_code_request(ip))
+            country_name = data.get('country_name')
+            if not country_name or country_name == '-':
+                return None
+            return {
+                "country_name": country_name,
+                "country_code": country_code,
+                "isp": data.get('isp') or "نامشخص"
+            }
+        except Exception as e:
+            logger.error(f"Remote GeoIP lookup failed for {ip}: {e}")
+            return None
+
+    @staticmethod
+    def _normalize(result: Dict[str, str]) -> Dict[str, str]:
+        country_name = result["country_name"]
+        country_code = (result.get("country_code") or "").upper()
+        # جایگزینی کد کشور برای کشورهای خاص
+        if country_name in SPECIAL_COUNTRY_CODES:
+            country_code = SPECIAL_COUNTRY_CODES[country_name]
+        result["country_code"] = country_code
+        return result
@@ -2,11 +2,21 @@ import re
 import requests
 import logging
 from collections import defaultdict
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from country_data import SPECIAL_COUNTRY_CODES
 
 class IPProcessor:
-    def __init__(self):
+    def __init__(self, resolver=None, max_workers=8):
+        """
+        Args:
+            resolver (GeoResolver): تشخیص‌دهنده کشور (پایگاه داده محلی با API پشتیبان)؛
+                اگر تعیین نشود مستقیماً از API استفاده می‌شود
+            max_workers (int): تعداد نخ‌های همزمان برای تشخیص کشور در پردازش گروهی
+        """
         self.ip_validation_api = "https://api.iplocation.net/?ip="
+        self.resolver = resolver
+        self.max_workers = max_workers
         self.logger = logging.getLogger(__name__)
 
         # نقشه پرچم‌های خاص برای کشورهای مشکل‌دار
@@ -21,17 +31,7 @@ class IPProcessor:
         }
 
         # نگاشت کشورهای خاص
-        self.special_country_codes = {
-            "Qatar": "QA", "UAE": "AE", "United Arab Emirates": "AE",
-            "Saudi Arabia": "SA", "Saudi": "SA", "KSA": "SA",
-            "Iran": "IR", "Iraq": "IQ", "Kuwait": "KW", 
-            "Bahrain": "BH", "Oman": "OM", "Egypt": "EG", 
-            "Turkey": "TR", "Russia": "RU", "United States": "US", 
-            "USA": "US", "Germany": "DE", "United Kingdom": "GB", 
-            "UK": "GB", "France": "FR", "China": "CN", 
-            "India": "IN", "Japan": "JP", "Canada": "CA", 
-            "Pakistan": "PK", "Georgia": "GE"
-        }
+        self.special_country_codes = SPECIAL_COUNTRY_CODES
 
     def extract_ips(self, text):
         """استخراج تمام آدرس‌های IP از متن ورودی"""
@@ -41,9 +41,8 @@ class IPProcessor:
     def get_country_info(self, ip_address):
         """دریافت اطلاعات کشور برای یک آدرس IP"""
         try:
-            response = requests.get(f"{self.ip_validation_api}{ip_address}")
-            if response.status_code == 200:
-                data = response.json()
+            data = self._lookup(ip_address)
+            if data:
                 country_name = data.get('country_name', 'نامشخص')
                 country_code = data.get('country_code', '').upper()
 
@@ -85,8 +84,26 @@ class IPProcessor:
             "ip": ip_address
         }
 
+    def _lookup(self, ip_address):
+        """دریافت اطلاعات خام کشور از resolver یا در نبود آن از API"""
+        if self.resolver is not None:
+            return self.resolver.lookup(ip_address)
+        response = requests.get(f"{self.ip_validation_api}{ip_address}", timeout=10)
+        if response.status_code == 200:
+            return response.json()
+        return None
+
     def extract_country_from_text(self, text, ip):
         """استخراج نام کشور و پرچم از متن ورودی"""
+        country_info = self._parse_country_from_text(text, ip)
+        if country_info is not None:
+            return country_info
+
+        # اگر هیچ کشوری یافت نشد، از API استفاده کنیم
+        return self.get_country_info(ip)
+
+    def _parse_country_from_text(self, text, ip):
+        """استخراج کشور فقط از متن (بدون درخواست API)؛ در صورت نبود الگو None برمی‌گرداند"""
         # الگوی 1: [PING OK] 39.62.163.207 -> 🇵🇰 Pakistan
         if '->' in text:
             try:
@@ -115,11 +132,57 @@ class IPProcessor:
 
             return {"country_name": country_name, "flag": flag, "ip": ip}
 
-        # اگر هیچ کشوری یافت نشد، از API استفاده کنیم
-        return self.get_country_info(ip)
+        return None
+
+    def resolve_countries(self, ips, progress_callback=None):
+        """
+        تشخیص همزمان کشور چند IP با استفاده از مجموعه نخ‌های محدود.
+
+        Args:
+            ips (list): آدرس‌های IP (بدون تکرار)
+            progress_callback (callable): در صورت تعیین، پس از هر نتیجه با (تعداد انجام‌شده، کل) فراخوانی می‌شود
 
-    def process_bulk_ips(self, text):
-        """پردازش گروهی آدرس‌های IP و گروه‌بندی بر اساس کشور"""
+        Returns:
+            dict: نگاشت IP به اطلاعات کشور
+        """
+        results = {}
+        total_count = len(ips)
+        if not total_count:
+            return results
+
+        def report(processed_count):
+            # لاگ کردن پیشرفت پردازش برای تعداد زیاد IP
+            if processed_count % 50 == 0 or processed_count == total_count:
+                self.logger.info(f"پردازش IP ها: {processed_count}/{total_count}")
+            if progress_callback is not None:
+                try:
+                    progress_callback(processed_count, total_count)
+                except Exception as e:
+                    self.logger.error(f"خطا در گزارش پیشرفت: {e}")
+
+        workers = min(self.max_workers, total_count)
+        if workers <= 1:
+            for ip in ips:
+                results[ip] = self.get_country_info(ip)
+                report(len(results))
+            return results
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="geo") as executor:
+            futures = {executor.submit(self.get_country_info, ip): ip for ip in ips}
+            for future in as_completed(futures):
+                # get_country_info خطاها را خودش مدیریت می‌کند و همیشه نتیجه برمی‌گرداند
+                results[futures[future]] = future.result()
+                report(len(results))
+        return results
+
+    def process_bulk_ips(self, text, progress_callback=None):
+        """
+        پردازش گروهی آدرس‌های IP و گروه‌بندی بر اساس کشور
+
+        Args:
+            text (str): متن حاوی آدرس‌ها
+            progress_callback (callable): گزارش پیشرفت تشخیص کشور با (تعداد انجام‌شده، کل)
+        """
         ips = self.extract_ips(text)
         if not ips:
             return {}
@@ -135,20 +198,13 @@ class IPProcessor:
                 for ip in line_ips:
                     # بررسی این IP قبلاً پردازش نشده باشد
                     if ip not in ip_data:
-                        country_info = self.extract_country_from_text(line, ip)
-                        ip_data[ip] = country_info
+                        country_info = self._parse_country_from_text(line, ip)
+                        if country_info is not None:
+                            ip_data[ip] = country_info
 
         # برای IPهایی که هنوز اطلاعات کشورشان استخراج نشده، از API استفاده می‌کنیم
-        processed_count = 0
-        total_count = len(ips)
-
-        for ip in ips:
-            if ip not in ip_data:
-                ip_data[ip] = self.get_country_info(ip)
-                processed_count += 1
-                # لاگ کردن پیشرفت پردازش برای تعداد زیاد IP
-                if processed_count % 10 == 0 or processed_count == total_count:
-                    self.logger.info(f"پردازش IP ها: {processed_count}/{total_count}")
+        pending = [ip for ip in dict.fromkeys(ips) if ip not in ip_data]
+        ip_data.update(self.resolve_countries(pending, progress_callback))
 
         # نرمال‌سازی و تصحیح نام‌های کشورها
         normalized_data = {}
@@ -167,7 +223,7 @@ class IPProcessor:
                 country_code = 'SA'
                 data['flag'] = self.special_flags.get('SA', data['flag'])
                 # Log for debugging
-                self.logger.info(f"Saudi Arabia identified and standardized: {country_name}, {country_code}")
+                self.logger.debug(f"Saudi Arabia identified and standardized: {country_name}, {country_code}")
 
             # تصحیح گرجستان
             elif country_name.lower() in ['georgia', 'گرجستان']:
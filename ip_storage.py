@@ -0,0 +1,139 @@
+import sys
+from array import array
+from collections.abc import MutableSequence
+from typing import Iterable, Optional, Union
+
+# array('I') روی تمام پلتفرم‌های رایج ۴ بایتی است؛ در غیر این صورت از 'L' استفاده می‌شود
+_TYPECODE = 'I' if array('I').itemsize == 4 else 'L'
+
+
+def ip_to_int(ip: str) -> Optional[int]:
+    """تبدیل IPv4 نقطه‌دار به عدد صحیح ۳۲ بیتی (برای ورودی نامعتبر None برمی‌گرداند)"""
+    parts = ip.split('.')
+    if len(parts) != 4:
+        return None
+    value = 0
+    for part in parts:
+        if not part.isdigit() or len(part) > 3:
+            return None
+        octet = int(part)
+        if octet > 255:
+            return None
+        value = (value << 8) | octet
+    return value
+
+
+def int_to_ip(value: int) -> str:
+    """تبدیل عدد صحیح ۳۲ بیتی به IPv4 نقطه‌دار"""
+    return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+
+def ip_index_key(ip: str) -> Union[int, str]:
+    """کلید فشرده برای ایندکس‌ها: عدد صحیح برای IPv4 معتبر و خود رشته برای سایر موارد"""
+    value = ip_to_int(ip)
+    return ip if value is None else value
+
+
+class PackedIPv4List(MutableSequence):
+    """
+    لیست مرتب آدرس‌های IPv4 که هر آدرس را به صورت یک عدد ۴ بایتی در array نگه می‌دارد.
+
+    رابط آن مانند list از رشته‌هاست و آدرس‌ها فقط هنگام خواندن (نمایش، خروجی و
+    جستجو) به رشته تبدیل می‌شوند. آدرس نامعتبر با ValueError رد می‌شود.
+    """
+
+    __slots__ = ('_data', )
+
+    def __init__(self, ips: Iterable[str] = ()):
+        self._data = array(_TYPECODE)
+        for ip in ips:
+            self.append(ip)
+
+    @staticmethod
+    def _pack(ip: str) -> int:
+        value = ip_to_int(ip)
+        if value is None:
+            raise ValueError(f"آدرس IPv4 نامعتبر: {ip}")
+        return value
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [int_to_ip(value) for value in self._data[index]]
+        return int_to_ip(self._data[index])
+
+    def __setitem__(self, index, ip):
+        if isinstance(index, slice):
+            self._data[index] = array(_TYPECODE, (self._pack(item) for item in ip))
+        else:
+            self._data[index] = self._pack(ip)
+
+    def __delitem__(self, index):
+        del self._data[index]
+
+    def insert(self, index, ip):
+        self._data.insert(index, self._pack(ip))
+
+    def append(self, ip):
+        self._data.append(self._pack(ip))
+
+    def remove(self, ip):
+        value = ip_to_int(ip)
+        if value is None:
+            raise ValueError(f"{ip} در لیست نیست")
+        self._data.remove(value)
+
+    def __iter__(self):
+        return (int_to_ip(value) for value in self._data)
+
+    def __contains__(self, ip):
+        value = ip_to_int(ip) if isinstance(ip, str) else None
+        return value is not None and value in self._data
+
+    def __eq__(self, other):
+        if isinstance(other, PackedIPv4List):
+            return self._data == other._data
+        return list(self) == other
+
+    def __repr__(self):
+        return f"PackedIPv4List({list(self)!r})"
+
+    def copy(self) -> 'PackedIPv4List':
+        result = PackedIPv4List()
+        result._data = array(_TYPECODE, self._data)
+        return result
+
+    def int_values(self) -> array:
+        """دسترسی مستقیم به مقادیر عددی (بدون تبدیل به رشته)"""
+        return self._data
+
+    # ذخیره در pickle به صورت بافر big-endian مستقل از معماری
+    def __reduce__(self):
+        data = array(_TYPECODE, self._data)
+        if sys.byteorder == 'little':
+            data.byteswap()
+        return (_unpack_ipv4_buffer, (data.tobytes(), ))
+
+
+def _unpack_ipv4_buffer(buffer: bytes) -> PackedIPv4List:
+    result = PackedIPv4List()
+    result._data.frombytes(buffer)
+    if sys.byteorder == 'little':
+        result._data.byteswap()
+    return result
+
+
+def pack_ip_list(ips: Iterable[str]):
+    """
+    تبدیل لیست آدرس‌ها به PackedIPv4List؛ اگر آدرس نامعتبری وجود داشته باشد
+    لیست معمولی برگردانده می‌شود.
+    """
+    if isinstance(ips, PackedIPv4List):
+        return ips
+    ips = list(ips)
+    try:
+        return PackedIPv4List(ips)
+    except ValueError:
+        return ips
@@ -0,0 +1,70 @@
+import logging
+import threading
+from collections import deque
+
+
+class KeyPool:
+    def __init__(self, generate, size=64, refill_at=None):
+        """
+        Pool of pre-generated values (e.g. WireGuard key pairs) refilled in the background.
+
+        get() pops a ready value in O(1); when the pool drops below refill_at the
+        background thread is woken and tops it up to size again. If the pool is ever
+        empty (a burst larger than the pool) get() falls back to generating inline.
+
+        Args:
+            generate (callable): Produces one value
+            size (int): Number of values kept ready
+            refill_at (int, optional): Wake the refill thread below this many values
+                (default: half of size)
+        """
+        self.generate = generate
+        self.size = size
+        self.refill_at = refill_at if refill_at is not None else size // 2
+        self.misses = 0  # Values generated inline because the pool was empty
+        self._values = deque()
+        self._wake = threading.Event()
+        self._running = False
+        self._thread = None
+        self.logger = logging.getLogger('key_pool')
+
+    def start(self):
+        """Start the refill thread (the pool is filled in the background)."""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._refill_loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the refill thread."""
+        self._running = False
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=1.0)
+            self._thread = None
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self):
+        """Return a ready value, generating one inline only if the pool is empty."""
+        try:
+            value = self._values.popleft()
+        except IndexError:
+            self.misses += 1
+            value = self.generate()
+        if len(self._values) < self.refill_at:
+            self._wake.set()
+        return value
+
+    def _refill_loop(self):
+        while self._running:
+            # Cleared before filling so a get() during the fill triggers another round
+            self._wake.clear()
+            try:
+                while self._running and len(self._values) < self.size:
+                    self._values.append(self.generate())
+            except Exception as e:
+                self.logger.error(f"Failed to refill key pool: {e}")
+            self._wake.wait()
@@ -2,7 +2,7 @@ import os
 import logging
 import random
 import json
-import requests
+import time
 import warnings
 from collections import deque
 
@@ -18,18 +18,45 @@ from telegram.ext import (
     Filters,
     CallbackContext,
 )
-from db_manager import DBManager
-from wg import WireguardConfig
+from db_manager import (DBManager, DB_FILE, DELIVERY_BLOCKED, DELIVERY_CHAT_NOT_FOUND,
+                        DELIVERY_DEACTIVATED)
+from sqlite_db_manager import SQLiteDBManager, SQLITE_FILE, migrate_pickle_to_sqlite
+from snapshot_file import encode_snapshot
+from wg import WireguardConfig, generate_keypair, configs_to_zip
+from key_pool import KeyPool
 from backup_manager import BackupManager
 from ip_processor import IPProcessor
+from geoip import GeoResolver, GeoCache, GEOIP_DB_FILE, GEO_CACHE_FILE
+from search_index import parse_ip_range
+from ip_storage import int_to_ip
+from country_data import country_flag, CONTINENT_MAP
+from broadcast import BroadcastManager
+from view_cache import ViewCache
+from callback_router import CallbackRouter, encode_callback, callback_args
+from token_ledger import TokenLedger
 
 # --- وضعیت سیستم ---
 LOCATIONS_ENABLED = True  # وضعیت فعال/غیرفعال بودن لوکیشن‌ها
 import threading
 
-# اضافه کردن قابلیت بکاپ‌گیری خودکار
-backup_mgr = BackupManager(backup_interval=3600*6, max_backups=10)  # هر 6 ساعت با نگهداری 10 بکاپ
-ip_processor = IPProcessor()  # پردازش کننده آی‌پی‌ها
+# تشخیص کشور IPها: ابتدا از فایل بازه‌های محلی (CSV/mmdb) و در صورت نبود نتیجه از API
+# نتایج API در کش مشترک (LRU با انقضا) نگه داشته و بین اجراها روی دیسک ذخیره می‌شوند
+# GEOIP_RATE_LIMIT: حداکثر درخواست API در ثانیه برای کل ربات
+# GEOIP_WORKERS: تعداد درخواست‌های همزمان در پردازش گروهی IPها
+GEOIP_WORKERS = int(os.getenv("GEOIP_WORKERS", "8"))
+geo_resolver = GeoResolver(os.getenv("GEOIP_DB_PATH", GEOIP_DB_FILE),
+                           remote_fallback=os.getenv("GEOIP_REMOTE_FALLBACK", "1") == "1",
+                           cache=GeoCache(GEO_CACHE_FILE),
+                           rate_limit=float(os.getenv("GEOIP_RATE_LIMIT", "10")),
+                           pool_size=GEOIP_WORKERS)
+ip_processor = IPProcessor(resolver=geo_resolver, max_workers=GEOIP_WORKERS)  # پردازش کننده آی‌پی‌ها
+
+# جفت کلیدهای X25519 وایرگارد در پس‌زمینه تولید و در استخر آماده نگه داشته می‌شوند
+# WG_KEY_POOL_SIZE: تعداد جفت کلیدهای آماده
+# WG_SERVER_PUBLIC_KEY: کلید عمومی سرور (خروجی `wg show <interface> public-key`) برای بخش [Peer]
+wg_key_pool = KeyPool(generate_keypair, size=int(os.getenv("WG_KEY_POOL_SIZE", "64")))
+wireguard = WireguardConfig(resolver=geo_resolver, key_pool=wg_key_pool,
+                            server_public_key=os.getenv("WG_SERVER_PUBLIC_KEY") or None)
 
 # دکمه‌های غیرفعال
 DISABLED_BUTTONS = {
@@ -75,6 +102,8 @@ BOT_TOKEN = os.getenv("BOT_TOKEN", "8093306771:AAFc2Cp6MrHxPvgj8GPuJcikC0Sqh6LOG
 # Conversation states
 ENTER_ACTIVATION, ENTER_NEW_CODE, ENTER_NEW_IPV4, ENTER_COUNTRY_NAME, ENTER_COUNTRY_FLAG, CHOOSE_CODE_TYPE, ENTER_TOKEN_COUNT, ENTER_IP_FOR_VALIDATION, ENTER_BROADCAST_MESSAGE, ENTER_CHANNEL_LINK, ENTER_BATCH_IPS, ENTER_BATCH_ENDPOINTS = range(
     12)
+UPLOAD_BACKUP_PARTS = 40  # دریافت فایل یا بخش‌های بکاپ برای بازیابی
+BOT_DOWNLOAD_LIMIT = 20 * 1024 * 1024  # حداکثر حجم فایلی که ربات می‌تواند دریافت کند
 
 # متغیرهای مورد نیاز برای قابلیت‌های جدید
 PENDING_IPS = {}  # ذخیره‌سازی درخواست‌های IP منتظر تایید ادمین
@@ -89,7 +118,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-db = DBManager()
+# پشتیبان پایگاه داده: pickle (پیش‌فرض) یا sqlite
+DB_BACKEND = os.getenv("DB_BACKEND", "pickle")
+
+if DB_BACKEND == "sqlite":
+    # در اولین اجرا داده‌های فایل pickle به SQLite منتقل می‌شوند
+    if not os.path.exists(SQLITE_FILE) and os.path.exists(DB_FILE):
+        db = migrate_pickle_to_sqlite()
+    else:
+        db = SQLiteDBManager()
+else:
+    # حالت ذخیره‌سازی: snapshot (پیش‌فرض، ذخیره کامل در هر تغییر) یا journal (ثبت افزایشی
+    # تغییرات در bot_database.journal و ادغام دوره‌ای در اسنپ‌شات)
+    # DB_SAVE_INTERVAL: حداقل فاصله ذخیره‌سازی پس‌زمینه به ثانیه (0 = ذخیره همزمان، پیش‌فرض)؛
+    # با مقدار بزرگ‌تر از صفر تغییرات همین بازه زمانی در صورت کرش از دست می‌روند
+    # DB_COMPACT_IPS=1: نگهداری IPها به صورت اعداد ۴ بایتی برای کاهش مصرف حافظه
+    db = DBManager(storage_mode=os.getenv("DB_STORAGE_MODE", "snapshot"),
+                   save_interval=float(os.getenv("DB_SAVE_INTERVAL", "0")),
+                   compact_ips=os.getenv("DB_COMPACT_IPS", "0") == "1")
+
+# اضافه کردن قابلیت بکاپ‌گیری خودکار
+# بازیابی بکاپ مستقیماً داده‌های db را جایگزین می‌کند و نیازی به راه‌اندازی مجدد نیست
+# در حالت sqlite فایل pickle قدیمی است؛ بکاپ از وضعیت فعلی SQLite ساخته می‌شود
+backup_mgr = BackupManager(backup_interval=3600*6, max_backups=10,  # هر 6 ساعت با نگهداری 10 بکاپ
+                           restore_handler=db.restore_snapshot,
+                           snapshot_source=((lambda: encode_snapshot(db.export_state()))
+                                            if DB_BACKEND == "sqlite" else None))
+
+# ارسال پیام‌های همگانی در پس‌زمینه با محدودیت نرخ (BROADCAST_RATE پیام در ثانیه) و ادامه پس از راه‌اندازی مجدد
+# کاربرانی که ربات را مسدود یا حساب خود را حذف کرده‌اند ثبت و از ارسال‌های بعدی کنار گذاشته می‌شوند
+broadcaster = BroadcastManager(rate=float(os.getenv("BROADCAST_RATE", "25")),
+                               on_unreachable=db.mark_user_unreachable)
+
+# تمام کسر و افزایش توکن‌ها از دفتر توکن با قفل جداگانه برای هر کاربر انجام می‌شود
+# موجودی‌ها و گزارش مصرف (token_ledger.log) هر TOKEN_FLUSH_INTERVAL ثانیه یک‌جا ذخیره می‌شوند
+token_ledger = TokenLedger(db, flush_interval=float(os.getenv("TOKEN_FLUSH_INTERVAL", "2")))
+
+# منوهای کشورها یک بار ساخته می‌شوند و تا تغییر بعدی کشورها/IPها/لوکیشن‌ها دوباره استفاده می‌شوند
+view_cache = ViewCache(lambda: db.catalog_version)
+
+# مسیریاب دکمه‌ها (یک CallbackQueryHandler به جای ده‌ها الگوی regex) به همراه آمار زمان پاسخ هر مسیر
+callback_router = CallbackRouter()
 
 
 def send_reply(update: Update, text: str, **kwargs):
@@ -182,6 +251,8 @@ def cb_subscription_status(update: Update, context: CallbackContext) -> None:
 
 def start(update: Update, context: CallbackContext) -> None:
     user_id = update.effective_user.id
+    # کاربری که دوباره ربات را استارت کرده، دوباره پیام‌های همگانی را دریافت می‌کند
+    db.mark_user_reachable(user_id)
 
     # بررسی عضویت در کانال اجباری (اگر تنظیم شده باشد)
     if REQUIRED_CHANNEL and user_id != ADMIN_ID:
@@ -378,9 +449,13 @@ def cb_generate_option(update: Update, context: CallbackContext) -> None:
                 reply_markup=main_menu_keyboard(user_id))
             return
 
-        # کم کردن یک توکن و به‌روزرسانی پایگاه داده
-        db.active_users[user_id]['tokens'] = current_tokens - 1
-        db.save_database()
+        # کم کردن یک توکن
+        if not token_ledger.charge(user_id, 1, "ipv6").ok:
+            send_reply(
+                update,
+                "❌ توکن شما تمام شده است. لطفاً اشتراک خود را تمدید کنید.",
+                reply_markup=main_menu_keyboard(user_id))
+            return
 
     ipv6_list = generate_ipv6(option)
     formatted_ipv6 = "\n".join(f"`{address}`" for address in ipv6_list)
@@ -396,13 +471,11 @@ def cb_generate_option(update: Update, context: CallbackContext) -> None:
                parse_mode=ParseMode.MARKDOWN)
 
 
-@require_subscription
-def cb_get_ipv4(update: Update, context: CallbackContext) -> None:
+def build_ipv4_country_menu():
+    """ساخت متن و کیبورد فهرست کشورها (فقط پس از تغییر داده‌ها، از طریق view_cache)"""
     country_ips = db.get_ipv4_countries()
     if not country_ips:
-        text = "ℹ️ هیچ IPv4 ذخیره‌شده‌ای یافت نشد."
-        send_reply(update, text)
-        return
+        return "ℹ️ هیچ IPv4 ذخیره‌شده‌ای یافت نشد.", None
 
     # نقشه پرچم‌های خاص برای کشورهای مشکل‌دار
     special_flags = {
@@ -433,7 +506,7 @@ def cb_get_ipv4(update: Update, context: CallbackContext) -> None:
         if len(ips) > 0 and not db.is_location_disabled(country_code, "ipv4"):
             countries_with_ips = True
             display_flag = get_flag(country_code, flag)
-            row.append(InlineKeyboardButton(f"{display_flag} {country} ({len(ips)})", callback_data=f"country_{country_code}"))
+            row.append(InlineKeyboardButton(f"{display_flag} {country} ({len(ips)})", callback_data=encode_callback('country', country_code)))
             count += 1
             if count % 3 == 0:
                 buttons.append(row)
@@ -445,31 +518,34 @@ def cb_get_ipv4(update: Update, context: CallbackContext) -> None:
     buttons.append([InlineKeyboardButton("↩️ بازگشت", callback_data='back')])
 
     if not countries_with_ips:
-        send_reply(update, "ℹ️ هیچ کشوری با آدرس IP فعال وجود ندارد.", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data='back')]]))
-    else:
-        send_reply(update, "🌍 انتخاب کشور:", reply_markup=InlineKeyboardMarkup(buttons))
+        return "ℹ️ هیچ کشوری با آدرس IP فعال وجود ندارد.", InlineKeyboardMarkup([[InlineKeyboardButton("↩️ بازگشت", callback_data='back')]])
+    return "🌍 انتخاب کشور:", InlineKeyboardMarkup(buttons)
+
+
+@require_subscription
+def cb_get_ipv4(update: Update, context: CallbackContext) -> None:
+    text, reply_markup = view_cache.get('ipv4_countries', build_ipv4_country_menu)
+    send_reply(update, text, reply_markup=reply_markup)
 
 
 def cb_country_ips(update: Update, context: CallbackContext) -> None:
     try:
-        if '_page_' in update.callback_query.data:
-            # مدیریت صفحه‌بندی
-            parts = update.callback_query.data.split('_page_')
-            country_code = parts[0].split('_')[-1]  # آخرین بخش قبل از _page_
-            try:
-                page = int(parts[1])
-            except ValueError:
-                # اگر نتوانستیم page را به عدد تبدیل کنیم، صفحه 0 را انتخاب می کنیم
-                page = 0
-        else:
-            # درخواست اولیه
-            country_code = update.callback_query.data.split('_')[1]
-            page = 0  # صفحه اول
+        # (کلید کشور) یا (کلید کشور، صفحه)؛ دکمه‌های قدیمی به شکل country_<code>_page_<n> هستند
+        args = callback_args(update.callback_query.data, 'country_')
+        if len(args) == 1 and '_page_' in args[0]:
+            args = args[0].rsplit('_page_', 1)
+        country_code = args[0] if args else ""
+        paginated = len(args) > 1
+        try:
+            page = int(args[1]) if paginated else 0
+        except ValueError:
+            # اگر نتوانستیم page را به عدد تبدیل کنیم، صفحه 0 را انتخاب می کنیم
+            page = 0
         
         # استاندارد‌سازی کد عربستان - اضافه کردن حالت‌های بیشتر
         if country_code.upper() in ["KSA", "SAUDI", "SAUDI ARABIA", "SAUDI_ARABIA", "KINGDOMOFSAUDIARABIA"]:
             country_code = "SA"
-            logger.info(f"Saudi Arabia country code standardized: {country_code}")
+            logger.debug(f"Saudi Arabia country code standardized: {country_code}")
             
         ips = db.get_ips_by_country(country_code)
         country_data = db.get_ipv4_countries().get(country_code)
@@ -522,9 +598,9 @@ def cb_country_ips(update: Update, context: CallbackContext) -> None:
                 next_page = page + 1 if page < total_ips - 1 else 0
                 
                 pagination_buttons = [
-                    InlineKeyboardButton("◀️ قبلی", callback_data=f"country_{country_code}_page_{prev_page}"),
+                    InlineKeyboardButton("◀️ قبلی", callback_data=encode_callback('country', country_code, prev_page)),
                     InlineKeyboardButton(f"{page + 1}/{total_ips}", callback_data="noop"),
-                    InlineKeyboardButton("بعدی ▶️", callback_data=f"country_{country_code}_page_{next_page}")
+                    InlineKeyboardButton("بعدی ▶️", callback_data=encode_callback('country', country_code, next_page))
                 ]
             
             # تهیه متن پیام با شماره صفحه
@@ -536,7 +612,7 @@ def cb_country_ips(update: Update, context: CallbackContext) -> None:
             buttons.append([InlineKeyboardButton("↩️ بازگشت به لیست کشورها", callback_data='get_ipv4')])
             
             # اگر پیام قبلاً وجود دارد، آن را ویرایش کنیم، در غیر این صورت پیام جدید بفرستیم
-            if update.callback_query.message and '_page_' in update.callback_query.data:
+            if update.callback_query.message and paginated:
                 update.callback_query.edit_message_text(
                     text=text,
                     parse_mode=ParseMode.MARKDOWN,
@@ -612,7 +688,8 @@ def cb_admin_panel(update: Update, context: CallbackContext) -> None:
              InlineKeyboardButton("🔍 جستجوی کاربر", callback_data='admin_search_user')],
             [InlineKeyboardButton("📋 لیست کاربران فعال", callback_data='admin_list_active_users'),
              InlineKeyboardButton("📋 لیست کاربران غیرفعال", callback_data='admin_list_disabled_users')],
-            [InlineKeyboardButton("📢 ارسال پیام همگانی", callback_data='admin_broadcast')],
+            [InlineKeyboardButton("📢 ارسال پیام همگانی", callback_data='admin_broadcast'),
+             InlineKeyboardButton("📵 کاربران غیرقابل دسترس", callback_data='admin_unreachable_users')],
             [InlineKeyboardButton("↩️ بازگشت به منوی اصلی ادمین", callback_data='admin_menu_main')]
         ]
         send_reply(update, "👥 مدیریت کاربران:", reply_markup=InlineKeyboardMarkup(buttons))
@@ -753,6 +830,15 @@ def enter_new_ipv4(update: Update, context: CallbackContext) -> int:
 
 def cb_admin_stats(update: Update, context: CallbackContext) -> None:
     stats = db.get_stats()
+    geo_stats = geo_resolver.stats()
+    stats["کش موقعیت IP"] = (f"{geo_stats['entries']} مورد، "
+                             f"{geo_stats['hits']} hit / {geo_stats['misses']} miss "
+                             f"({geo_stats['hit_rate']}%)")
+    # کندترین دکمه‌ها بر اساس مجموع زمان پاسخ
+    latency = list(callback_router.latency_stats().items())[:5]
+    if latency:
+        stats["کندترین دکمه‌ها"] = "، ".join(
+            f"`{route}` {entry['avg_ms']}ms ({entry['calls']})" for route, entry in latency)
     text = "📊 *آمار بات:*\n" + "\n".join(f"• {k}: {v}"
                                          for k, v in stats.items())
     send_reply(update, text, parse_mode=ParseMode.MARKDOWN)
@@ -774,85 +860,6 @@ def cb_ipv4_menu(update: Update, context: CallbackContext) -> None:
     send_reply(update, "لطفاً یک گزینه انتخاب کنید:", reply_markup=InlineKeyboardMarkup(buttons))
 
 
-def cb_quick_search_ipv4(update: Update, context: CallbackContext) -> None:
-    """جستجوی سریع IPv4"""
-    send_reply(update, "🔍 لطفاً نام کشور یا بخشی از IP را وارد کنید:")
-    context.user_data['search_mode_ipv4'] = True
-    return ConversationHandler.END
-
-
-def handle_search_input_ipv4(update: Update, context: CallbackContext) -> None:
-    """پردازش متن جستجو شده توسط کاربر"""
-    if context.user_data.get('search_mode_ipv4'):
-        query = update.message.text.strip().lower()
-        results = []
-        
-        # نقشه کشورهای فارسی به انگلیسی برای جستجوی فارسی
-        persian_to_english = {
-            "ایران": "iran", 
-            "عربستان": "saudi arabia", "عربستان سعودی": "saudi arabia", "سعودی": "saudi arabia",
-            "آمریکا": "united states", "امریکا": "united states", 
-            "انگلیس": "united kingdom", "انگلستان": "united kingdom", "آلمان": "germany", "روسیه": "russia",
-            "فرانسه": "france", "چین": "china", "هند": "india", "ژاپن": "japan", "کانادا": "canada",
-            "پاکستان": "pakistan", "قطر": "qatar", "امارات": "uae", "عراق": "iraq", "کویت": "kuwait",
-            "بحرین": "bahrain", "عمان": "oman", "مصر": "egypt", "ترکیه": "turkey", "گرجستان": "georgia"
-        }
-        
-        # کد کشورهای مرتبط با عربستان
-        saudi_codes = ["sa", "ksa", "saudi", "saudi arabia", "saudi_arabia"]
-        
-        # تبدیل جستجوی فارسی به انگلیسی
-        english_query = persian_to_english.get(query, query)
-        
-        # لاگ کردن کوئری برای اشکال‌زدایی
-        logger.info(f"جستجوی کاربر: {query} -> {english_query}")
-        
-        for country_code, (country, flag, ips) in db.get_ipv4_countries().items():
-            # برای عربستان، کدهای مختلف را بررسی کنیم
-            if (country_code.lower() in saudi_codes or 
-                "saudi" in country.lower() or 
-                english_query in saudi_codes):
-                
-                # اگر جستجو مرتبط با عربستان است
-                if ("saudi" in english_query or 
-                    query == "عربستان" or 
-                    query == "عربستان سعودی" or 
-                    query == "سعودی"):
-                    results.append(f"{flag} {country}: {len(ips)} IP (کد کشور: {country_code})")
-                    logger.info(f"Saudi Arabia found: {country_code}, {country}")
-            
-            # جستجوی استاندارد در نام و کد کشور
-            elif (english_query in country.lower() or 
-                  english_query in country_code.lower() or 
-                  query in country.lower()):
-                results.append(f"{flag} {country}: {len(ips)} IP")
-            else:
-                # جستجو در آدرس‌های IP
-                for ip in ips:
-                    if query in ip:
-                        results.append(f"{flag} {country}: {ip}")
-        
-        if results:
-            # اگر تعداد نتایج زیاد است، آنها را به چند پیام تقسیم می‌کنیم
-            if len(results) > 30:
-                send_reply(update, f"🔍 {len(results)} نتیجه برای جستجوی '{query}' یافت شد.")
-                
-                for i in range(0, len(results), 30):
-                    chunk = results[i:i+30]
-                    message = f"نتایج {i+1} تا {min(i+30, len(results))}:\n" + "\n".join(chunk)
-                    update.message.reply_text(message)
-            else:
-                send_reply(update, f"🔍 نتایج جستجو برای '{query}':\n" + "\n".join(results))
-        else:
-            send_reply(update, f"❌ نتیجه‌ای برای جستجوی '{query}' یافت نشد.")
-            
-        context.user_data['search_mode_ipv4'] = False
-        
-        # بازگشت به منوی اصلی
-        buttons = [[InlineKeyboardButton("↩️ بازگشت", callback_data='ipv4_menu')]]
-        update.message.reply_text("عملیات جستجو به پایان رسید.", reply_markup=InlineKeyboardMarkup(buttons))
-
-
 def cb_latest_ips_ipv4(update: Update, context: CallbackContext) -> None:
     """نمایش آخرین IPهای اضافه شده"""
     if not hasattr(db, 'last_added_ips'):
@@ -869,79 +876,8 @@ def cb_latest_ips_ipv4(update: Update, context: CallbackContext) -> None:
     update.callback_query.message.reply_text("", reply_markup=InlineKeyboardMarkup(buttons))
 
 
-# Define global continent mapping at the module level
-CONTINENT_MAP = {
-    'AS': 'آسیا 🌏', 'EU': 'اروپا 🇪🇺', 'AF': 'آفریقا 🌍', 
-    'NA': 'آمریکای شمالی 🌎', 'SA': 'آمریکای جنوبی 🌎', 
-    'OC': 'اقیانوسیه 🏝️', 'AN': 'جنوبگان 🏔️'
-}
-
-# Global country to continent mapping
-COUNTRY_TO_CONTINENT = {
-    # آسیا - Asia
-    'IR': 'AS', 'SA': 'AS', 'AE': 'AS', 'QA': 'AS', 'TR': 'AS', 'IQ': 'AS',
-    'KW': 'AS', 'OM': 'AS', 'BH': 'AS', 'CN': 'AS', 'JP': 'AS', 'ID': 'AS',
-    'IN': 'AS', 'KR': 'AS', 'SG': 'AS', 'PK': 'AS', 'MY': 'AS', 'TH': 'AS',
-    'KSA': 'AS', 'SAUDI': 'AS', 'SAUDI ARABIA': 'AS', 'SAUDI_ARABIA': 'AS',
-    'GE': 'AS', 'IL': 'AS', 'JO': 'AS', 'LB': 'AS', 'SY': 'AS',
-    'AF': 'AS', 'BD': 'AS', 'LK': 'AS', 'NP': 'AS', 'VN': 'AS', 'HK': 'AS',
-    'YE': 'AS', 'UZ': 'AS', 'TW': 'AS', 'TJ': 'AS', 'TM': 'AS', 'KZ': 'AS',
-    'KG': 'AS', 'MO': 'AS', 'LA': 'AS', 'KH': 'AS', 'MM': 'AS', 'MN': 'AS',
-    'MV': 'AS', 'BT': 'AS', 'BN': 'AS', 'TL': 'AS', 'PS': 'AS', 'PH': 'AS',
-    
-    # اروپا - Europe
-    'DE': 'EU', 'GB': 'EU', 'FR': 'EU', 'IT': 'EU', 'ES': 'EU', 'RU': 'EU',
-    'NL': 'EU', 'CH': 'EU', 'SE': 'EU', 'PL': 'EU', 'BE': 'EU', 'AT': 'EU',
-    'NO': 'EU', 'DK': 'EU', 'FI': 'EU', 'PT': 'EU', 'IE': 'EU', 'GR': 'EU',
-    'UA': 'EU', 'CZ': 'EU', 'RO': 'EU', 'BG': 'EU', 'HU': 'EU', 'HR': 'EU',
-    'RS': 'EU', 'SK': 'EU', 'SI': 'EU', 'EE': 'EU', 'LV': 'EU', 'LT': 'EU',
-    'IS': 'EU', 'LU': 'EU', 'MT': 'EU', 'CY': 'EU', 'ME': 'EU', 'MK': 'EU',
-    'AL': 'EU', 'BA': 'EU', 'MD': 'EU', 'MC': 'EU', 'LI': 'EU', 'SM': 'EU',
-    'VA': 'EU', 'BY': 'EU', 'GI': 'EU', 'JE': 'EU', 'IM': 'EU', 'FO': 'EU',
-    
-    # آفریقا - Africa
-    'EG': 'AF', 'ZA': 'AF', 'NG': 'AF', 'MA': 'AF', 'KE': 'AF', 'TN': 'AF',
-    'DZ': 'AF', 'GH': 'AF', 'CM': 'AF', 'CI': 'AF', 'LY': 'AF', 'SD': 'AF',
-    'ET': 'AF', 'AO': 'AF', 'TZ': 'AF', 'UG': 'AF', 'ZM': 'AF', 'ZW': 'AF',
-    'SN': 'AF', 'ML': 'AF', 'MR': 'AF', 'NE': 'AF', 'TD': 'AF', 'SO': 'AF',
-    'MG': 'AF', 'RW': 'AF', 'BF': 'AF', 'GA': 'AF', 'BJ': 'AF', 'BI': 'AF',
-    'DJ': 'AF', 'ER': 'AF', 'GM': 'AF', 'GN': 'AF', 'GQ': 'AF', 'GW': 'AF',
-    'LR': 'AF', 'LS': 'AF', 'MW': 'AF', 'MU': 'AF', 'MZ': 'AF', 'NA': 'AF',
-    'SC': 'AF', 'SL': 'AF', 'SS': 'AF', 'ST': 'AF', 'SZ': 'AF', 'TG': 'AF',
-    
-    # آمریکای شمالی - North America
-    'US': 'NA', 'CA': 'NA', 'MX': 'NA', 'PA': 'NA', 'CR': 'NA', 'CU': 'NA',
-    'DO': 'NA', 'GT': 'NA', 'HN': 'NA', 'SV': 'NA', 'NI': 'NA', 'JM': 'NA',
-    'HT': 'NA', 'BS': 'NA', 'TT': 'NA', 'BB': 'NA', 'BZ': 'NA', 'PR': 'NA',
-    'DM': 'NA', 'LC': 'NA', 'VC': 'NA', 'AG': 'NA', 'KN': 'NA', 'GD': 'NA',
-    
-    # آمریکای جنوبی - South America
-    'BR': 'SA', 'AR': 'SA', 'CL': 'SA', 'CO': 'SA', 'PE': 'SA', 'VE': 'SA',
-    'EC': 'SA', 'BO': 'SA', 'PY': 'SA', 'UY': 'SA', 'GY': 'SA', 'SR': 'SA',
-    'FK': 'SA', 'GF': 'SA',
-    
-    # اقیانوسیه - Oceania
-    'AU': 'OC', 'NZ': 'OC', 'FJ': 'OC', 'PG': 'OC', 'SB': 'OC', 'VU': 'OC',
-    'KI': 'OC', 'MH': 'OC', 'WS': 'OC', 'TO': 'OC', 'TV': 'OC', 'NR': 'OC',
-    'PW': 'OC', 'FM': 'OC', 'PF': 'OC', 'NC': 'OC', 'AS': 'OC', 'CK': 'OC',
-    'GU': 'OC', 'MP': 'OC', 'NU': 'OC', 'NF': 'OC', 'TK': 'OC', 'WF': 'OC',
-    
-    # جنوبگان - Antarctica
-    'AQ': 'AN', 'BV': 'AN', 'GS': 'AN', 'HM': 'AN', 'TF': 'AN'
-}
-
-def cb_continent_list_ipv4(update: Update, context: CallbackContext) -> None:
-    """نمایش لیست قاره‌ها برای انتخاب با چیدمان دو به دو"""
-    
-    # Log available countries for debugging
-    logger.info("Available countries in database for continent grouping:")
-    all_countries = db.get_ipv4_countries()
-    logger.info(f"Total countries: {len(all_countries)}")
-    for code, data in all_countries.items():
-        if len(data) >= 3 and len(data[2]) > 0:
-            logger.info(f"Country: {code}, Name: {data[0]}, IPs: {len(data[2])}")
-    
-    # چیدمان دو به دو دکمه‌ها با ترتیب خاص
+def build_continent_list_menu():
+    """کیبورد انتخاب قاره با چیدمان دو به دو"""
     buttons = [
         [
             InlineKeyboardButton(CONTINENT_MAP['AS'], callback_data='continent_ipv4_AS'),
@@ -962,105 +898,57 @@ def cb_continent_list_ipv4(update: Update, context: CallbackContext) -> None:
             InlineKeyboardButton("↩️ بازگشت", callback_data='ipv4_menu')
         ]
     ]
-    
-    # Use global COUNTRY_TO_CONTINENT mapping that's already defined 
-    # at the module level
-    
-    send_reply(update, "🌎 یک قاره را انتخاب کنید:", reply_markup=InlineKeyboardMarkup(buttons))
+    return "🌎 یک قاره را انتخاب کنید:", InlineKeyboardMarkup(buttons)
 
 
-def cb_show_countries_by_continent_ipv4(update: Update, context: CallbackContext) -> None:
-    """نمایش کشورهای یک قاره خاص با چیدمان دو به دو"""
-    code = update.callback_query.data.split('_')[2]
-    
-    # Using the global COUNTRY_TO_CONTINENT mapping
-    # that's now defined at the module level
-    
-    # نام قاره‌ها برای نمایش
-    continent_names = {
-        'AS': 'آسیا 🌏', 'EU': 'اروپا 🇪🇺', 'AF': 'آفریقا 🌍', 
-        'NA': 'آمریکای شمالی 🌎', 'SA': 'آمریکای جنوبی 🌎', 
-        'OC': 'اقیانوسیه 🏝️', 'AN': 'جنوبگان 🏔️'
-    }
-    
-    logger.info(f"Finding countries for continent: {code}")
-    
-    # کشورهای این قاره را پیدا کن
-    countries = [k for k, v in COUNTRY_TO_CONTINENT.items() if v == code]
-    
-    if not countries:
-        send_reply(update, f"کشوری برای قاره {continent_names.get(code, code)} ثبت نشده است.")
-        return
-    
-    # تهیه لیست کشورهایی که IP دارند
-    countries_with_ips = []
+def cb_continent_list_ipv4(update: Update, context: CallbackContext) -> None:
+    """نمایش لیست قاره‌ها برای انتخاب با چیدمان دو به دو"""
+    text, reply_markup = view_cache.get('continent_list', build_continent_list_menu)
+    send_reply(update, text, reply_markup=reply_markup)
+
+
+def build_continent_countries_menu(code: str):
+    """ساخت متن و کیبورد کشورهای یک قاره (فقط پس از تغییر داده‌ها، از طریق view_cache)"""
+    continent_name = CONTINENT_MAP.get(code, code)
+    if code not in CONTINENT_MAP:
+        return f"کشوری برای قاره {continent_name} ثبت نشده است.", None
+
+    # کشورهای دارای IP از آمار زنده قاره‌ها، از قبل مرتب بر اساس تعداد IP (نزولی)
     all_ipv4_countries = db.get_ipv4_countries()
-    
-    logger.info(f"Available country codes in DB: {list(all_ipv4_countries.keys())}")
-    logger.info(f"Countries in this continent: {countries}")
-    
-    # Special handling for problematic country codes (to prevent duplicates)
-    handled_countries = set()
-    
-    # First handle Saudi Arabia specially if in Asia continent
-    if code == 'AS':
-        saudi_variants = ['SA', 'KSA', 'SAUDI', 'SAUDI ARABIA', 'SAUDI_ARABIA']
-        for variant in saudi_variants:
-            if variant in all_ipv4_countries:
-                saudi_data = all_ipv4_countries[variant]
-                if saudi_data and len(saudi_data) >= 3 and len(saudi_data[2]) > 0:
-                    countries_with_ips.append((variant, saudi_data[0], saudi_data[1], len(saudi_data[2])))
-                    logger.info(f"Added Saudi Arabia variant: {variant}, {saudi_data[0]}, {len(saudi_data[2])} IPs")
-                    # Mark all Saudi variants as handled
-                    for sv in saudi_variants:
-                        handled_countries.add(sv.upper())
-                    break
-    
-    # Process all other countries
-    for country_code in countries:
-        # Skip if already handled as a special case
-        if country_code.upper() in handled_countries:
-            continue
-            
-        # Try variants of the country code (uppercase, lowercase)
-        for code_variant in [country_code, country_code.upper(), country_code.lower()]:
-            if code_variant in all_ipv4_countries:
-                country_data = all_ipv4_countries[code_variant]
-                if country_data and len(country_data) >= 3:
-                    country_name, flag, ips = country_data[0], country_data[1], country_data[2]
-                    if len(ips) > 0:  # فقط کشورهایی که IP دارند را اضافه کن
-                        countries_with_ips.append((code_variant, country_name, flag, len(ips)))
-                        logger.info(f"Found country with IPs: {code_variant}, {country_name}, {len(ips)} IPs")
-                        handled_countries.add(country_code.upper())
-                        break
-    
+    countries_with_ips = [
+        (country_code, ip_count) for country_code, ip_count in db.get_continent_countries(code)
+        if country_code in all_ipv4_countries and not db.is_location_disabled(country_code, "ipv4")
+    ]
+
     if not countries_with_ips:
-        send_reply(update, f"هیچ کشوری با IP در قاره {continent_names.get(code, code)} یافت نشد.")
-        return
-    
-    # مرتب‌سازی کشورها بر اساس تعداد IP (نزولی)
-    countries_with_ips.sort(key=lambda x: x[3], reverse=True)
-    
+        return f"هیچ کشوری با IP در قاره {continent_name} یافت نشد.", None
+
     # ایجاد دکمه‌ها با چیدمان دو به دو
     buttons = []
     row = []
-    for i, (country_code, country_name, flag, ip_count) in enumerate(countries_with_ips):
+    for i, (country_code, ip_count) in enumerate(countries_with_ips):
+        country_name, flag = all_ipv4_countries[country_code][:2]
         row.append(InlineKeyboardButton(
             f"{flag} {country_name} ({ip_count})", 
-            callback_data=f"country_{country_code}")
+            callback_data=encode_callback('country', country_code))
         )
-        
+
         # هر دو کشور، یک ردیف جدید
         if i % 2 == 1 or i == len(countries_with_ips) - 1:
             buttons.append(row)
             row = []
-    
+
     buttons.append([InlineKeyboardButton("↩️ بازگشت", callback_data='continent_list_ipv4')])
-    
-    send_reply(update, 
-               f"🌍 کشورهای قاره {continent_names.get(code, code)} با IP:\n"
-               f"لطفاً یک کشور را انتخاب کنید:",
-               reply_markup=InlineKeyboardMarkup(buttons))
+
+    return (f"🌍 کشورهای قاره {continent_name} با IP:\n"
+            f"لطفاً یک کشور را انتخاب کنید:"), InlineKeyboardMarkup(buttons)
+
+
+def cb_show_countries_by_continent_ipv4(update: Update, context: CallbackContext) -> None:
+    """نمایش کشورهای یک قاره خاص با چیدمان دو به دو"""
+    code = update.callback_query.data.split('_')[2]
+    text, reply_markup = view_cache.get(('continent', code), build_continent_countries_menu, code)
+    send_reply(update, text, reply_markup=reply_markup)
 
 
 def error_handler(update: object, context: CallbackContext) -> None:
@@ -1107,7 +995,9 @@ def cb_admin_grant_tokens(update: Update, context: CallbackContext) -> int:
 def enter_grant_tokens(update: Update, context: CallbackContext) -> int:
     try:
         user_id, tokens = map(int, update.message.text.strip().split())
-        db.grant_tokens(user_id, tokens)
+        if not token_ledger.grant(user_id, tokens, "admin_grant"):
+            send_reply(update, f"❌ کاربری با آیدی {user_id} یافت نشد.")
+            return ConversationHandler.END
         send_reply(update,
                    f"✅ {tokens} توکن به کاربر با آیدی {user_id} افزوده شد.")
     except (ValueError, TypeError):
@@ -1207,66 +1097,28 @@ def process_ipv4_entry(update: Update, context: CallbackContext) -> int:
     return ConversationHandler.END
 
 def get_country_info(ip_address):
-    """دریافت اطلاعات کشور برای یک آدرس IP با استفاده از API"""
-    try:
-        response = requests.get(f"https://api.iplocation.net/?ip={ip_address}")
-        if response.status_code == 200:
-            data = response.json()
-            country_name = data.get('country_name', 'نامشخص')
-            country_code = data.get('country_code', '').upper()
-            
-            # نگاشت کشورهای خاص
-            special_country_codes = {
-                "Qatar": "QA", "UAE": "AE", "United Arab Emirates": "AE",
-                "Saudi Arabia": "SA", "Iran": "IR", "Iraq": "IQ",
-                "Kuwait": "KW", "Bahrain": "BH", "Oman": "OM",
-                "Egypt": "EG", "Turkey": "TR", "Russia": "RU",
-                "United States": "US", "USA": "US", "Germany": "DE",
-                "United Kingdom": "GB", "UK": "GB", "France": "FR",
-                "China": "CN", "India": "IN", "Japan": "JP",
-                "Canada": "CA", "Pakistan": "PK"
-            }
-            
-            if country_name in special_country_codes:
-                country_code = special_country_codes[country_name]
-                
-            # نگاشت پرچم‌های خاص
-            special_flags = {
-                "QA": "🇶🇦", "AE": "🇦🇪", "SA": "🇸🇦", "IR": "🇮🇷",
-                "IQ": "🇮🇶", "KW": "🇰🇼", "BH": "🇧🇭", "OM": "🇴🇲",
-                "EG": "🇪🇬", "TR": "🇹🇷", "RU": "🇷🇺", "US": "🇺🇸",
-                "DE": "🇩🇪", "GB": "🇬🇧", "FR": "🇫🇷", "CN": "🇨🇳",
-                "IN": "🇮🇳", "JP": "🇯🇵", "CA": "🇨🇦", "PK": "🇵🇰"
-            }
-            
-            flag = "🏳️"  # پرچم پیش‌فرض
-            
-            if country_code in special_flags:
-                flag = special_flags[country_code]
-            elif country_code and len(country_code) == 2:
-                try:
-                    # تبدیل کد کشور به پرچم
-                    flag_chars = []
-                    for c in country_code:
-                        if 'A' <= c <= 'Z':
-                            flag_chars.append(chr(ord(c) + 127397))
-                    if len(flag_chars) == 2:
-                        flag = "".join(flag_chars)
-                except Exception:
-                    pass
-                    
-            return country_name, flag
-    except Exception:
-        pass
-    
+    """دریافت نام و پرچم کشور برای یک آدرس IP"""
+    info = geo_resolver.lookup(ip_address)
+    if info:
+        return info['country_name'], country_flag(info['country_code'])
     return None
 
 
+def wg_server_key_missing(update: Update) -> bool:
+    """اطلاع به کاربر در صورت تنظیم نبودن کلید عمومی سرور (قبل از کسر توکن)"""
+    if wireguard.server_public_key:
+        return False
+    logger.error("WG_SERVER_PUBLIC_KEY تنظیم نشده است؛ ساخت کانفیگ وایرگارد ممکن نیست")
+    send_reply(update, "❌ ساخت کانفیگ وایرگارد فعلاً ممکن نیست. لطفاً با ادمین تماس بگیرید.")
+    return True
+
+
 def generate_wireguard_config() -> str:
     """تولید پیکربندی وایرگارد."""
-    # تولید کلیدهای خصوصی و عمومی
-    private_key = ''.join(random.choices('abcdef0123456789', k=44))
-    public_key = ''.join(random.choices('abcdef0123456789', k=44))
+    if not wireguard.server_public_key:
+        raise ValueError("کلید عمومی سرور وایرگارد تنظیم نشده است")
+    # تولید کلید خصوصی کلاینت؛ کلید [Peer] کلید عمومی سرور است
+    private_key, _ = wireguard.generate_keypair()
 
     # انتخاب تصادفی آدرس سرور و پورت
     server_ip = f"162.159.{random.randint(1, 255)}.{random.randint(1, 255)}"
@@ -1279,7 +1131,7 @@ Address = 10.66.66.2/32
 DNS = 1.1.1.1, 8.8.8.8
 
 [Peer]
-PublicKey = {public_key}
+PublicKey = {wireguard.server_public_key}
 AllowedIPs = 0.0.0.0/0, ::/0
 Endpoint = {server_ip}:{port}
 PersistentKeepalive = 25
@@ -1509,13 +1361,20 @@ def cb_wg_select_dns(update: Update, context: CallbackContext) -> None:
     
     # ذخیره DNS انتخاب شده
     context.user_data['wg_dns'] = dns
+
+    if wg_server_key_missing(update):
+        return
     
     # کسر توکن‌ها (اگر حساب توکنی باشد)
     user_data = db.active_users.get(user_id, {})
     if user_data.get('type') == 'token':
-        # کم کردن ۲ توکن و به‌روزرسانی پایگاه داده
-        db.active_users[user_id]['tokens'] = user_data.get('tokens', 0) - 2
-        db.save_database()
+        # کم کردن ۲ توکن
+        if not token_ledger.charge(user_id, 2, "wireguard").ok:
+            send_reply(
+                update,
+                "❌ توکن کافی ندارید. برای ساخت کانفیگ وایرگارد ۲ توکن نیاز است.",
+                reply_markup=main_menu_keyboard(user_id))
+            return
     
     # انتخاب endpoint مناسب
     endpoints = db.get_endpoints()
@@ -1526,12 +1385,8 @@ def cb_wg_select_dns(update: Update, context: CallbackContext) -> None:
         import random
         endpoint = random.choice(endpoints)
     
-    # تولید کانفیگ وایرگارد با تنظیمات انتخاب شده
-    from wg import WireguardConfig
-    wg = WireguardConfig()
-    
-    private_key = wg.generate_private_key()
-    public_key = wg.generate_public_key()
+    # تولید کانفیگ وایرگارد با تنظیمات انتخاب شده (جفت کلید آماده از استخر)
+    private_key, _ = wireguard.generate_keypair()
     
     # انتخاب MTU تصادفی از بین مقادیر معمول
     mtu = random.choice([1280, 1380, 1420, 1480])
@@ -1547,23 +1402,15 @@ DNS = {context.user_data['wg_dns']}
 MTU = {mtu}
 
 [Peer]
-PublicKey = {public_key}
+PublicKey = {wireguard.server_public_key}
 AllowedIPs = 0.0.0.0/0, ::/0
 Endpoint = {endpoint}:{context.user_data['wg_port']}
 PersistentKeepalive = {keepalive}
 """
     
-    # تلاش برای دریافت اطلاعات کشور endpoint
-    try:
-        import requests
-        response = requests.get(f"https://api.iplocation.net/?ip={endpoint}")
-        if response.status_code == 200:
-            country_data = response.json()
-            country = country_data.get('country_name', 'نامشخص')
-        else:
-            country = 'نامشخص'
-    except Exception:
-        country = 'نامشخص'
+    # دریافت اطلاعات کشور endpoint (از کش مشترک موقعیت IP)
+    info = geo_resolver.lookup(endpoint)
+    country = info['country_name'] if info else 'نامشخص'
     
     # نمایش کانفیگ به کاربر
     message = f"✅ کانفیگ وایرگارد با موفقیت ایجاد شد!\n\n"
@@ -1595,6 +1442,95 @@ PersistentKeepalive = {keepalive}
                reply_markup=InlineKeyboardMarkup(buttons))
 
 
+def cb_noop(update: Update, context: CallbackContext) -> None:
+    """دکمه‌های فقط نمایشی (مانند شماره صفحه)"""
+    update.callback_query.answer()
+
+
+def register_callback_routes(router: CallbackRouter) -> None:
+    """ثبت مسیر تمام دکمه‌هایی که خارج از کانورسیشن‌ها پردازش می‌شوند"""
+    router.exact('support', support_command)
+    router.exact('wireguard', cb_wireguard)
+    router.exact('check_membership', cb_check_membership)
+    router.exact('channel_help', cb_channel_help)
+    router.exact('admin_menu_main', cb_admin_menu_main)
+    router.exact('admin_menu_ip', cb_admin_menu_ip)
+    router.exact('admin_menu_subscription', cb_admin_menu_subscription)
+    router.exact('admin_menu_users', cb_admin_menu_users)
+    router.exact('admin_menu_wireguard', cb_admin_menu_wireguard)
+    router.exact('admin_menu_settings', cb_admin_menu_settings)
+    router.exact('admin_manage_sub_ipv4', cb_admin_manage_sub_ipv4)
+    router.exact('admin_manage_main_buttons', cb_admin_manage_main_buttons)
+    router.exact('confirm_add_batch_ips', cb_confirm_add_batch_ips)
+    router.exact('confirm_add_batch_ips_notify', cb_confirm_add_batch_ips_notify)
+    router.exact('cancel_add_batch_ips', cb_cancel_add_batch_ips)
+    router.prefix('wg_addr_', cb_wg_select_address)
+    router.prefix('wg_port_', cb_wg_select_port)
+    router.prefix('wg_dns_', cb_wg_select_dns)
+    router.exact('wg_batch', cb_wg_batch)
+    router.prefix('wg_batch_', cb_wg_batch_generate)
+    router.exact('admin_panel', cb_admin_panel)
+    router.exact('generate_ipv6', cb_generate)
+    router.prefix('gen_', cb_generate_option)
+    router.exact('get_ipv4', cb_get_ipv4)
+    router.prefix('country_', cb_country_ips)
+    router.exact('admin_stats', cb_admin_stats)
+    router.exact('admin_unreachable_users', cb_admin_unreachable_users)
+    router.exact('back', cb_back)
+    router.exact('admin_shutdown', cb_admin_shutdown)
+    router.exact('noop', cb_noop)
+    router.exact('user_account', cb_user_account)
+    router.exact('subscription_status', cb_subscription_status)
+    router.exact('admin_startup', cb_admin_startup)
+    router.prefix('add_validated_ip_', cb_add_validated_ip)
+    router.exact('ipv4_menu', cb_ipv4_menu)
+    router.exact('quick_search_ipv4', cb_quick_search_ipv4)
+    router.exact('latest_ips_ipv4', cb_latest_ips_ipv4)
+    router.prefix('iprange_', cb_ip_range_page)
+    router.exact('continent_list_ipv4', cb_continent_list_ipv4)
+    router.prefix('continent_ipv4_', cb_show_countries_by_continent_ipv4)
+    router.prefix('request_add_ip_', cb_request_add_ip)
+    router.prefix('approve_ip_', cb_approve_ip)
+    router.prefix('reject_ip_', cb_reject_ip)
+    router.exact('admin_manage_users', cb_admin_manage_users)
+    router.exact('admin_manage_locations', cb_admin_manage_locations)
+    router.exact('manage_ipv4', cb_manage_ipv4)
+    router.exact('disable_ipv4_menu', cb_disable_ipv4_menu)
+    router.exact('enable_ipv4_menu', cb_enable_ipv4_menu)
+    router.prefix('disable_ipv4_', cb_disable_ipv4)
+    router.prefix('enable_ipv4_', cb_enable_ipv4)
+    router.exact('manage_ipv4_buttons', cb_manage_ipv4_buttons)
+    router.prefix('toggle_ipv4_', cb_toggle_ipv4)
+    router.exact('admin_view_codes', cb_admin_view_codes)
+    router.exact('manage_ipv6', cb_manage_ipv6)
+    router.exact('disable_ipv6_menu', cb_disable_ipv6_menu)
+    router.exact('enable_ipv6_menu', cb_enable_ipv6_menu)
+    router.prefix('disable_ipv6_', cb_disable_ipv6)
+    router.prefix('enable_ipv6_', cb_enable_ipv6)
+    router.exact('manage_ipv6_buttons', cb_manage_ipv6_buttons)
+    router.prefix('toggle_ipv6_', cb_toggle_ipv6)
+    router.exact('admin_remove_ipv4', cb_admin_remove_ipv4)
+    router.prefix('remove_country_', cb_remove_country_ips)
+    router.prefix('remove_ip_', cb_remove_ip)
+    router.exact('admin_manage_backups', cb_admin_manage_backups)
+    router.exact('create_backup', cb_create_backup)
+    router.exact('restore_last_backup', cb_restore_last_backup)
+    router.exact('enable_auto_backup', cb_toggle_auto_backup)
+    router.exact('disable_auto_backup', cb_toggle_auto_backup)
+    router.exact('send_latest_backup', cb_send_latest_backup)
+    router.exact('disabled_button', cb_disabled_button)
+    router.exact('admin_manage_buttons', cb_admin_manage_buttons)
+    router.prefix('admin_enable_button_', cb_admin_toggle_button)
+    router.prefix('admin_disable_button_', cb_admin_toggle_button)
+
+    # دکمه‌هایی که با encode_callback ساخته می‌شوند (کلید کشور می‌تواند شامل _ باشد)
+    router.action('country', cb_country_ips)
+    router.action('disable_ipv4', cb_disable_ipv4)
+    router.action('enable_ipv4', cb_enable_ipv4)
+    router.action('toggle_ipv4', cb_toggle_ipv4)
+    router.action('remove_country', cb_remove_country_ips)
+
+
 def main() -> None:
     # مکانیزم قفل برای جلوگیری از اجرای چندگانه ربات
     import os
@@ -1615,35 +1551,6 @@ def main() -> None:
         logger.error("یک نمونه دیگر از ربات در حال اجراست. خروج...")
         sys.exit(1)
     
-    # عادی‌سازی کلیدهای کشورها برای حل مشکل عربستان و سایر کشورها
-    normalized_keys = {}
-    # ادغام کلیدهای تکراری کشورها با نام‌های مشابه
-    for country_code in list(db.ipv4_data.keys()):
-        normalized_key = country_code.lower().replace(' ', '_')
-        if normalized_key in normalized_keys:
-            # این کشور قبلاً با کلید مشابهی اضافه شده است
-            primary_key = normalized_keys[normalized_key]
-            if country_code != primary_key:
-                # ادغام داده‌ها
-                old_name, old_flag, old_ips = db.ipv4_data[primary_key]
-                _, _, new_ips = db.ipv4_data[country_code]
-
-                # ادغام لیست آی‌پی‌ها و حذف موارد تکراری
-                merged_ips = old_ips.copy()
-                for ip in new_ips:
-                    if ip not in merged_ips:
-                        merged_ips.append(ip)
-
-                # به‌روزرسانی داده‌ها
-                db.ipv4_data[primary_key] = (old_name, old_flag, merged_ips)
-                del db.ipv4_data[country_code]
-                logger.info(f"کشور {country_code} با {primary_key} ادغام شد")
-        else:
-            normalized_keys[normalized_key] = country_code
-
-    # ذخیره تغییرات
-    db.save_database()
-
     # شروع بکاپ‌گیری خودکار
     backup_mgr.start_backup_thread()
 
@@ -1655,10 +1562,6 @@ def main() -> None:
         'help', support_command))  # Changed help command handler
     dp.add_handler(CommandHandler('stop',
                                   stop_command))  # اضافه کردن دستور توقف
-    dp.add_handler(CallbackQueryHandler(
-        support_command, pattern='^support$'))  #Added support callback handler
-    dp.add_handler(CallbackQueryHandler(
-        cb_wireguard, pattern='^wireguard$'))  #اضافه کردن هندلر وایرگارد
 
     # کانورسیشن هندلرها
     activate_conv = ConversationHandler(
@@ -1891,169 +1794,34 @@ def main() -> None:
         ],
     )
     dp.add_handler(batch_endpoints_conv)
-    
-    # هندلرهای جدید سیستم کانال اجباری
-    dp.add_handler(CallbackQueryHandler(cb_check_membership, pattern='^check_membership$'))
-    dp.add_handler(CallbackQueryHandler(cb_channel_help, pattern='^channel_help$'))
-    
-    # هندلرهای منوی ادمین بهبود یافته
-    dp.add_handler(CallbackQueryHandler(cb_admin_menu_main, pattern='^admin_menu_main$'))
-    dp.add_handler(CallbackQueryHandler(cb_admin_menu_ip, pattern='^admin_menu_ip$'))
-    dp.add_handler(CallbackQueryHandler(cb_admin_menu_subscription, pattern='^admin_menu_subscription$'))
-    dp.add_handler(CallbackQueryHandler(cb_admin_menu_users, pattern='^admin_menu_users$'))
-    dp.add_handler(CallbackQueryHandler(cb_admin_menu_wireguard, pattern='^admin_menu_wireguard$'))
-    dp.add_handler(CallbackQueryHandler(cb_admin_menu_settings, pattern='^admin_menu_settings$'))
-    
-    # هندلرهای سیستم مدیریت دکمه‌های بهبود یافته
-    dp.add_handler(CallbackQueryHandler(cb_admin_manage_sub_ipv4, pattern='^admin_manage_sub_ipv4$'))
-    dp.add_handler(CallbackQueryHandler(cb_admin_manage_main_buttons, pattern='^admin_manage_main_buttons$'))
-    
-    # هندلرهای تأیید افزودن IP گروهی
-    dp.add_handler(CallbackQueryHandler(cb_confirm_add_batch_ips, pattern='^confirm_add_batch_ips$'))
-    dp.add_handler(CallbackQueryHandler(cb_confirm_add_batch_ips_notify, pattern='^confirm_add_batch_ips_notify$'))
-    dp.add_handler(CallbackQueryHandler(cb_cancel_add_batch_ips, pattern='^cancel_add_batch_ips$'))
-    
-    # هندلرهای وایرگارد بهبود یافته
-    dp.add_handler(CallbackQueryHandler(cb_wg_select_address, pattern='^wg_addr_'))
-    dp.add_handler(CallbackQueryHandler(cb_wg_select_port, pattern='^wg_port_'))
-    dp.add_handler(CallbackQueryHandler(cb_wg_select_dns, pattern='^wg_dns_'))
-    
-    # هندلر برای صفحه‌بندی آدرس‌های IP
-    dp.add_handler(CallbackQueryHandler(cb_country_ips, pattern='^country_page_'))
-
-    # سایر هندلرها
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_panel, pattern='^admin_panel$'))
-    dp.add_handler(CallbackQueryHandler(cb_generate,
-                                        pattern='^generate_ipv6$'))
-    dp.add_handler(CallbackQueryHandler(cb_generate_option, pattern='^gen_'))
-    dp.add_handler(CallbackQueryHandler(cb_get_ipv4, pattern='^get_ipv4$'))
-    dp.add_handler(CallbackQueryHandler(cb_country_ips, pattern='^country_'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_stats, pattern='^admin_stats$'))
-    dp.add_handler(CallbackQueryHandler(cb_back, pattern='^back$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_shutdown, pattern='^admin_shutdown$'))
-    dp.add_handler(CallbackQueryHandler(lambda u, c: None, pattern='^noop$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_user_account, pattern='^user_account$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_subscription_status,
-                             pattern='^subscription_status$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_startup, pattern='^admin_startup$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_add_validated_ip,
-                             pattern='^add_validated_ip_'))
-                             
-    # هندلرهای جدید برای منوی IPv4
-    dp.add_handler(CallbackQueryHandler(cb_ipv4_menu, pattern='^ipv4_menu$'))
-    dp.add_handler(CallbackQueryHandler(cb_quick_search_ipv4, pattern='^quick_search_ipv4$'))
-    dp.add_handler(CallbackQueryHandler(cb_latest_ips_ipv4, pattern='^latest_ips_ipv4$'))
-    dp.add_handler(CallbackQueryHandler(cb_continent_list_ipv4, pattern='^continent_list_ipv4$'))
-    dp.add_handler(CallbackQueryHandler(cb_show_countries_by_continent_ipv4, pattern='^continent_ipv4_'))
-    
+
+    # بازیابی از بکاپ ارسالی ادمین (یک فایل یا چند بخش به همراه فایل مشخصات)
+    restore_upload_conv = ConversationHandler(
+        entry_points=[
+            CommandHandler('restore_backup', cb_restore_from_upload),
+            CallbackQueryHandler(cb_restore_from_upload, pattern='^restore_from_upload$')
+        ],
+        states={
+            UPLOAD_BACKUP_PARTS: [
+                MessageHandler(Filters.document, receive_backup_part)
+            ]
+        },
+        fallbacks=[
+            CallbackQueryHandler(cb_back, pattern='^back$'),
+            CommandHandler('stop', stop_command)
+        ],
+    )
+    dp.add_handler(restore_upload_conv)
+
+    # تمام دکمه‌های خارج از کانورسیشن‌ها از یک هندلر و با جستجوی دیکشنری مسیریابی می‌شوند
+    register_callback_routes(callback_router)
+    dp.add_handler(CallbackQueryHandler(callback_router.dispatch))
+
     # هندلر برای جستجوی متنی
     dp.add_handler(MessageHandler(Filters.text & ~Filters.command & ~Filters.update.edited_message, 
                                   handle_search_input_ipv4, 
                                   pass_user_data=True))
 
-    # هندلرهای جدید برای درخواست و تایید/رد IP
-    dp.add_handler(
-        CallbackQueryHandler(cb_request_add_ip, pattern='^request_add_ip_'))
-    dp.add_handler(CallbackQueryHandler(cb_approve_ip, pattern='^approve_ip_'))
-    dp.add_handler(CallbackQueryHandler(cb_reject_ip, pattern='^reject_ip_'))
-
-    # هندلرهای مدیریت کاربران
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_manage_users,
-                             pattern='^admin_manage_users$'))
-
-    # هندلرهای مدیریت لوکیشن‌ها
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_manage_locations,
-                             pattern='^admin_manage_locations$'))
-
-    # هندلرهای مدیریت IPv4
-    dp.add_handler(
-        CallbackQueryHandler(cb_manage_ipv4, pattern='^manage_ipv4$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_disable_ipv4_menu,
-                             pattern='^disable_ipv4_menu$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_enable_ipv4_menu,
-                             pattern='^enable_ipv4_menu$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_disable_ipv4, pattern='^disable_ipv4_'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_enable_ipv4, pattern='^enable_ipv4_'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_manage_ipv4_buttons,
-                             pattern='^manage_ipv4_buttons$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_toggle_ipv4, pattern='^toggle_ipv4_'))
-        
-    # هندلر برای مشاهده کدهای فعال‌سازی
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_view_codes, pattern='^admin_view_codes$'))
-
-    # هندلرهای مدیریت IPv6
-    dp.add_handler(
-        CallbackQueryHandler(cb_manage_ipv6, pattern='^manage_ipv6$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_disable_ipv6_menu,
-                             pattern='^disable_ipv6_menu$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_enable_ipv6_menu,
-                             pattern='^enable_ipv6_menu$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_disable_ipv6, pattern='^disable_ipv6_'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_enable_ipv6, pattern='^enable_ipv6_'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_manage_ipv6_buttons,
-                             pattern='^manage_ipv6_buttons$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_toggle_ipv6, pattern='^toggle_ipv6_'))
-
-    # هندلرهای حذف آدرس IP
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_remove_ipv4,
-                             pattern='^admin_remove_ipv4$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_remove_country_ips,
-                             pattern='^remove_country_'))
-    dp.add_handler(CallbackQueryHandler(cb_remove_ip, pattern='^remove_ip_'))
-
-    # هندلرهای مدیریت بکاپ
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_manage_backups,
-                             pattern='^admin_manage_backups$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_create_backup,
-                             pattern='^create_backup$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_restore_last_backup,
-                             pattern='^restore_last_backup$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_toggle_auto_backup,
-                             pattern='^(enable|disable)_auto_backup$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_send_latest_backup,
-                             pattern='^send_latest_backup$'))
-
-    # هندلر دکمه‌های غیرفعال
-    dp.add_handler(
-        CallbackQueryHandler(cb_disabled_button, pattern='^disabled_button$'))
-
-    # هندلرهای مدیریت دکمه‌ها
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_manage_buttons,
-                             pattern='^admin_manage_buttons$'))
-    dp.add_handler(
-        CallbackQueryHandler(cb_admin_toggle_button,
-                             pattern='^admin_(enable|disable)_button_'))
-
     # هندلر خطاها
     dp.add_error_handler(error_handler)
 
@@ -2062,7 +1830,13 @@ def main() -> None:
     def cleanup_and_exit(signum=None, frame=None):
         logger.info("در حال خروج و پاکسازی منابع...")
         backup_mgr.stop_backup_thread()
+        broadcaster.stop()
+        wg_key_pool.stop()
         updater.stop()
+        # نوشتن تغییرات معوق دفتر توکن، پایگاه داده و کش موقعیت IP پیش از خروج
+        token_ledger.stop()
+        db.close()
+        geo_resolver.close()
         logger.info("ربات با موفقیت متوقف شد")
     
     # ثبت تابع پاکسازی برای سیگنال‌های خروج
@@ -2072,6 +1846,9 @@ def main() -> None:
     
     try:
         logger.info("Bot started successfully ✅")
+        broadcaster.start(updater.bot)
+        token_ledger.start()
+        wg_key_pool.start()
         updater.start_polling(clean=True)
         updater.idle()
     except Exception as e:
@@ -2119,7 +1896,7 @@ def cb_admin_remove_ipv4(update: Update, context: CallbackContext) -> int:
             buttons.append([
                 InlineKeyboardButton(
                     f"{flag} {country} ({len(ips)})",
-                    callback_data=f"remove_country_{country_code}")
+                    callback_data=encode_callback('remove_country', country_code))
             ])
 
     if not has_countries_with_ips:
@@ -2136,7 +1913,7 @@ def cb_admin_remove_ipv4(update: Update, context: CallbackContext) -> int:
 
 def cb_remove_country_ips(update: Update, context: CallbackContext) -> int:
     """نمایش آدرس‌های IP یک کشور برای حذف."""
-    country_code = update.callback_query.data.split('_')[2]
+    country_code = callback_args(update.callback_query.data, 'remove_country_')[0]
     ips = db.get_ips_by_country(country_code)
 
     if not ips:
@@ -2289,7 +2066,7 @@ def cb_disable_ipv4_menu(update: Update, context: CallbackContext) -> None:
             buttons.append([
                 InlineKeyboardButton(
                     f"{info['flag']} {info['name']} ({info['ipv4_count']} IP)",
-                    callback_data=f'disable_ipv4_{country_code}')
+                    callback_data=encode_callback('disable_ipv4', country_code))
             ])
 
     if not buttons:
@@ -2314,7 +2091,7 @@ def cb_enable_ipv4_menu(update: Update, context: CallbackContext) -> None:
             buttons.append([
                 InlineKeyboardButton(
                     f"{info['flag']} {info['name']} ({info['ipv4_count']} IP)",
-                    callback_data=f'enable_ipv4_{country_code}')
+                    callback_data=encode_callback('enable_ipv4', country_code))
             ])
 
     if not buttons:
@@ -2380,7 +2157,7 @@ def cb_enable_ipv6_menu(update: Update, context: CallbackContext) -> None:
 
 def cb_disable_ipv4(update: Update, context: CallbackContext) -> None:
     """غیرفعال کردن IPv4 یک لوکیشن خاص."""
-    country_code = update.callback_query.data.split('_')[2]
+    country_code = callback_args(update.callback_query.data, 'disable_ipv4_')[0]
     result = db.disable_location(country_code, "ipv4")
 
     if result:
@@ -2405,7 +2182,7 @@ def cb_disable_ipv4(update: Update, context: CallbackContext) -> None:
 
 def cb_enable_ipv4(update: Update, context: CallbackContext) -> None:
     """فعال کردن IPv4 یک لوکیشن خاص."""
-    country_code = update.callback_query.data.split('_')[2]
+    country_code = callback_args(update.callback_query.data, 'enable_ipv4_')[0]
     result = db.enable_location(country_code, "ipv4")
 
     if result:
@@ -2620,29 +2397,56 @@ def enter_broadcast_message(update: Update, context: CallbackContext) -> int:
     # تایید دریافت پیام
     status_message = update.message.reply_text("🔄 در حال ارسال پیام همگانی...")
 
-    # ارسال پیام به همه کاربران فعال
-    success_count = 0
-    fail_count = 0
+    # ارسال پیام به همه کاربران فعال در پس‌زمینه؛ پیشرفت روی همین پیام وضعیت نمایش داده می‌شود
+    broadcaster.submit(f"📢 *پیام مهم از مدیریت*\n\n{message_text}",
+                       db.get_broadcast_recipients(),
+                       status_chat_id=status_message.chat_id,
+                       status_message_id=status_message.message_id,
+                       parse_mode=ParseMode.MARKDOWN)
 
-    for user_id in db.active_users:
-        try:
-            context.bot.send_message(
-                chat_id=user_id,
-                text=f"📢 *پیام مهم از مدیریت*\n\n{message_text}",
-                parse_mode=ParseMode.MARKDOWN)
-            success_count += 1
-        except Exception as e:
-            logger.error(f"خطا در ارسال پیام به کاربر {user_id}: {e}")
-            fail_count += 1
+    return ConversationHandler.END
 
-    # به‌روزرسانی پیام وضعیت
-    status_message.edit_text(f"✅ پیام همگانی ارسال شد.\n\n"
-                             f"📊 آمار ارسال:\n"
-                             f"✅ موفق: {success_count}\n"
-                             f"❌ ناموفق: {fail_count}\n"
-                             f"📋 کل: {success_count + fail_count}")
 
-    return ConversationHandler.END
+# عنوان وضعیت‌های تحویل در گزارش ادمین
+DELIVERY_STATUS_LABELS = {
+    DELIVERY_BLOCKED: "⛔ ربات را مسدود کرده‌اند",
+    DELIVERY_CHAT_NOT_FOUND: "❓ گفتگو یافت نشد",
+    DELIVERY_DEACTIVATED: "🗑 حساب حذف شده",
+}
+
+
+def cb_admin_unreachable_users(update: Update, context: CallbackContext) -> None:
+    """گزارش کاربرانی که در ارسال‌های همگانی غیرقابل دسترس شناخته شده‌اند."""
+    if update.callback_query.from_user.id != ADMIN_ID:
+        update.callback_query.answer("شما دسترسی به این بخش را ندارید.")
+        return
+
+    unreachable = db.get_unreachable_users()
+    buttons = [[InlineKeyboardButton("↩️ بازگشت", callback_data='admin_menu_users')]]
+    if not unreachable:
+        send_reply(update, "✅ هیچ کاربر غیرقابل دسترسی ثبت نشده است.",
+                   reply_markup=InlineKeyboardMarkup(buttons))
+        return
+
+    counts = {}
+    for state in unreachable.values():
+        counts[state['status']] = counts.get(state['status'], 0) + 1
+
+    text = f"📵 کاربران غیرقابل دسترس: {len(unreachable)}\n"
+    text += "این کاربران در ارسال‌های همگانی نادیده گرفته می‌شوند تا وقتی دوباره ربات را استارت کنند.\n\n"
+    for status, count in counts.items():
+        text += f"• {DELIVERY_STATUS_LABELS.get(status, status)}: {count}\n"
+
+    # جدیدترین موارد
+    latest = sorted(unreachable.items(), key=lambda item: item[1].get('since', 0), reverse=True)
+    text += "\n🕒 آخرین موارد:\n"
+    for user_id, state in latest[:20]:
+        since = time.strftime('%Y-%m-%d', time.localtime(state.get('since', 0)))
+        text += f"• {user_id} - {DELIVERY_STATUS_LABELS.get(state['status'], state['status'])} ({since})\n"
+    if len(latest) > 20:
+        text += f"... و {len(latest) - 20} کاربر دیگر"
+
+    send_reply(update, text, reply_markup=InlineKeyboardMarkup(buttons))
 
 
 def cb_admin_set_channel(update: Update, context: CallbackContext) -> int:
@@ -2790,6 +2594,10 @@ def cb_admin_batch_process_ip(update: Update, context: CallbackContext) -> int:
     return ENTER_BATCH_IPS
 
 
+# حداقل فاصله ویرایش پیام پیشرفت پردازش گروهی به ثانیه
+BATCH_PROGRESS_INTERVAL = 2.0
+
+
 def process_batch_ips(update: Update, context: CallbackContext) -> int:
     """پردازش گروهی آدرس‌های IP دریافتی."""
     import re
@@ -2798,9 +2606,23 @@ def process_batch_ips(update: Update, context: CallbackContext) -> int:
     # نمایش پیام انتظار
     status_message = update.message.reply_text("🔄 در حال پردازش آدرس‌های IP... لطفاً صبر کنید.")
 
+    # نمایش پیشرفت تشخیص کشور؛ ویرایش پیام حداکثر هر چند ثانیه یک بار تا به محدودیت تلگرام نخوریم
+    last_progress_edit = [time.monotonic()]
+
+    def show_progress(done, total):
+        now = time.monotonic()
+        if done < total and now - last_progress_edit[0] < BATCH_PROGRESS_INTERVAL:
+            return
+        last_progress_edit[0] = now
+        try:
+            status_message.edit_text(
+                f"🔄 در حال تشخیص کشور آدرس‌های IP... {done}/{total} ({done * 100 // total}%)")
+        except Exception as e:
+            logger.debug(f"خطا در به‌روزرسانی پیام پیشرفت: {e}")
+
     try:
         # استخراج و پردازش آدرس‌های IP
-        ip_groups = ip_processor.process_bulk_ips(text)
+        ip_groups = ip_processor.process_bulk_ips(text, progress_callback=show_progress)
 
         if not ip_groups:
             status_message.edit_text("❌ هیچ آدرس IP معتبری در متن ارسالی یافت نشد.")
@@ -2880,29 +2702,30 @@ def complete_batch_ip_process(update: Update, context: CallbackContext, notify_u
     total_ips = context.user_data['total_ips']
     
     # اضافه کردن آدرس‌ها به دیتابیس و تولید گزارش
-    added_count = 0
+    bulk_report = db.add_ipv4_addresses_bulk(ip_groups)
+    added_count = sum(stats["added"] for stats in bulk_report.values())
+    duplicate_count = sum(stats["duplicates"] for stats in bulk_report.values())
     country_reports = []
+    new_country_reports = []  # فقط کشورهایی که آدرس جدید گرفته‌اند (برای اطلاع‌رسانی)
 
-    for country_info, ip_list in ip_groups.items():
-        country_name = country_info.split(" ", 1)[1] if " " in country_info else country_info
-        flag = country_info.split(" ")[0] if " " in country_info else "🏳️"
-
-        country_report = f"{flag} {country_name}: "
-        country_added = 0
+    for stats in bulk_report.values():
+        country_report = f"{stats['flag']} {stats['name']}: {stats['added']} آدرس"
+        if stats["added"]:
+            new_country_reports.append(country_report)
+        if stats["duplicates"]:
+            country_report += f" ({stats['duplicates']} تکراری)"
+        country_reports.append(country_report)
 
-        for ip_data in ip_list:
-            db.add_ipv4_address(country_name, flag, ip_data["ip"])
-            country_added += 1
-            added_count += 1
-
-        country_reports.append(f"{country_report}{country_added} آدرس")
+    # اطمینان از نوشته شدن دسته روی دیسک پیش از گزارش (در حالت write-behind)
+    db.flush()
     
     # ارسال گزارش نهایی
     report = f"✅ عملیات اضافه کردن IPها با موفقیت انجام شد.\n\n" \
              f"📊 گزارش:\n" \
              f"• تعداد کل IP‌های شناسایی شده: {total_ips}\n" \
              f"• تعداد IP‌های اضافه شده: {added_count}\n" \
-             f"• تعداد کشورها: {len(ip_groups)}\n\n" \
+             f"• تعداد IP‌های تکراری: {duplicate_count}\n" \
+             f"• تعداد کشورها: {len(bulk_report)}\n\n" \
              f"🌐 دسته‌بندی بر اساس کشور:\n"
     
     # نمایش همه کشورها بدون محدودیت
@@ -2916,40 +2739,30 @@ def complete_batch_ip_process(update: Update, context: CallbackContext, notify_u
     update.callback_query.message.edit_text(report)
     
     # اطلاع‌رسانی به کاربران در صورت درخواست
-    if notify_users:
+    if notify_users and new_country_reports:
         # متن اطلاع‌رسانی
         notification = "🔥 آدرس‌های جدید اضافه شدند! 🔥\n\n"
         notification += "📡 کشورهای جدید:\n"
+        notifications = []
         
         # تقسیم اطلاع‌رسانی به چند پیام اگر تعداد کشورها زیاد باشد
-        for i in range(0, len(country_reports), 20):
-            chunk = country_reports[i:i+20]
+        for i in range(0, len(new_country_reports), 20):
+            chunk = new_country_reports[i:i+20]
             chunk_notification = notification + "\n".join(f"• {report}" for report in chunk)
             
-            if i + 20 < len(country_reports):
-                chunk_notification += f"\n\n(بخش {i//20 + 1}/{(len(country_reports)+19)//20})"
+            if i + 20 < len(new_country_reports):
+                chunk_notification += f"\n\n(بخش {i//20 + 1}/{(len(new_country_reports)+19)//20})"
             
             chunk_notification += "\n\nبرای مشاهده لیست کامل به بخش «📋 لیست IPv4» مراجعه کنید."
-            
-            # ارسال هر بخش به تمام کاربران فعال
-            success_count = 0
-            fail_count = 0
-            for user_id in db.active_users:
-                if db.is_user_active(user_id):
-                    try:
-                        context.bot.send_message(chat_id=user_id, text=chunk_notification)
-                        success_count += 1
-                    except Exception as e:
-                        logger.error(f"خطا در ارسال اطلاع‌رسانی به کاربر {user_id}: {e}")
-                        fail_count += 1
-            
-            # گزارش نتیجه اطلاع‌رسانی برای هر بخش
-            if i == 0:  # فقط برای بخش اول گزارش می‌دهیم
-                update.callback_query.message.reply_text(
-                    f"📢 اطلاع‌رسانی به کاربران:\n"
-                    f"✅ موفق: {success_count}\n"
-                    f"❌ ناموفق: {fail_count}"
-                )
+            notifications.append(chunk_notification)
+        
+        # ارسال همه بخش‌ها به کاربران فعال در پس‌زمینه؛ نتیجه روی پیام وضعیت گزارش می‌شود
+        status_message = update.callback_query.message.reply_text("📢 در حال اطلاع‌رسانی به کاربران...")
+        broadcaster.submit(notifications,
+                           db.get_broadcast_recipients(active_only=True),
+                           status_chat_id=status_message.chat_id,
+                           status_message_id=status_message.message_id,
+                           title="اطلاع‌رسانی آدرس‌های جدید")
     
     # پاکسازی داده‌های موقت
     del context.user_data['ip_groups']
@@ -2984,11 +2797,12 @@ def cb_admin_manage_backups(update: Update, context: CallbackContext) -> None:
 
     backup_list = "💾 لیست بکاپ‌های موجود:\n\n"
 
-    for i, (timestamp, path) in enumerate(backups[:5], 1):  # نمایش 5 بکاپ آخر
+    for i, (timestamp, backup_id) in enumerate(backups[:5], 1):  # نمایش 5 بکاپ آخر
         # تبدیل timestamp به تاریخ خوانا
         date_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp))
-        backup_name = os.path.basename(path)
-        backup_list += f"{i}. {date_str} - {backup_name}\n"
+        info = backup_mgr.backup_info(backup_id)
+        kind = "کامل" if info["kind"] == "full" else "افزایشی"
+        backup_list += f"{i}. {date_str} - {kind} ({info['stored_size'] // 1024} KB)\n"
 
     if len(backups) > 5:
         backup_list += f"\n... و {len(backups) - 5} بکاپ دیگر"
@@ -2997,6 +2811,7 @@ def cb_admin_manage_backups(update: Update, context: CallbackContext) -> None:
         [InlineKeyboardButton("💾 ایجاد بکاپ جدید", callback_data='create_backup')],
         [InlineKeyboardButton("📤 ارسال آخرین بکاپ به ادمین", callback_data='send_latest_backup')],
         [InlineKeyboardButton("🔄 بازیابی آخرین بکاپ", callback_data='restore_last_backup')],
+        [InlineKeyboardButton("📥 بازیابی از فایل بکاپ ارسالی", callback_data='restore_from_upload')],
         [InlineKeyboardButton(f"⏱️ بکاپ خودکار: {auto_backup_status}", 
                              callback_data=auto_backup_action)],
         [InlineKeyboardButton("↩️ بازگشت", callback_data='admin_panel')]
@@ -3013,30 +2828,95 @@ def cb_admin_manage_backups(update: Update, context: CallbackContext) -> None:
 
 # --- ارسال آخرین بکاپ به ادمین ---
 def cb_send_latest_backup(update: Update, context: CallbackContext) -> None:
-    """ارسال آخرین فایل بکاپ به ادمین به صورت فایل."""
+    """ارسال آخرین بکاپ به ادمین؛ بکاپ‌های بزرگ در چند بخش شماره‌دار همراه با فایل مشخصات ارسال می‌شوند."""
     backups = backup_mgr.list_backups()
     if not backups:
         update.callback_query.answer("هیچ بکاپی وجود ندارد.")
         return
-    latest_backup_path = backups[0][1]
+    update.callback_query.answer("در حال آماده‌سازی بکاپ...")
+    # بکاپ‌ها از اشیای فشرده مشترک تشکیل شده‌اند و برای ارسال در یک فایل tar بسته‌بندی و در صورت نیاز تقسیم می‌شوند
+    files = backup_mgr.split_archive(backup_mgr.export_backup(backups[0][1]))
+    message = update.callback_query.message
     try:
-        with open(latest_backup_path, 'rb') as f:
-            update.callback_query.message.reply_document(
-                document=f,
-                filename=os.path.basename(latest_backup_path),
-                caption="📤 آخرین بکاپ دیتابیس برای شما ارسال شد."
-            )
+        for i, path in enumerate(files, 1):
+            if len(files) == 1:
+                caption = "📤 آخرین بکاپ دیتابیس برای شما ارسال شد."
+            elif i < len(files):
+                caption = f"📦 بخش {i} از {len(files) - 1}"
+            else:
+                caption = ("🧾 فایل مشخصات بکاپ چندبخشی.\n"
+                           "برای بازیابی، دستور /restore_backup را بزنید و همه بخش‌ها و این فایل را ارسال کنید.")
+            # فایل مستقیماً از دیسک خوانده و ارسال می‌شود
+            with open(path, 'rb') as f:
+                message.reply_document(document=f, filename=os.path.basename(path), caption=caption,
+                                       timeout=300)
+    except Exception as e:
+        message.reply_text(f"❌ خطا در ارسال بکاپ: {str(e)}")
+    finally:
+        for path in files:
+            os.remove(path)
+
+
+def cb_restore_from_upload(update: Update, context: CallbackContext) -> int:
+    """شروع بازیابی از بکاپ ارسالی ادمین (فایل tar یا بخش‌های آن به همراه فایل مشخصات)."""
+    user_id = update.effective_user.id
+    if user_id != ADMIN_ID:
+        send_reply(update, "⛔ فقط ادمین می‌تواند بکاپ را بازیابی کند.")
+        return ConversationHandler.END
+
+    backup_mgr.clear_upload()
+    send_reply(update,
+               "📥 فایل بکاپ (.tar) یا همه بخش‌های آن به همراه فایل مشخصات (.parts.json) را ارسال کنید.\n"
+               "پس از دریافت همه بخش‌ها بازیابی به صورت خودکار انجام می‌شود. برای لغو /stop را بزنید.")
+    return UPLOAD_BACKUP_PARTS
+
+
+def receive_backup_part(update: Update, context: CallbackContext) -> int:
+    """دریافت یک فایل یا بخش بکاپ و بازیابی پس از کامل شدن بخش‌ها."""
+    if update.message.from_user.id != ADMIN_ID:
+        return ConversationHandler.END
+
+    document = update.message.document
+    if document.file_size and document.file_size > BOT_DOWNLOAD_LIMIT:
+        update.message.reply_text("❌ حجم این فایل بیش از حد مجاز دریافت ربات (۲۰ مگابایت) است.")
+        return UPLOAD_BACKUP_PARTS
+
+    file_name = os.path.basename(document.file_name or document.file_id)
+    try:
+        document.get_file().download(custom_path=os.path.join(backup_mgr.incoming_dir, file_name))
+        status = backup_mgr.assemble_upload()
+    except Exception as e:
+        backup_mgr.clear_upload()
+        update.message.reply_text(f"❌ فایل‌های ارسالی معتبر نیستند: {str(e)}\nدوباره از ابتدا ارسال کنید.")
+        return UPLOAD_BACKUP_PARTS
+
+    if status.archive is None:
+        total = f" از {status.total}" if status.total else ""
+        update.message.reply_text(f"✅ {status.received}{total} بخش دریافت شد.")
+        return UPLOAD_BACKUP_PARTS
+
+    try:
+        backup_id = backup_mgr.import_backup(status.archive)
+        # نوشتن تغییرات معوق توکن‌ها پیش از جایگزینی داده‌ها
+        token_ledger.flush()
+        if backup_mgr.restore_backup(backup_id):
+            update.message.reply_text(f"✅ دیتابیس با موفقیت از بکاپ {backup_id} بازیابی و بارگذاری شد.")
+        else:
+            update.message.reply_text("❌ خطا در بازیابی بکاپ ارسالی.")
     except Exception as e:
-        update.callback_query.message.reply_text(f"❌ خطا در ارسال بکاپ: {str(e)}")
+        update.message.reply_text(f"❌ خطا در بازیابی بکاپ ارسالی: {str(e)}")
+    finally:
+        backup_mgr.clear_upload()
+    return ConversationHandler.END
 
 def cb_create_backup(update: Update, context: CallbackContext) -> None:
     """ایجاد بکاپ دستی از دیتابیس."""
     update.callback_query.answer("در حال ایجاد بکاپ...")
 
     try:
-        backup_file = backup_mgr.create_backup()
-        if backup_file:
-            update.callback_query.message.reply_text(f"✅ بکاپ با موفقیت ایجاد شد: {os.path.basename(backup_file)}")
+        backup_id = backup_mgr.create_backup()
+        if backup_id:
+            update.callback_query.message.reply_text(f"✅ بکاپ با موفقیت ایجاد شد: {backup_id}")
         else:
             update.callback_query.message.reply_text("❌ خطا در ایجاد بکاپ: فایل دیتابیس یافت نشد.")
     except Exception as e:
@@ -3051,11 +2931,13 @@ def cb_restore_last_backup(update: Update, context: CallbackContext) -> None:
     update.callback_query.answer("در حال بازیابی آخرین بکاپ...")
 
     try:
+        # نوشتن تغییرات معوق توکن‌ها پیش از جایگزینی داده‌ها
+        token_ledger.flush()
         result = backup_mgr.restore_backup()
         if result:
-            update.callback_query.message.reply_text("✅ دیتابیس با موفقیت از آخرین بکاپ بازیابی شد.")
+            update.callback_query.message.reply_text("✅ دیتابیس با موفقیت از آخرین بکاپ بازیابی و بارگذاری شد.")
         else:
-            update.callback_query.message.reply_text("❌ خطا در بازیابی: بکاپی یافت نشد.")
+            update.callback_query.message.reply_text("❌ خطا در بازیابی: بکاپ معتبری یافت نشد.")
     except Exception as e:
         update.callback_query.message.reply_text(f"❌ خطا در بازیابی بکاپ: {str(e)}")
 
@@ -3141,7 +3023,7 @@ def cb_manage_ipv4_buttons(update: Update, context: CallbackContext) -> None:
             buttons.append([
                 InlineKeyboardButton(
                     f"{status} {info['flag']} {info['name']} ({info['ipv4_count']} IP)",
-                    callback_data=f'toggle_ipv4_{action}_{country_code}')
+                    callback_data=encode_callback('toggle_ipv4', action, country_code))
             ])
 
     if not buttons:
@@ -3197,9 +3079,11 @@ def cb_manage_ipv6_buttons(update: Update, context: CallbackContext) -> None:
 
 def cb_toggle_ipv4(update: Update, context: CallbackContext) -> None:
     """تغییر وضعیت فعال/غیرفعال IPv4 یک لوکیشن."""
-    data = update.callback_query.data.split('_')
-    action = data[2]
-    country_code = data[3]
+    args = callback_args(update.callback_query.data, 'toggle_ipv4_')
+    if len(args) == 1:
+        # قالب قدیمی: toggle_ipv4_<action>_<code>
+        args = args[0].split('_', 1)
+    action, country_code = args
 
     if action == "disable":
         result = db.disable_location(country_code, "ipv4")
@@ -3245,15 +3129,12 @@ def cb_toggle_ipv6(update: Update, context: CallbackContext) -> None:
 
     # ذخیره در پایگاه داده
     if action == "disable":
-        db.disabled_locations[key] = True
+        db.set_disabled_flag(key, True)
         status_text = "غیرفعال"
     else:  # enable
-        db.disabled_locations[key] = False
+        db.set_disabled_flag(key, False)
         status_text = "فعال"
 
-    # ذخیره تغییرات
-    db.save_database()
-
     # به روز کردن DISABLED_BUTTONS برای گزینه generate_ipv6
     # این بخش جدید است و برای حل مشکل اضافه شده
     if option_id in [
@@ -3437,6 +3318,126 @@ def cb_validate_ipv4(update: Update, context: CallbackContext) -> int:
     return ENTER_IP_FOR_VALIDATION
 
 
+# پیام‌های مرحله‌ای اعتبارسنجی IP: (تأخیر به ثانیه، متن)؛ اگر نتیجه زودتر برسد نمایش داده نمی‌شوند
+VALIDATION_STAGES = (
+    (1.0, "🔄 در حال ارتباط با سرور IP Location..."),
+    (2.5, "🔄 در حال دریافت اطلاعات IP..."),
+)
+
+
+def show_validation_stage(context: CallbackContext) -> None:
+    """نمایش یک مرحله از پیشرفت اعتبارسنجی (اجرا توسط JobQueue)"""
+    progress, text = context.job.context
+    with progress["lock"]:
+        if progress["done"]:
+            return
+        try:
+            progress["message"].edit_text(text)
+        except Exception as e:
+            logger.debug(f"Could not update validation status: {e}")
+
+
+def finish_ipv4_validation(future, progress, user_id: int, ip_address: str, user_data: dict,
+                           charged: bool = False) -> None:
+    """
+    نمایش نتیجه اعتبارسنجی به محض رسیدن پاسخ (در نخ GeoResolver).
+
+    خطاهای این نخ توسط concurrent.futures نادیده گرفته می‌شوند، پس همه خطاها همین‌جا
+    ثبت می‌شوند؛ اگر اطلاعات IP دریافت نشود توکن کسرشده بازگردانده می‌شود.
+    """
+    with progress["lock"]:
+        progress["done"] = True
+        for job in progress["jobs"]:
+            job.schedule_removal()
+        message = progress["message"]
+        try:
+            info = future.result()
+            text = "❌ خطا در دریافت اطلاعات IP."
+        except Exception as e:
+            logger.error(f"خطا در اعتبارسنجی IP {ip_address}: {e}")
+            info, text = None, f"❌ خطایی رخ داد: {str(e)}"
+
+        if info:
+            try:
+                render_ipv4_validation(message, info, user_id, ip_address, user_data)
+                return
+            except Exception as e:
+                logger.error(f"خطا در نمایش نتیجه اعتبارسنجی IP {ip_address}: {e}")
+                text = f"❌ خطایی رخ داد: {str(e)}"
+        elif charged:
+            token_ledger.grant(user_id, 1, "validate_ipv4_refund")
+            text += "\nتوکن کسرشده بازگردانده شد."
+        try:
+            message.edit_text(text)
+        except Exception as e:
+            logger.error(f"خطا در نمایش نتیجه اعتبارسنجی IP {ip_address}: {e}")
+
+
+def render_ipv4_validation(message, info: dict, user_id: int, ip_address: str, user_data: dict) -> None:
+    """ویرایش پیام وضعیت با نتیجه اعتبارسنجی و دکمه‌های افزودن IP"""
+    # نمایش نتیجه
+    country = info['country_name']
+    country_code = info['country_code']
+    isp = info['isp']
+
+    # لاگ کردن اطلاعات برای بررسی
+    logger.info(
+        f"IP: {ip_address}, Country: {country}, Code: {country_code}")
+
+    # دریافت پرچم کشور
+    flag = country_flag(country_code)
+
+    # ساخت دکمه‌های نمایش اطلاعات با پرچم بزرگتر و بهتر
+    buttons = [
+        [
+            InlineKeyboardButton(f"{flag} کشور: {country}",
+                                 callback_data='noop')
+        ],
+        [InlineKeyboardButton(f"🔌 ISP: {isp}", callback_data='noop')],
+        [
+            InlineKeyboardButton(f"🌐 آدرس IP: {ip_address}",
+                                 callback_data='noop')
+        ],
+    ]
+
+    # اضافه کردن دکمه درخواست افزودن IP به لیست در صورت معتبر بودن
+    if country != 'نامشخص':
+        # اگر کاربر ادمین باشد، مستقیما به لیست اضافه کند
+        if user_id == ADMIN_ID:
+            buttons.append([
+                InlineKeyboardButton(
+                    "➕ افزودن این IP به لیست",
+                    callback_data=
+                    f'add_validated_ip_{country_code}_{ip_address}')
+            ])
+        else:
+            # برای کاربران عادی، ارسال درخواست تایید به ادمین
+            buttons.append([
+                InlineKeyboardButton(
+                    "🔔 درخواست افزودن این IP به لیست",
+                    callback_data=
+                    f'request_add_ip_{country_code}_{ip_address}_{country}_{flag}'
+                )
+            ])
+
+    buttons.append([
+        InlineKeyboardButton("↩️ بازگشت به منوی اصلی",
+                             callback_data='back')
+    ])
+
+    # نمایش وضعیت توکن برای کاربران توکنی
+    token_message = ""
+    if user_data.get('type') == 'token':
+        remaining_tokens = db.active_users[user_id].get('tokens', 0)
+        token_message = f"\n\n🔄 توکن‌های باقی‌مانده: {remaining_tokens}"
+
+    # اضافه کردن پرچم بزرگ به ابتدای پیام
+    flag_header = f"{flag} " if flag != "🏳️" else ""
+    message.edit_text(
+        f"{flag_header}✅ نتیجه اعتبارسنجی آدرس IP:{token_message}",
+        reply_markup=InlineKeyboardMarkup(buttons))
+
+
 def validate_ipv4_address(update: Update, context: CallbackContext) -> int:
     """بررسی آدرس IPv4 وارد شده."""
     user_id = update.message.from_user.id
@@ -3458,6 +3459,7 @@ def validate_ipv4_address(update: Update, context: CallbackContext) -> int:
 
     # کم کردن توکن برای کاربران توکنی
     user_data = db.active_users.get(user_id, {})
+    charged = False
     if user_data.get('type') == 'token':
         current_tokens = user_data.get('tokens', 0)
         if current_tokens <= 0:
@@ -3465,182 +3467,22 @@ def validate_ipv4_address(update: Update, context: CallbackContext) -> int:
                 "❌ توکن شما تمام شده است. لطفاً اشتراک خود را تمدید کنید.")
             return ConversationHandler.END
 
-        # کم کردن یک توکن
-        db.use_tokens(user_id, 1)
-
-    try:
-        import time
-
-        # نمایش پیام‌های مرحله‌ای
-        time.sleep(2)
-        message.edit_text("🔄 در حال ارتباط با سرور IP Location...")
-
-        time.sleep(2)
-        message.edit_text("🔄 در حال دریافت اطلاعات IP...")
-
-        # ارسال درخواست به API - استفاده از API ویژه برای اطلاعات کامل
-        response = requests.get(f"{IP_VALIDATION_API}{ip_address}")
-        country_response = requests.get(
-            f"https://api.iplocation.net/?cmd=ip-country&ip={ip_address}")
-
-        if response.status_code == 200:
-            time.sleep(1)
-            message.edit_text("✅ اطلاعات IP دریافت شد. در حال پردازش...")
-
-            # دریافت اطلاعات
-            data = response.json()
-
-            # بررسی API ثانویه برای اطلاعات دقیق‌تر کشور
-            if country_response.status_code == 200:
-                country_data = country_response.json()
-                # به‌روزرسانی کد کشور اگر در پاسخ دوم موجود بود
-                if country_data.get('country_code'):
-                    data['country_code'] = country_data.get('country_code')
-                    logger.info(
-                        f"کد کشور از API ثانویه: {data['country_code']}")
-
-            # نمایش نتیجه
-            country = data.get('country_name', 'نامشخص')
-            country_code = data.get('country_code', '').upper()
-            isp = data.get('isp', 'نامشخص')
-
-            # لاگ کردن اطلاعات برای بررسی
-            logger.info(
-                f"IP: {ip_address}, Country: {country}, Code: {country_code}")
-
-            # دریافت پرچم کشور
-            flag = "🏳️"
-
-            # تنظیم دستی کد کشور برای کشورهای خاص که ممکن است از API به درستی دریافت نشوند
-            special_country_codes = {
-                "Qatar": "QA",
-                "UAE": "AE",
-                "United Arab Emirates": "AE",
-                "Saudi Arabia": "SA",
-                "Iran": "IR",
-                "Iraq": "IQ",
-                "Kuwait": "KW",
-                "Bahrain": "BH",
-                "Oman": "OM",
-                "Egypt": "EG",
-                "Turkey": "TR",
-                "Russia": "RU",
-                "United States": "US",
-                "USA": "US",
-                "Germany": "DE",
-                "United Kingdom": "GB",
-                "UK": "GB",
-                "France": "FR",
-                "China": "CN",
-                "India": "IN",
-                "Japan": "JP",
-                "Canada": "CA",
-                "Pakistan": "PK"
-            }
-
-            if country in special_country_codes:
-                country_code = special_country_codes[country]
-
-            # Map پرچم‌های آماده برای کشورهای خاص
-            special_flags = {
-                "QA": "🇶🇦",  # قطر
-                "AE": "🇦🇪",  # امارات
-                "SA": "🇸🇦",  # عربستان
-                "IR": "🇮🇷",  # ایران
-                "IQ": "🇮🇶",  # عراق
-                "KW": "🇰🇼",  # کویت
-                "BH": "🇧🇭",  # بحرین
-                "OM": "🇴🇲",  # عمان
-                "EG": "🇪🇬",  # مصر
-                "TR": "🇹🇷",  # ترکیه
-                "RU": "🇷🇺",  # روسیه
-                "US": "🇺🇸",  # آمریکا
-                "DE": "🇩🇪",  # آلمان
-                "GB": "🇬🇧",  # بریتانیا
-                "FR": "🇫🇷",  # فرانسه
-                "CN": "🇨🇳",  # چین
-                "IN": "🇮🇳",  # هند
-                "JP": "🇯🇵",  # ژاپن
-                "CA": "🇨🇦",  # کانادا
-                "PK": "🇵🇰"  # پاکستان
-            }
-
-            # بررسی اگر کشور در لیست پرچم‌های خاص موجود است
-            if country_code in special_flags:
-                flag = special_flags[country_code]
-                logger.info(f"Using prepared flag for {country}: {flag}")
-            elif country_code and len(country_code) == 2:
-                # ساخت ایموجی پرچم از کد کشور
-                try:
-                    # تبدیل کدهای ISO دو حرفی به ایموجی پرچم
-                    flag_chars = []
-                    for c in country_code.upper():
-                        if 'A' <= c <= 'Z':
-                            flag_chars.append(chr(ord(c) + 127397))
-                    if len(flag_chars) == 2:
-                        flag = "".join(flag_chars)
-                        logger.info(
-                            f"Generated flag for {country}: {flag} from code {country_code}"
-                        )
-                except Exception as e:
-                    logger.error(f"خطا در تولید پرچم: {e}")
-
-            # ساخت دکمه‌های نمایش اطلاعات با پرچم بزرگتر و بهتر
-            buttons = [
-                [
-                    InlineKeyboardButton(f"{flag} کشور: {country}",
-                                         callback_data='noop')
-                ],
-                [InlineKeyboardButton(f"🔌 ISP: {isp}", callback_data='noop')],
-                [
-                    InlineKeyboardButton(f"🌐 آدرس IP: {ip_address}",
-                                         callback_data='noop')
-                ],
-            ]
-
-            # اضافه کردن دکمه درخواست افزودن IP به لیست در صورت معتبر بودن
-            if country != 'نامشخص':
-                # اگر کاربر ادمین باشد، مستقیما به لیست اضافه کند
-                if user_id == ADMIN_ID:
-                    buttons.append([
-                        InlineKeyboardButton(
-                            "➕ افزودن این IP به لیست",
-                            callback_data=
-                            f'add_validated_ip_{country_code}_{ip_address}')
-                    ])
-                else:
-                    # برای کاربران عادی، ارسال درخواست تایید به ادمین
-                    buttons.append([
-                        InlineKeyboardButton(
-                            "🔔 درخواست افزودن این IP به لیست",
-                            callback_data=
-                            f'request_add_ip_{country_code}_{ip_address}_{country}_{flag}'
-                        )
-                    ])
-
-            buttons.append([
-                InlineKeyboardButton("↩️ بازگشت به منوی اصلی",
-                                     callback_data='back')
-            ])
-
-            # نمایش وضعیت توکن برای کاربران توکنی
-            token_message = ""
-            if user_data.get('type') == 'token':
-                remaining_tokens = db.active_users[user_id].get('tokens', 0)
-                token_message = f"\n\n🔄 توکن‌های باقی‌مانده: {remaining_tokens}"
-
-            # اضافه کردن پرچم بزرگ به ابتدای پیام
-            flag_header = f"{flag} " if flag != "🏳️" else ""
-            message.edit_text(
-                f"{flag_header}✅ نتیجه اعتبارسنجی آدرس IP:{token_message}",
-                reply_markup=InlineKeyboardMarkup(buttons))
-
-        else:
+        # کم کردن یک توکن (در صورت درخواست همزمان ممکن است موجودی دیگر کافی نباشد)
+        if not token_ledger.charge(user_id, 1, "validate_ipv4").ok:
             message.edit_text(
-                f"❌ خطا در دریافت اطلاعات IP: {response.status_code}")
+                "❌ توکن شما تمام شده است. لطفاً اشتراک خود را تمدید کنید.")
+            return ConversationHandler.END
+        charged = True
 
-    except Exception as e:
-        message.edit_text(f"❌ خطایی رخ داد: {str(e)}")
+    # وضعیت‌های مرحله‌ای با JobQueue نمایش داده می‌شوند و worker ربات منتظر شبکه نمی‌ماند
+    progress = {"done": False, "lock": threading.Lock(), "message": message}
+    progress["jobs"] = [
+        context.job_queue.run_once(show_validation_stage, delay, context=(progress, text))
+        for delay, text in VALIDATION_STAGES
+    ]
+    future = geo_resolver.submit_lookup(ip_address, with_isp=True)
+    future.add_done_callback(
+        lambda done: finish_ipv4_validation(done, progress, user_id, ip_address, user_data, charged))
 
     return ConversationHandler.END
 
@@ -3652,90 +3494,12 @@ def cb_add_validated_ip(update: Update, context: CallbackContext) -> None:
     ip_address = data[4]
 
     # دریافت اطلاعات کشور
-    import requests
     try:
-        # ارسال درخواست برای دریافت نام کامل کشور
-        response = requests.get(
-            f"https://api.iplocation.net/?cmd=ip-country&ip={ip_address}")
-        if response.status_code == 200:
-            data = response.json()
-            country_name = data.get('country_name', country_code)
-
-            # ساخت ایموجی پرچم از کد کشور
-            flag = "🏳️"
-
-            # تنظیم دستی کد کشور برای کشورهای خاص
-            special_country_codes = {
-                "Qatar": "QA",
-                "UAE": "AE",
-                "United Arab Emirates": "AE",
-                "Saudi Arabia": "SA",
-                "Iran": "IR",
-                "Iraq": "IQ",
-                "Kuwait": "KW",
-                "Bahrain": "BH",
-                "Oman": "OM",
-                "Egypt": "EG",
-                "Turkey": "TR",
-                "Russia": "RU",
-                "United States": "US",
-                "USA": "US",
-                "Germany": "DE",
-                "United Kingdom": "GB",
-                "UK": "GB",
-                "France": "FR",
-                "China": "CN",
-                "India": "IN",
-                "Japan": "JP",
-                "Canada": "CA",
-                "Pakistan": "PK"
-            }
-
-            if country_name in special_country_codes:
-                country_code = special_country_codes[country_name]
-
-            # Map پرچم‌های آماده برای کشورهای خاص
-            special_flags = {
-                "QA": "🇶🇦",  # قطر
-                "AE": "🇦🇪",  # امارات
-                "SA": "🇸🇦",  # عربستان
-                "IR": "🇮🇷",  # ایران
-                "IQ": "🇮🇶",  # عراق
-                "KW": "🇰🇼",  # کویت
-                "BH": "🇧🇭",  # بحرین
-                "OM": "🇴🇲",  # عمان
-                "EG": "🇪🇬",  # مصر
-                "TR": "🇹🇷",  # ترکیه
-                "RU": "🇷🇺",  # روسیه
-                "US": "🇺🇸",  # آمریکا
-                "DE": "🇩🇪",  # آلمان
-                "GB": "🇬🇧",  # بریتانیا
-                "FR": "🇫🇷",  # فرانسه
-                "CN": "🇨🇳",  # چین
-                "IN": "🇮🇳",  # هند
-                "JP": "🇯🇵",  # ژاپن
-                "CA": "🇨🇦",  # کانادا
-                "PK": "🇵🇰"  # پاکستان
-            }
-
-            if country_code and country_code.upper() in special_flags:
-                flag = special_flags[country_code.upper()]
-                logger.info(
-                    f"استفاده از پرچم آماده برای {country_name}: {flag}")
-            elif country_code and len(country_code) == 2:
-                country_code = country_code.upper()
-                try:
-                    flag_chars = []
-                    for c in country_code:
-                        if 'A' <= c <= 'Z':
-                            flag_chars.append(chr(ord(c) + 127397))
-                    if len(flag_chars) == 2:
-                        flag = "".join(flag_chars)
-                        logger.info(
-                            f"تولید پرچم برای کشور: {flag} از کد {country_code}"
-                        )
-                except Exception as e:
-                    logger.error(f"خطا در تولید پرچم: {e}")
+        info = geo_resolver.lookup(ip_address)
+        if info:
+            country_name = info['country_name']
+            country_code = info['country_code'] or country_code
+            flag = country_flag(country_code)
 
             # افزودن IP به پایگاه داده
             db.add_ipv4_address(country_name, flag, ip_address)
@@ -3760,17 +3524,36 @@ def cb_quick_search(update: Update, context: CallbackContext) -> None:
     send_reply(update, "🔍 لطفاً نام کشور یا بخشی از IP را وارد کنید:")
     context.user_data['search_mode'] = True
 
+# حداکثر تعداد IPهای نمایش داده‌شده در نتایج جستجو
+SEARCH_RESULT_LIMIT = 50
+
+
+def search_ipv4_results(query: str) -> list:
+    """
+    جستجوی کشورها (نام، کد و نام‌های فارسی) و پیشوند IP از طریق ایندکس‌های پایگاه داده.
+
+    Returns:
+        list: خطوط نتیجه آماده نمایش
+    """
+    results = []
+    countries = db.get_ipv4_countries()
+    for country_code in db.search_countries(query):
+        country, flag, ips = countries[country_code]
+        results.append(f"{flag} {country}: {len(ips)} IP")
+
+    matches = db.search_ip_prefix(query, limit=SEARCH_RESULT_LIMIT + 1)
+    for ip, country_code in matches[:SEARCH_RESULT_LIMIT]:
+        country, flag, _ = countries[country_code]
+        results.append(f"{flag} {country}: {ip}")
+    if len(matches) > SEARCH_RESULT_LIMIT:
+        results.append(f"... فقط {SEARCH_RESULT_LIMIT} نتیجه اول نمایش داده شد؛ جستجو را دقیق‌تر کنید.")
+    return results
+
+
 def handle_search_input(update: Update, context: CallbackContext) -> None:
     if context.user_data.get('search_mode'):
         query = update.message.text.strip().lower()
-        results = []
-        for country_code, (country, flag, ips) in db.get_ipv4_countries().items():
-            if query in country.lower() or query in country_code.lower():
-                results.append(f"{flag} {country}: {len(ips)} IP")
-            else:
-                for ip in ips:
-                    if query in ip:
-                        results.append(f"{flag} {country}: {ip}")
+        results = search_ipv4_results(query)
         if results:
             send_reply(update, "نتایج جستجو:\n" + "\n".join(results))
         else:
@@ -3799,16 +3582,17 @@ def cb_continent_list(update: Update, context: CallbackContext) -> None:
 
 def cb_show_countries_by_continent(update: Update, context: CallbackContext) -> None:
     code = update.callback_query.data.split('_')[1]
-    countries = [k for k, v in COUNTRY_TO_CONTINENT.items() if v == code]
+    countries = db.get_continent_countries(code)
     if not countries:
         send_reply(update, "کشوری برای این قاره ثبت نشده است.")
         return
+    all_ipv4_countries = db.get_ipv4_countries()
     buttons = []
-    for country_code in countries:
-        country = db.get_ipv4_countries().get(country_code)
+    for country_code, ip_count in countries:
+        country = all_ipv4_countries.get(country_code)
         if country:
-            flag, name, ips = country[1], country[0], country[2]
-            buttons.append([InlineKeyboardButton(f"{flag} {name} ({len(ips)})", callback_data=f"country_{country_code}")])
+            flag, name = country[1], country[0]
+            buttons.append([InlineKeyboardButton(f"{flag} {name} ({ip_count})", callback_data=encode_callback('country', country_code))])
     buttons.append([InlineKeyboardButton("↩️ بازگشت", callback_data='continent_list')])
     send_reply(update, "🌍 انتخاب کشور:", reply_markup=InlineKeyboardMarkup(buttons))
 
@@ -3820,14 +3604,10 @@ def cb_admin_broadcast(update: Update, context: CallbackContext) -> None:
 def handle_broadcast_input(update: Update, context: CallbackContext) -> None:
     if context.user_data.get('broadcast_mode'):
         msg = update.message.text.strip()
-        count = 0
-        for user_id in db.active_users:
-            try:
-                update.bot.send_message(chat_id=user_id, text=msg)
-                count += 1
-            except Exception:
-                pass
-        send_reply(update, f"📢 پیام به {count} کاربر ارسال شد.")
+        status_message = update.message.reply_text("🔄 در حال ارسال پیام همگانی...")
+        broadcaster.submit(msg, db.get_broadcast_recipients(),
+                           status_chat_id=status_message.chat_id,
+                           status_message_id=status_message.message_id)
         context.user_data['broadcast_mode'] = False
 
 # --- ادمین: خروجی CSV ---
@@ -3892,6 +3672,7 @@ def cb_wireguard(update: Update, context: CallbackContext) -> int:
     addresses = ["10.10.0.2/32", "10.66.66.2/32", "192.168.100.2/32"]
     buttons = [[InlineKeyboardButton(addr, callback_data=f'wg_addr_{addr}')]
                for addr in addresses]
+    buttons.append([InlineKeyboardButton("📦 ساخت گروهی کانفیگ (ZIP)", callback_data='wg_batch')])
     buttons.append([InlineKeyboardButton("لغو", callback_data='back')])
     send_reply(update, "آدرس مورد نظر را انتخاب کنید:", reply_markup=InlineKeyboardMarkup(buttons))
     return WG_SELECT_ADDRESS
@@ -3922,6 +3703,8 @@ def enter_wg_port(update: Update, context: CallbackContext) -> int:
         return WG_SELECT_PORT
 
 def wg_generate_config(update: Update, context: CallbackContext) -> int:
+    if wg_server_key_missing(update):
+        return ConversationHandler.END
     # انتخاب endpoint رندوم
     endpoints = db.get_endpoints()
     if not endpoints:
@@ -3930,28 +3713,77 @@ def wg_generate_config(update: Update, context: CallbackContext) -> int:
     import random
     endpoint = random.choice(endpoints)
     # تشخیص کشور endpoint
-    try:
-        import requests
-        country = requests.get(f'https://api.iplocation.net/?ip={endpoint.split(":")[0]}').json().get('country_name', 'نامشخص')
-    except Exception:
-        country = 'نامشخص'
+    info = geo_resolver.lookup(endpoint.split(":")[0])
+    country = info['country_name'] if info else 'نامشخص'
     # انتخاب MTU رندوم
     mtu = random.choice([1360, 1380, 1440])
     # DNS ثابت و یکی از endpointها
     dns1 = "10.202.10.10"
     dns2 = endpoint.split(":")[0]
-    # ساخت کانفیگ
-    from wg import WireguardConfig
-    wg = WireguardConfig()
-    private_key = wg.generate_private_key()
-    public_key = wg.generate_public_key()
+    # ساخت کانفیگ (کلید [Peer] کلید عمومی سرور است)
+    private_key, _ = wireguard.generate_keypair()
     address = context.user_data['wg_address']
     port = context.user_data['wg_port']
-    config = f"""[Interface]\nPrivateKey = {private_key}\nAddress = {address}\nDNS = {dns1}, {dns2}\nMTU = {mtu}\n\n[Peer]\nPublicKey = {public_key}\nAllowedIPs = 0.0.0.0/0, ::/0\nEndpoint = {endpoint}:{port}\nPersistentKeepalive = 25\n"""
+    config = f"""[Interface]\nPrivateKey = {private_key}\nAddress = {address}\nDNS = {dns1}, {dns2}\nMTU = {mtu}\n\n[Peer]\nPublicKey = {wireguard.server_public_key}\nAllowedIPs = 0.0.0.0/0, ::/0\nEndpoint = {endpoint}:{port}\nPersistentKeepalive = 25\n"""
     caption = f"✨ کانفیگ وایرگارد اختصاصی شما آماده است!\n\n🌍 کشور سرور: {country}\n🌐 Endpoint: {endpoint}\n🔢 پورت: {port}\n🟢 آدرس: {address}\n🔑 MTU: {mtu}\n🟦 DNS: {dns1}, {dns2}\n\nبرای اتصال کافیست این کانفیگ را در برنامه WireGuard وارد کنید.\nدر صورت مشکل با پشتیبانی تماس بگیرید."
     send_reply(update, f"<b>{caption}</b>\n\n<pre>{config}</pre>", parse_mode='HTML')
     return ConversationHandler.END
 
+# --- ساخت گروهی کانفیگ وایرگارد ---
+WG_CONFIG_TOKENS = 2  # هزینه هر کانفیگ وایرگارد
+WG_BATCH_SIZES = (5, 10, 25, 50)
+
+
+@require_subscription
+def cb_wg_batch(update: Update, context: CallbackContext) -> None:
+    """انتخاب تعداد کانفیگ‌ها برای ساخت گروهی"""
+    buttons = [[InlineKeyboardButton(f"{count} کانفیگ ({count * WG_CONFIG_TOKENS} توکن)",
+                                     callback_data=f'wg_batch_{count}')]
+               for count in WG_BATCH_SIZES]
+    buttons.append([InlineKeyboardButton("↩️ بازگشت", callback_data='wireguard')])
+    send_reply(update,
+               "📦 ساخت گروهی کانفیگ وایرگارد\n\n"
+               "همه کانفیگ‌ها با آدرس‌های یکتا و Endpointهای چرخشی ساخته و در یک فایل ZIP ارسال می‌شوند.\n"
+               "تعداد کانفیگ‌ها را انتخاب کنید:",
+               reply_markup=InlineKeyboardMarkup(buttons))
+
+
+@require_subscription
+def cb_wg_batch_generate(update: Update, context: CallbackContext) -> None:
+    """ساخت N کانفیگ در یک فراخوانی و ارسال آن‌ها در یک فایل ZIP با یک بار کسر توکن"""
+    user_id = update.callback_query.from_user.id
+    count = int(update.callback_query.data.replace('wg_batch_', ''))
+    if count not in WG_BATCH_SIZES:
+        update.callback_query.answer()
+        return
+    if wg_server_key_missing(update):
+        return
+
+    cost = count * WG_CONFIG_TOKENS
+    charge = token_ledger.charge(user_id, cost, "wireguard_batch")
+    if not charge.ok:
+        send_reply(update,
+                   f"❌ توکن کافی ندارید. برای ساخت {count} کانفیگ {cost} توکن نیاز است.",
+                   reply_markup=main_menu_keyboard(user_id))
+        return
+    update.callback_query.answer("در حال ساخت کانفیگ‌ها...")
+
+    try:
+        configs = wireguard.generate_config(count=count, endpoints=db.get_endpoints())
+        archive = configs_to_zip(configs)
+        caption = f"✅ {count} کانفیگ وایرگارد اختصاصی شما آماده است."
+        if charge.balance is not None:
+            caption += f"\n\n🔄 توکن‌های باقی‌مانده: {charge.balance}"
+        update.callback_query.message.reply_document(document=archive,
+                                                     filename=f"wireguard_{count}.zip",
+                                                     caption=caption)
+    except Exception as e:
+        logger.error(f"خطا در ساخت گروهی کانفیگ وایرگارد: {e}")
+        # بازگرداندن توکن‌های کسرشده در صورت شکست
+        if charge.balance is not None:
+            token_ledger.grant(user_id, cost, "wireguard_batch_refund")
+        update.callback_query.message.reply_text("❌ خطا در ساخت کانفیگ‌ها. توکن‌های شما بازگردانده شد.")
+
 # --- ثبت در main() ---
 # اضافه کردن CallbackQueryHandler(cb_admin_manage_wg_endpoints, pattern='^admin_manage_wg_endpoints$')
 # اضافه کردن CallbackQueryHandler(cb_add_wg_endpoint, pattern='^add_wg_endpoint$')
@@ -3972,20 +3804,60 @@ def cb_ipv4_menu(update: Update, context: CallbackContext) -> None:
 
 # --- اصلاح هندلرهای جستجو/قاره/آخرین IP برای زیرمنوی ipv4 ---
 def cb_quick_search_ipv4(update: Update, context: CallbackContext) -> None:
-    send_reply(update, "🔍 لطفاً نام کشور یا بخشی از IP را وارد کنید:")
+    send_reply(update, "🔍 لطفاً نام کشور، ابتدای IP، یک CIDR (مانند 185.220.0.0/16) "
+                       "یا بازه (مانند 1.2.3.0-1.2.5.255) را وارد کنید:")
     context.user_data['search_mode_ipv4'] = True
 
+# تعداد IPهای هر صفحه در نتایج جستجوی بازه‌ای
+IP_RANGE_PAGE_SIZE = 30
+
+
+def render_ip_range_page(start: int, end: int, page: int):
+    """متن و دکمه‌های یک صفحه از نتایج جستجوی بازه‌ای IP"""
+    total, matches = db.search_ip_range(start, end,
+                                        offset=page * IP_RANGE_PAGE_SIZE,
+                                        limit=IP_RANGE_PAGE_SIZE)
+    header = f"🔎 بازه {int_to_ip(start)} تا {int_to_ip(end)}"
+    if not total:
+        return f"{header}\n\n❌ هیچ IP ذخیره‌شده‌ای در این بازه یافت نشد.", None
+
+    pages = (total + IP_RANGE_PAGE_SIZE - 1) // IP_RANGE_PAGE_SIZE
+    countries = db.get_ipv4_countries()
+    lines = []
+    for ip, country_code in matches:
+        country, flag, _ = countries[country_code]
+        lines.append(f"{flag} {country}: {ip}")
+    text = f"{header}\n📊 {total} IP - صفحه {page + 1} از {pages}\n\n" + "\n".join(lines)
+
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton("⬅️ قبلی", callback_data=f"iprange_{start}_{end}_{page - 1}"))
+    if page + 1 < pages:
+        navigation.append(InlineKeyboardButton("بعدی ➡️", callback_data=f"iprange_{start}_{end}_{page + 1}"))
+    buttons = [navigation] if navigation else []
+    buttons.append([InlineKeyboardButton("↩️ بازگشت", callback_data='ipv4_menu')])
+    return text, InlineKeyboardMarkup(buttons)
+
+
+def cb_ip_range_page(update: Update, context: CallbackContext) -> None:
+    """جابجایی بین صفحات نتایج جستجوی بازه‌ای"""
+    query = update.callback_query
+    _, start, end, page = query.data.split('_')
+    text, reply_markup = render_ip_range_page(int(start), int(end), int(page))
+    query.answer()
+    query.message.edit_text(text, reply_markup=reply_markup)
+
 def handle_search_input_ipv4(update: Update, context: CallbackContext) -> None:
     if context.user_data.get('search_mode_ipv4'):
         query = update.message.text.strip().lower()
-        results = []
-        for country_code, (country, flag, ips) in db.get_ipv4_countries().items():
-            if query in country.lower() or query in country_code.lower():
-                results.append(f"{flag} {country}: {len(ips)} IP")
-            else:
-                for ip in ips:
-                    if query in ip:
-                        results.append(f"{flag} {country}: {ip}")
+        # CIDR یا بازه دو آدرس: جستجوی بازه‌ای روی ایندکس عددی با صفحه‌بندی
+        ip_range = parse_ip_range(query)
+        if ip_range is not None:
+            text, reply_markup = render_ip_range_page(ip_range[0], ip_range[1], 0)
+            send_reply(update, text, reply_markup=reply_markup)
+            context.user_data['search_mode_ipv4'] = False
+            return
+        results = search_ipv4_results(query)
         if results:
             send_reply(update, "نتایج جستجو:\n" + "\n".join(results))
         else:
@@ -3999,33 +3871,6 @@ def cb_latest_ips_ipv4(update: Update, context: CallbackContext) -> None:
     text = "🆕 آخرین IPهای افزوده شده:\n" + "\n".join(LAST_ADDED_IPS)
     send_reply(update, text)
 
-CONTINENT_MAP = {
-    'AS': 'آسیا', 'EU': 'اروپا', 'AF': 'آفریقا', 'NA': 'آمریکای شمالی', 'SA': 'آمریکای جنوبی', 'OC': 'اقیانوسیه', 'AN': 'جنوبگان'
-}
-COUNTRY_TO_CONTINENT = {
-    # نمونه: 'IR': 'AS', 'SA': 'AS', ...
-}
-def cb_continent_list_ipv4(update: Update, context: CallbackContext) -> None:
-    buttons = [[InlineKeyboardButton(name, callback_data=f'continent_ipv4_{code}')]
-               for code, name in CONTINENT_MAP.items()]
-    buttons.append([InlineKeyboardButton("↩️ بازگشت", callback_data='ipv4_menu')])
-    send_reply(update, "🌎 یک قاره را انتخاب کنید:", reply_markup=InlineKeyboardMarkup(buttons))
-
-def cb_show_countries_by_continent_ipv4(update: Update, context: CallbackContext) -> None:
-    code = update.callback_query.data.split('_')[2]
-    countries = [k for k, v in COUNTRY_TO_CONTINENT.items() if v == code]
-    if not countries:
-        send_reply(update, "کشوری برای این قاره ثبت نشده است.")
-        return
-    buttons = []
-    for country_code in countries:
-        country = db.get_ipv4_countries().get(country_code)
-        if country:
-            flag, name, ips = country[1], country[0], country[2]
-            buttons.append([InlineKeyboardButton(f"{flag} {name} ({len(ips)})", callback_data=f"country_{country_code}")])
-    buttons.append([InlineKeyboardButton("↩️ بازگشت", callback_data='continent_list_ipv4')])
-    send_reply(update, "🌍 انتخاب کشور:", reply_markup=InlineKeyboardMarkup(buttons))
-
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,70 @@
+import time
+import threading
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        """
+        Thread-safe token bucket shared by all callers of a rate-limited resource.
+
+        Args:
+            rate (float): Tokens added per second (0 or less disables limiting)
+            capacity (float): Maximum burst size (default: one second worth of tokens)
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def try_acquire(self, tokens=1.0):
+        """
+        Take tokens without waiting.
+
+        Returns:
+            float: 0 if the tokens were taken, otherwise seconds until they are available
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0.0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1.0, timeout=None):
+        """
+        Block until tokens are available.
+
+        Args:
+            tokens (float): Number of tokens to take
+            timeout (float): Maximum time to wait in seconds (None waits forever)
+
+        Returns:
+            bool: True if the tokens were taken, False on timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return True
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """Drain the bucket so no tokens are handed out for the given time (e.g. after HTTP 429)."""
+        if self.rate <= 0:
+            return
+        with self._lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0) - seconds * self.rate
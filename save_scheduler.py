@@ -0,0 +1,91 @@
+import time
+import logging
+import threading
+
+
+class SaveScheduler:
+    def __init__(self, save_func, interval=5.0):
+        """
+        Coalesce repeated save requests into at most one write per interval.
+
+        Args:
+            save_func (callable): Function that persists the data. A falsy return
+                value is treated as a failed write and retried on the next tick.
+            interval (float): Minimum time between two writes in seconds (default: 5)
+        """
+        self.save_func = save_func
+        self.interval = interval
+        self.running = False
+        self.dirty = False
+        self.last_save = 0.0
+        self._condition = threading.Condition()
+        self._save_lock = threading.Lock()
+        self.logger = logging.getLogger('save_scheduler')
+
+    def start(self):
+        """Start the background flusher thread."""
+        if not self.running:
+            self.running = True
+            self.flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self.flush_thread.start()
+            self.logger.info("Write-behind save scheduler started.")
+
+    def stop(self):
+        """Stop the flusher thread and write any pending changes."""
+        with self._condition:
+            self.running = False
+            self._condition.notify_all()
+        if hasattr(self, 'flush_thread') and self.flush_thread.is_alive():
+            self.flush_thread.join(timeout=self.interval + 1.0)
+        self.flush()
+        self.logger.info("Write-behind save scheduler stopped.")
+
+    def mark_dirty(self):
+        """Record that the data changed; the flusher will save it later."""
+        with self._condition:
+            if not self.dirty:
+                self.dirty = True
+                self._condition.notify()
+
+    def flush(self):
+        """
+        Write pending changes immediately.
+
+        Returns:
+            bool: True if nothing was pending or the write succeeded
+        """
+        with self._save_lock:
+            with self._condition:
+                if not self.dirty:
+                    return True
+                self.dirty = False
+            try:
+                saved = self.save_func() is not False
+            except Exception as e:
+                self.logger.error(f"Error during scheduled save: {e}")
+                saved = False
+            self.last_save = time.monotonic()
+            if not saved:
+                # The change is still unsaved, keep it for the next attempt
+                with self._condition:
+                    self.dirty = True
+            return saved
+
+    def _flush_loop(self):
+        """Background process that saves dirty data at most once per interval."""
+        while True:
+            with self._condition:
+                while self.running and not self.dirty:
+                    self._condition.wait()
+                if not self.running:
+                    return
+
+            # Wait out the rest of the interval so bursts of changes coalesce
+            delay = self.last_save + self.interval - time.monotonic()
+            if delay > 0:
+                with self._condition:
+                    self._condition.wait_for(lambda: not self.running, timeout=delay)
+                    if not self.running:
+                        return
+
+            self.flush()
@@ -0,0 +1,290 @@
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from ip_storage import ip_to_int, int_to_ip
+
+
+def parse_ip_prefix(prefix: str) -> Optional[Tuple[List[int], str]]:
+    """
+    تجزیه پیشوند IPv4 مانند "192.168." یا "10.2" به (اکتت‌های کامل، بخش ناقص آخر).
+
+    Returns:
+        None اگر عبارت شبیه ابتدای یک آدرس IPv4 نباشد
+    """
+    parts = prefix.strip().split('.')
+    if len(parts) > 4 or not prefix.strip():
+        return None
+    *full, partial = parts
+    octets = []
+    for part in full:
+        if not part.isdigit() or len(part) > 3 or int(part) > 255:
+            return None
+        octets.append(int(part))
+    if partial and (not partial.isdigit() or len(partial) > 3):
+        return None
+    return octets, partial
+
+
+def parse_ip_range(query: str) -> Optional[Tuple[int, int]]:
+    """
+    تجزیه یک بازه IPv4 به صورت CIDR ("185.220.0.0/16") یا دو آدرس ("1.2.3.4-1.2.3.200").
+
+    Returns:
+        Optional[Tuple[int, int]]: (شروع، پایان) عددی و شامل هر دو سر، یا None
+    """
+    query = query.strip()
+    if '/' in query:
+        network, _, prefix = query.partition('/')
+        start = ip_to_int(network.strip())
+        prefix = prefix.strip()
+        if start is None or not prefix.isdigit() or int(prefix) > 32:
+            return None
+        size = 1 << (32 - int(prefix))
+        start &= ~(size - 1) & 0xFFFFFFFF
+        return start, start + size - 1
+    if '-' in query:
+        first, _, second = query.partition('-')
+        start, end = ip_to_int(first.strip()), ip_to_int(second.strip())
+        if start is None or end is None:
+            return None
+        return (start, end) if start <= end else (end, start)
+    return None
+
+
+def _octet_ranges(partial: str) -> List[Tuple[int, int]]:
+    """بازه‌های مقادیر اکتتی که شکل رشته‌ای آن‌ها با partial شروع می‌شود (مثلاً "2" -> 2، 20-29، 200-255)"""
+    if not partial:
+        return [(0, 255)]
+    if partial[0] == '0':
+        return [(0, 0)] if partial == '0' else []
+    value = int(partial)
+    ranges = []
+    for extra_digits in range(4 - len(partial)):
+        scale = 10 ** extra_digits
+        low, high = value * scale, min((value + 1) * scale - 1, 255)
+        if low > 255:
+            break
+        ranges.append((low, high))
+    return ranges
+
+
+class IPv4PrefixTrie:
+    """
+    درخت پیشوندی (burst trie) روی اکتت‌های آدرس‌های IPv4.
+
+    دو اکتت اول گره‌های dict هستند و دو اکتت آخر هر /16 در یک array مرتب ۱۶ بیتی
+    نگه داشته می‌شوند؛ پس هر آدرس فقط ۲ بایت جا می‌گیرد و جستجوی یک پیشوند با
+    پیمایش گره‌ها و bisect در برگ انجام می‌شود و هزینه آن متناسب با تعداد نتایج است
+    نه تعداد کل آدرس‌ها.
+    """
+
+    __slots__ = ('_root', '_size')
+
+    def __init__(self):
+        self._root: Dict[int, Dict[int, array]] = {}
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    @staticmethod
+    def _value(ip: Union[int, str]) -> Optional[int]:
+        return ip if isinstance(ip, int) else ip_to_int(ip)
+
+    def insert(self, ip: Union[int, str]) -> bool:
+        """افزودن آدرس (آدرس تکراری یا غیر IPv4 نادیده گرفته می‌شود)"""
+        value = self._value(ip)
+        if value is None:
+            return False
+        bucket = self._root.setdefault(value >> 24, {}).setdefault((value >> 16) & 255, array('H'))
+        low = value & 0xFFFF
+        index = bisect_left(bucket, low)
+        if index < len(bucket) and bucket[index] == low:
+            return False
+        bucket.insert(index, low)
+        self._size += 1
+        return True
+
+    def remove(self, ip: Union[int, str]) -> bool:
+        """حذف آدرس و گره‌هایی که خالی می‌شوند"""
+        value = self._value(ip)
+        if value is None:
+            return False
+        first, second, low = value >> 24, (value >> 16) & 255, value & 0xFFFF
+        node = self._root.get(first)
+        bucket = node.get(second) if node is not None else None
+        if bucket is None:
+            return False
+        index = bisect_left(bucket, low)
+        if index == len(bucket) or bucket[index] != low:
+            return False
+        del bucket[index]
+        self._size -= 1
+        if not bucket:
+            del node[second]
+            if not node:
+                del self._root[first]
+        return True
+
+    def __contains__(self, ip) -> bool:
+        value = self._value(ip) if isinstance(ip, (int, str)) else None
+        if value is None:
+            return False
+        bucket = self._root.get(value >> 24, {}).get((value >> 16) & 255)
+        if bucket is None:
+            return False
+        index = bisect_left(bucket, value & 0xFFFF)
+        return index < len(bucket) and bucket[index] == value & 0xFFFF
+
+    def iter_prefix(self, prefix: str) -> Iterator[int]:
+        """مقدار عددی آدرس‌هایی که شکل نقطه‌دار آن‌ها با prefix شروع می‌شود، به ترتیب عددی"""
+        parsed = parse_ip_prefix(prefix)
+        if parsed is None:
+            return
+        octets, partial = parsed
+        ranges = _octet_ranges(partial)
+
+        def matches(octet):
+            return any(low <= octet <= high for low, high in ranges)
+
+        if len(octets) < 2:
+            if octets:
+                firsts = octets if octets[0] in self._root else []
+            else:
+                firsts = [octet for octet in sorted(self._root) if matches(octet)]
+            for first in firsts:
+                node = self._root[first]
+                seconds = sorted(node) if not octets else [o for o in sorted(node) if matches(o)]
+                for second in seconds:
+                    base = (first << 24) | (second << 16)
+                    for low in node[second]:
+                        yield base | low
+            return
+
+        bucket = self._root.get(octets[0], {}).get(octets[1])
+        if bucket is None:
+            return
+        base = (octets[0] << 24) | (octets[1] << 16)
+        if len(octets) == 2:
+            # بخش ناقص مربوط به اکتت سوم است
+            bounds = [(low << 8, (high << 8) | 255) for low, high in ranges]
+        else:
+            bounds = [((octets[2] << 8) | low, (octets[2] << 8) | high) for low, high in ranges]
+        for low, high in bounds:
+            index = bisect_left(bucket, low)
+            while index < len(bucket) and bucket[index] <= high:
+                yield base | bucket[index]
+                index += 1
+
+    def iter_range(self, start: int, end: int) -> Iterator[int]:
+        """مقادیر عددی آدرس‌های بین start و end (شامل هر دو) به ترتیب عددی"""
+        for first in sorted(self._root):
+            if first < start >> 24:
+                continue
+            if first > end >> 24:
+                break
+            node = self._root[first]
+            for second in sorted(node):
+                bucket_base = (first << 24) | (second << 16)
+                if bucket_base + 0xFFFF < start:
+                    continue
+                if bucket_base > end:
+                    break
+                bucket = node[second]
+                index = bisect_left(bucket, max(start - bucket_base, 0))
+                high = min(end - bucket_base, 0xFFFF)
+                while index < len(bucket) and bucket[index] <= high:
+                    yield bucket_base | bucket[index]
+                    index += 1
+
+    def count_range(self, start: int, end: int) -> int:
+        """تعداد آدرس‌های یک بازه؛ برگ‌هایی که کامل داخل بازه هستند بدون پیمایش شمرده می‌شوند"""
+        total = 0
+        for first, node in self._root.items():
+            if not start >> 24 <= first <= end >> 24:
+                continue
+            for second, bucket in node.items():
+                bucket_base = (first << 24) | (second << 16)
+                if bucket_base + 0xFFFF < start or bucket_base > end:
+                    continue
+                if start <= bucket_base and bucket_base + 0xFFFF <= end:
+                    total += len(bucket)
+                else:
+                    total += (bisect_right(bucket, min(end - bucket_base, 0xFFFF))
+                              - bisect_left(bucket, max(start - bucket_base, 0)))
+        return total
+
+    def search(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """
+        Returns:
+            List[str]: حداکثر limit آدرس که با prefix شروع می‌شوند
+        """
+        return [int_to_ip(value) for value in islice(self.iter_prefix(prefix), limit)]
+
+
+def search_tokens(text: str) -> List[str]:
+    """تبدیل نام یا عبارت جستجو به کلمات کوچک‌شده"""
+    return text.lower().replace('_', ' ').replace('-', ' ').split()
+
+
+class CountryTokenIndex:
+    """
+    ایندکس معکوس کلمه -> کدهای کشور روی نام، کد و نام‌های مستعار (انگلیسی و فارسی).
+
+    کلمات در یک لیست مرتب هم نگه داشته می‌شوند تا جستجوی پیشوندی («ger» برای
+    Germany) با bisect و بدون پیمایش همه کشورها انجام شود.
+    """
+
+    def __init__(self):
+        self._tokens: Dict[str, Set[str]] = {}  # token -> country codes
+        self._country_tokens: Dict[str, Set[str]] = {}  # country code -> tokens
+        self._sorted_tokens: List[str] = []
+        self._dirty = False
+
+    def add(self, country_code: str, name: str, aliases: Iterable[str] = ()):
+        """ثبت (یا ثبت مجدد) کلمات یک کشور"""
+        self.remove(country_code)
+        tokens = set()
+        for text in (country_code, name, *aliases):
+            words = search_tokens(text)
+            tokens.update(words)
+            if len(words) > 1:
+                # عبارت کامل برای جستجوی چندکلمه‌ای مانند «saudi ar»
+                tokens.add(" ".join(words))
+        self._country_tokens[country_code] = tokens
+        for token in tokens:
+            self._tokens.setdefault(token, set()).add(country_code)
+        self._dirty = True
+
+    def remove(self, country_code: str):
+        for token in self._country_tokens.pop(country_code, ()):
+            codes = self._tokens.get(token)
+            if codes is not None:
+                codes.discard(country_code)
+                if not codes:
+                    del self._tokens[token]
+        self._dirty = True
+
+    def _prefix_matches(self, prefix: str) -> Set[str]:
+        if self._dirty:
+            self._sorted_tokens = sorted(self._tokens)
+            self._dirty = False
+        result = set()
+        index = bisect_left(self._sorted_tokens, prefix)
+        while index < len(self._sorted_tokens) and self._sorted_tokens[index].startswith(prefix):
+            result.update(self._tokens[self._sorted_tokens[index]])
+            index += 1
+        return result
+
+    def search(self, query: str) -> Set[str]:
+        """کشورهایی که یکی از کلماتشان با عبارت (یا با همه کلمات عبارت) شروع می‌شود"""
+        words = search_tokens(query)
+        if not words:
+            return set()
+        result = self._prefix_matches(" ".join(words))
+        if len(words) > 1:
+            matches = [self._prefix_matches(word) for word in words]
+            result |= set.intersection(*matches)
+        return result
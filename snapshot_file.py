@@ -0,0 +1,107 @@
+import os
+import pickle
+import hashlib
+import struct
+
+# سرآیند اسنپ‌شات: شناسه قالب، طول داده و SHA-256 داده pickle شده
+SNAPSHOT_MAGIC = b'IPBOTDB1'
+_HEADER = struct.Struct('>8sQ32s')
+
+
+class SnapshotCorrupted(ValueError):
+    """فایل اسنپ‌شات ناقص است یا چک‌سام آن با محتوا مطابقت ندارد"""
+
+
+def fsync_directory(path: str) -> None:
+    """همگام‌سازی پوشه تا تغییر نام فایل‌ها پس از قطع برق هم باقی بماند"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return  # برخی سیستم‌عامل‌ها (ویندوز) باز کردن پوشه را پشتیبانی نمی‌کنند
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def replace_atomically(path: str, payload: bytes) -> None:
+    """
+    نوشتن payload در فایل موقت کنار path، fsync و جایگزینی اتمیک با os.replace.
+
+    خواننده‌ها همیشه یا نسخه قبلی کامل یا نسخه جدید کامل را می‌بینند؛ قطع شدن
+    برنامه حین نوشتن فقط یک فایل موقت ناقص به جا می‌گذارد.
+    """
+    tmp_path = f"{path}.tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    fsync_directory(path)
+
+
+def encode_snapshot(data) -> bytes:
+    """تبدیل وضعیت به بایت‌های اسنپ‌شات همراه با سرآیند چک‌سام"""
+    body = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+    return _HEADER.pack(SNAPSHOT_MAGIC, len(body), hashlib.sha256(body).digest()) + body
+
+
+def check_snapshot(payload: bytes) -> memoryview:
+    """
+    بررسی سرآیند و چک‌سام اسنپ‌شات بدون unpickle کردن آن.
+
+    فایل‌های قدیمی بدون سرآیند (pickle خام) چک‌سامی ندارند و بدون بررسی پذیرفته می‌شوند.
+
+    Returns:
+        memoryview: بخش pickle شده داده
+
+    Raises:
+        SnapshotCorrupted: طول یا چک‌سام داده با سرآیند مطابقت ندارد
+    """
+    if not payload.startswith(SNAPSHOT_MAGIC):
+        return memoryview(payload)
+    if len(payload) < _HEADER.size:
+        raise SnapshotCorrupted("سرآیند اسنپ‌شات ناقص است")
+    _, length, digest = _HEADER.unpack_from(payload)
+    body = memoryview(payload)[_HEADER.size:]
+    if len(body) != length:
+        raise SnapshotCorrupted(f"طول اسنپ‌شات {len(body)} بایت است، {length} بایت انتظار می‌رفت")
+    if hashlib.sha256(body).digest() != digest:
+        raise SnapshotCorrupted("چک‌سام اسنپ‌شات مطابقت ندارد")
+    return body
+
+
+def decode_snapshot(payload: bytes):
+    """
+    بازگرداندن وضعیت از بایت‌های اسنپ‌شات (فایل‌های قدیمی بدون سرآیند همچنان خوانده می‌شوند).
+
+    Raises:
+        SnapshotCorrupted: طول یا چک‌سام داده با سرآیند مطابقت ندارد
+    """
+    return pickle.loads(check_snapshot(payload))
+
+
+def write_snapshot(path: str, data) -> None:
+    """ذخیره اتمیک وضعیت در path"""
+    replace_atomically(path, encode_snapshot(data))
+
+
+def read_snapshot(path: str):
+    """
+    خواندن و بررسی یک فایل اسنپ‌شات.
+
+    Raises:
+        SnapshotCorrupted: فایل آسیب دیده است
+        OSError: فایل وجود ندارد یا قابل خواندن نیست
+    """
+    with open(path, 'rb') as f:
+        return decode_snapshot(f.read())
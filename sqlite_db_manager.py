@@ -0,0 +1,923 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from collections.abc import Mapping, Sequence
+from contextlib import contextmanager
+from typing import Dict, List, Tuple, Optional
+
+from db_manager import (DBManager, DB_FILE, SAUDI_KEYS, COUNTRY_ALIASES, normalize_country_key,
+                        is_saudi_name, country_group, country_search_aliases, country_continent)
+from ip_storage import ip_to_int
+from search_index import CountryTokenIndex, parse_ip_prefix
+
+SQLITE_FILE = 'bot_database.sqlite3'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    type TEXT NOT NULL,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    joined_date TEXT NOT NULL DEFAULT 'نامشخص',
+    activation_code TEXT NOT NULL DEFAULT 'نامشخص'
+);
+CREATE TABLE IF NOT EXISTS disabled_users (
+    user_id INTEGER PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS delivery_state (
+    user_id INTEGER PRIMARY KEY,
+    status TEXT NOT NULL,
+    reason TEXT NOT NULL DEFAULT '',
+    since REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS codes (
+    code TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    tokens INTEGER NOT NULL DEFAULT 0,
+    used_count INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS code_users (
+    code TEXT NOT NULL REFERENCES codes(code) ON DELETE CASCADE,
+    user_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_code_users_code ON code_users(code);
+CREATE TABLE IF NOT EXISTS countries (
+    code TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    flag TEXT NOT NULL,
+    norm_key TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_countries_norm_key ON countries(norm_key);
+CREATE TABLE IF NOT EXISTS ips (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    country_code TEXT NOT NULL REFERENCES countries(code) ON DELETE CASCADE,
+    ip TEXT NOT NULL,
+    ip_num INTEGER,
+    UNIQUE (country_code, ip)
+);
+CREATE INDEX IF NOT EXISTS idx_ips_country ON ips(country_code, id);
+CREATE INDEX IF NOT EXISTS idx_ips_ip ON ips(ip);
+CREATE TABLE IF NOT EXISTS locations (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS endpoints (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    endpoint TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS recent_ips (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    entry TEXT NOT NULL
+);
+"""
+
+RECENT_IPS_LIMIT = 20
+IP_ITER_BATCH = 1000  # تعداد ردیف‌های هر دسته هنگام پیمایش IPهای یک کشور
+
+
+class _IPListView(Sequence):
+    """نمای فقط‌خواندنی آدرس‌های یک کشور که ردیف‌ها را هنگام دسترسی از SQLite می‌خواند"""
+
+    def __init__(self, manager, country_code: str, count: Optional[int] = None):
+        self._manager = manager
+        self._country_code = country_code
+        self._count = count
+
+    def __len__(self):
+        if self._count is None:
+            row = self._manager._query_one(
+                "SELECT COUNT(*) FROM ips WHERE country_code = ?",
+                (self._country_code, ))
+            self._count = row[0]
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            # یک پرس‌وجو برای کل بازه به جای یک OFFSET جداگانه برای هر عنصر
+            positions = range(*index.indices(len(self)))
+            if not positions:
+                return []
+            first, last = min(positions), max(positions)
+            rows = self._manager._query(
+                "SELECT ip FROM ips WHERE country_code = ? ORDER BY id LIMIT ? OFFSET ?",
+                (self._country_code, last - first + 1, first))
+            return [rows[i - first][0] for i in positions if i - first < len(rows)]
+        if index < 0:
+            index += len(self)
+        row = self._manager._query_one(
+            "SELECT ip FROM ips WHERE country_code = ? ORDER BY id LIMIT 1 OFFSET ?",
+            (self._country_code, index))
+        if row is None or index < 0:
+            raise IndexError(index)
+        return row[0]
+
+    def __iter__(self):
+        # پیمایش دسته‌ای بر اساس id (keyset) روی ایندکس idx_ips_country؛ هر دسته یک
+        # پرس‌وجوی کوتاه است و اتصال مشترک بین دسته‌ها قفل نمی‌ماند
+        last_id = -1
+        while True:
+            rows = self._manager._query(
+                "SELECT id, ip FROM ips WHERE country_code = ? AND id > ? ORDER BY id LIMIT ?",
+                (self._country_code, last_id, IP_ITER_BATCH))
+            for row in rows:
+                yield row[1]
+            if len(rows) < IP_ITER_BATCH:
+                return
+            last_id = rows[-1][0]
+
+    def __contains__(self, ip):
+        return self._manager._query_one(
+            "SELECT 1 FROM ips WHERE country_code = ? AND ip = ?",
+            (self._country_code, ip)) is not None
+
+
+class _UsersView(Mapping):
+    """نمای فقط‌خواندنی کاربران فعال (سازگار با DBManager.active_users)"""
+
+    def __init__(self, manager):
+        self._manager = manager
+
+    def __getitem__(self, user_id):
+        row = self._manager._query_one(
+            "SELECT type, tokens, joined_date, activation_code FROM users WHERE user_id = ?",
+            (user_id, ))
+        if row is None:
+            raise KeyError(user_id)
+        return dict(row)
+
+    def __iter__(self):
+        rows = self._manager._query("SELECT user_id FROM users ORDER BY rowid")
+        return (row[0] for row in rows)
+
+    def __len__(self):
+        return self._manager._query_one("SELECT COUNT(*) FROM users")[0]
+
+    def __contains__(self, user_id):
+        return self._manager._query_one(
+            "SELECT 1 FROM users WHERE user_id = ?", (user_id, )) is not None
+
+
+class _LocationsView(Mapping):
+    """نمای فقط‌خواندنی وضعیت لوکیشن‌ها (سازگار با DBManager.disabled_locations)"""
+
+    def __init__(self, manager):
+        self._manager = manager
+
+    def __getitem__(self, key):
+        row = self._manager._query_one(
+            "SELECT value FROM locations WHERE key = ?", (key, ))
+        if row is None:
+            raise KeyError(key)
+        return json.loads(row[0])
+
+    def __iter__(self):
+        rows = self._manager._query("SELECT key FROM locations ORDER BY rowid")
+        return (row[0] for row in rows)
+
+    def __len__(self):
+        return self._manager._query_one("SELECT COUNT(*) FROM locations")[0]
+
+
+class SQLiteDBManager:
+    """
+    پیاده‌سازی DBManager روی SQLite (حالت WAL) با همان متدهای عمومی.
+
+    داده‌ها به جای نگهداری کامل در حافظه در جدول‌های ایندکس‌شده ذخیره می‌شوند و
+    هر تغییر فقط ردیف‌های مربوط به خود را می‌نویسد.
+    """
+
+    def __init__(self, path: str = SQLITE_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self.catalog_version = 0  # با هر تغییر کشورها/IPها/لوکیشن‌ها افزایش می‌یابد (برای کش‌ها)
+        self._conn = sqlite3.connect(path,
+                                     check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        self._conn.executescript(SCHEMA)
+        self._migrate_schema()
+
+    def _migrate_schema(self):
+        """افزودن ستون‌هایی که در نسخه‌های قبلی جدول‌ها وجود نداشتند"""
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(ips)")}
+        with self._transaction() as conn:
+            if 'ip_num' not in columns:
+                # مقدار عددی IP برای جستجوی بازه‌ای (CIDR) روی ایندکس
+                conn.execute("ALTER TABLE ips ADD COLUMN ip_num INTEGER")
+                conn.executemany("UPDATE ips SET ip_num = ? WHERE id = ?",
+                                 [(ip_to_int(row['ip']), row['id'])
+                                  for row in conn.execute("SELECT id, ip FROM ips").fetchall()])
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ips_num ON ips(ip_num)")
+
+    # --- ابزارهای داخلی ---
+
+    @contextmanager
+    def _transaction(self):
+        """اجرای چند دستور در یک تراکنش اتمیک"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            else:
+                self._conn.execute("COMMIT")
+
+    @contextmanager
+    def _catalog_transaction(self):
+        """تراکنشی روی کشورها، IPها یا لوکیشن‌ها که پس از commit نسخه فهرست را افزایش می‌دهد"""
+        with self._transaction() as conn:
+            yield conn
+        self.catalog_version += 1
+
+    def _query(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _query_one(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    # --- سازگاری با ویژگی‌های DBManager ---
+
+    @property
+    def active_users(self) -> Mapping:
+        return _UsersView(self)
+
+    @property
+    def disabled_locations(self) -> Mapping:
+        return _LocationsView(self)
+
+    @property
+    def ipv4_data(self) -> Dict[str, Tuple[str, str, Sequence]]:
+        return self.get_ipv4_countries()
+
+    @property
+    def active_codes(self) -> Dict[str, Dict]:
+        return self.get_all_codes()
+
+    @property
+    def disabled_users(self) -> set:
+        return {row[0] for row in self._query("SELECT user_id FROM disabled_users")}
+
+    @property
+    def wg_endpoints(self) -> list:
+        return self.get_endpoints()
+
+    @property
+    def last_added_ips(self) -> list:
+        rows = self._query("SELECT entry FROM recent_ips ORDER BY id DESC LIMIT ?",
+                           (RECENT_IPS_LIMIT, ))
+        return [row[0] for row in rows]
+
+    def load_database(self):
+        """در SQLite داده‌ها هنگام نیاز خوانده می‌شوند؛ برای سازگاری نگه داشته شده است"""
+        self._conn.executescript(SCHEMA)
+
+    def save_database(self):
+        """هر تغییر بلافاصله در تراکنش خود ذخیره می‌شود؛ فقط WAL را در فایل اصلی ادغام می‌کند"""
+        with self._lock:
+            self._conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def flush(self) -> bool:
+        """هر تراکنش هنگام commit نوشته می‌شود؛ برای سازگاری با DBManager"""
+        return True
+
+    def close(self):
+        """بستن اتصال پایگاه داده"""
+        with self._lock:
+            self._conn.close()
+
+    # --- endpoint های وایرگارد ---
+
+    def get_endpoints(self):
+        """دریافت لیست endpoint های وایرگارد"""
+        return [row[0] for row in self._query("SELECT endpoint FROM endpoints ORDER BY id")]
+
+    def add_endpoint(self, endpoint: str) -> bool:
+        """اضافه کردن endpoint جدید"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO endpoints (endpoint) VALUES (?)", (endpoint, ))
+            return cursor.rowcount > 0
+
+    def remove_endpoint(self, endpoint: str) -> bool:
+        """حذف endpoint"""
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM endpoints WHERE endpoint = ?", (endpoint, ))
+            return cursor.rowcount > 0
+
+    # --- کاربران و توکن‌ها ---
+
+    def is_user_subscribed(self, user_id: int) -> bool:
+        return self.is_user_active(user_id)
+
+    def is_user_active(self, user_id: int) -> bool:
+        return self._query_one(
+            "SELECT 1 FROM users WHERE user_id = ? "
+            "AND user_id NOT IN (SELECT user_id FROM disabled_users)",
+            (user_id, )) is not None
+
+    def get_tokens(self, user_id: int) -> int:
+        if not self.is_user_subscribed(user_id):
+            return 0
+        row = self._query_one("SELECT type, tokens FROM users WHERE user_id = ?", (user_id, ))
+        if row['type'] == 'unlimited':
+            return 999999
+        return row['tokens']
+
+    def check_activation_code(self, code: str) -> Tuple[bool, Optional[dict]]:
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT type, tokens, used_count, created_at FROM codes WHERE code = ?",
+                (code, )).fetchone()
+            if row is None:
+                return False, None
+            code_data = dict(row)
+            code_data['users'] = [
+                r[0] for r in conn.execute(
+                    "SELECT user_id FROM code_users WHERE code = ? ORDER BY rowid", (code, ))
+            ]
+            # به جای حذف کد، آمار استفاده را افزایش می‌دهیم
+            conn.execute("UPDATE codes SET used_count = used_count + 1 WHERE code = ?", (code, ))
+            return True, code_data
+
+    def activate_user(self,
+                      user_id: int,
+                      code_data: dict,
+                      code: str = "نامشخص") -> bool:
+        current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+
+        if code_data["type"] == "token":
+            tokens = code_data.get("tokens", 0)
+            if tokens <= 0:
+                return False
+        else:
+            tokens = 999999
+
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO users (user_id, type, tokens, joined_date, activation_code) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (user_id, code_data["type"], tokens, current_time, code))
+            # اضافه کردن کاربر به لیست استفاده‌کنندگان از کد
+            if code != "نامشخص":
+                conn.execute(
+                    "INSERT INTO code_users (code, user_id) "
+                    "SELECT code, ? FROM codes WHERE code = ?", (user_id, code))
+        return True
+
+    def grant_tokens(self, user_id: int, amount: int) -> bool:
+        """افزودن توکن به کاربر."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE users SET tokens = tokens + ? WHERE user_id = ?", (amount, user_id))
+            return cursor.rowcount > 0
+
+    def use_tokens(self, user_id: int, amount: int = 1, commit: bool = True) -> bool:
+        """استفاده از توکن توسط کاربر (هر کسر در تراکنش خودش ذخیره می‌شود و commit بی‌اثر است)."""
+        if not self.is_user_active(user_id):
+            return False
+
+        with self._transaction() as conn:
+            row = conn.execute("SELECT type FROM users WHERE user_id = ?", (user_id, )).fetchone()
+            if row is None:
+                return False
+            if row['type'] == 'unlimited':
+                return True
+            # کسر اتمیک: فقط در صورت کافی بودن موجودی
+            cursor = conn.execute(
+                "UPDATE users SET tokens = tokens - ? WHERE user_id = ? AND tokens >= ?",
+                (amount, user_id, amount))
+            return cursor.rowcount > 0
+
+    def commit_users(self, user_ids) -> None:
+        """سازگاری با DBManager؛ تغییرات توکن در همان تراکنش use_tokens ذخیره شده‌اند"""
+
+    def disable_user(self, user_id: int) -> bool:
+        """غیرفعال کردن یک کاربر."""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO disabled_users (user_id) "
+                "SELECT user_id FROM users WHERE user_id = ?", (user_id, ))
+            return cursor.rowcount > 0
+
+    def enable_user(self, user_id: int) -> bool:
+        """فعال کردن یک کاربر."""
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM disabled_users WHERE user_id = ?", (user_id, ))
+            return cursor.rowcount > 0
+
+    def is_user_disabled(self, user_id: int) -> bool:
+        """بررسی اینکه آیا کاربر غیرفعال شده است یا خیر."""
+        return self._query_one(
+            "SELECT 1 FROM disabled_users WHERE user_id = ?", (user_id, )) is not None
+
+    # --- وضعیت تحویل پیام ---
+
+    def mark_user_unreachable(self, user_id: int, status: str, reason: str = "") -> None:
+        """ثبت کاربری که پیام به او قابل تحویل نیست"""
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO delivery_state (user_id, status, reason, since) "
+                "VALUES (?, ?, ?, ?)", (user_id, status, reason, time.time()))
+
+    def mark_user_reachable(self, user_id: int) -> bool:
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM delivery_state WHERE user_id = ?", (user_id, ))
+            return cursor.rowcount > 0
+
+    def is_user_reachable(self, user_id: int) -> bool:
+        return self._query_one(
+            "SELECT 1 FROM delivery_state WHERE user_id = ?", (user_id, )) is None
+
+    def get_unreachable_users(self) -> Dict[int, Dict]:
+        return {
+            row['user_id']: {"status": row['status'], "reason": row['reason'], "since": row['since']}
+            for row in self._query("SELECT user_id, status, reason, since FROM delivery_state")
+        }
+
+    def get_broadcast_recipients(self, active_only: bool = False) -> List[int]:
+        """کاربرانی که پیام همگانی برایشان ارسال می‌شود (بدون کاربران غیرقابل دسترس)"""
+        sql = ("SELECT user_id FROM users "
+               "WHERE user_id NOT IN (SELECT user_id FROM delivery_state)")
+        if active_only:
+            sql += " AND user_id NOT IN (SELECT user_id FROM disabled_users)"
+        return [row[0] for row in self._query(sql)]
+
+    # --- کدهای فعال‌سازی ---
+
+    def add_active_code(self,
+                        code: str,
+                        code_type: str,
+                        tokens: int = 0) -> None:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM code_users WHERE code = ?", (code, ))
+            conn.execute(
+                "INSERT OR REPLACE INTO codes (code, type, tokens, used_count, created_at) "
+                "VALUES (?, ?, ?, 0, ?)", (code, code_type, tokens, time.time()))
+
+    def remove_active_code(self, code: str) -> bool:
+        """حذف یک کد فعال‌سازی"""
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM codes WHERE code = ?", (code, ))
+            return cursor.rowcount > 0
+
+    def update_active_code(self,
+                           code: str,
+                           code_type: str,
+                           tokens: int = 0) -> bool:
+        """به‌روزرسانی یک کد فعال‌سازی"""
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE codes SET type = ?, tokens = ? WHERE code = ?",
+                (code_type, tokens, code))
+            return cursor.rowcount > 0
+
+    def get_code_stats(self, code: str) -> Dict:
+        """دریافت آمار استفاده از یک کد فعال‌سازی"""
+        row = self._query_one(
+            "SELECT type, tokens, used_count, created_at, "
+            "(SELECT COUNT(*) FROM code_users WHERE code_users.code = codes.code) AS users "
+            "FROM codes WHERE code = ?", (code, ))
+        if row is None:
+            return {}
+        return {
+            "کد": code,
+            "نوع": "دائمی" if row['type'] == "unlimited" else "توکنی",
+            "توکن‌ها": row['tokens'],
+            "تعداد استفاده": row['used_count'],
+            "تاریخ ایجاد": time.strftime("%Y-%m-%d %H:%M:%S",
+                                         time.localtime(row['created_at'])),
+            "کاربران": row['users']
+        }
+
+    def get_all_codes(self) -> Dict[str, Dict]:
+        """دریافت تمام کدهای فعال‌سازی"""
+        codes = {}
+        for row in self._query(
+                "SELECT code, type, tokens, used_count, created_at FROM codes ORDER BY rowid"):
+            code_data = dict(row)
+            code = code_data.pop('code')
+            code_data['users'] = []
+            codes[code] = code_data
+        for row in self._query("SELECT code, user_id FROM code_users ORDER BY rowid"):
+            if row['code'] in codes:
+                codes[row['code']]['users'].append(row['user_id'])
+        return codes
+
+    def initialize_codes(self):
+        DBManager.initialize_codes(self)
+
+    # --- آدرس‌های IPv4 ---
+
+    def get_ipv4_countries(self) -> Dict[str, Tuple[str, str, Sequence]]:
+        rows = self._query(
+            "SELECT c.code, c.name, c.flag, COUNT(i.id) AS ip_count "
+            "FROM countries c LEFT JOIN ips i ON i.country_code = c.code "
+            "GROUP BY c.code ORDER BY c.rowid")
+        return {
+            row['code']: (row['name'], row['flag'],
+                          _IPListView(self, row['code'], row['ip_count']))
+            for row in rows
+        }
+
+    def get_ips_by_country(self, country_code: str) -> Sequence:
+        if self._query_one("SELECT 1 FROM countries WHERE code = ?", (country_code, )) is None:
+            return []
+        return _IPListView(self, country_code)
+
+    def get_continent_countries(self, continent: str) -> List[Tuple[str, int]]:
+        """(کد کشور، تعداد IP) کشورهای دارای IP یک قاره به ترتیب نزولی تعداد IP"""
+        rows = self._query(
+            "SELECT c.code, c.name, c.flag, COUNT(i.id) AS ip_count "
+            "FROM countries c JOIN ips i ON i.country_code = c.code "
+            "GROUP BY c.code ORDER BY ip_count DESC")
+        return [(row['code'], row['ip_count']) for row in rows
+                if country_continent(row['code'], row['name'], row['flag']) == continent]
+
+    def rebuild_indexes(self):
+        """ایندکس‌ها در خود SQLite نگهداری می‌شوند؛ فقط کش‌های وابسته باطل می‌شوند"""
+        self.catalog_version += 1
+
+    def has_ipv4_address(self, ipv4: str, country_code: Optional[str] = None) -> bool:
+        """بررسی وجود یک IP در کل پایگاه داده یا در یک کشور خاص"""
+        if country_code is None:
+            return self.find_ip_country(ipv4) is not None
+        return self._query_one("SELECT 1 FROM ips WHERE country_code = ? AND ip = ?",
+                               (country_code, ipv4)) is not None
+
+    def find_ip_country(self, ipv4: str) -> Optional[str]:
+        """کد کشوری که IP در آن ثبت شده است (یا None)"""
+        row = self._query_one("SELECT country_code FROM ips WHERE ip = ? ORDER BY id DESC LIMIT 1",
+                              (ipv4, ))
+        return row[0] if row else None
+
+    def search_countries(self, query: str) -> List[str]:
+        """کد کشورهایی که نام، کد یا یکی از نام‌های مستعار آن‌ها با عبارت شروع می‌شود"""
+        # تعداد کشورها کم است؛ ایندکس کلمات در هر جستجو از جدول countries ساخته می‌شود
+        index = CountryTokenIndex()
+        for row in self._query("SELECT code, name FROM countries"):
+            index.add(row['code'], row['name'], country_search_aliases(row['code'], row['name']))
+        return sorted(index.search(query))
+
+    def search_ip_prefix(self, prefix: str, limit: Optional[int] = None) -> List[Tuple[str, str]]:
+        """آدرس‌هایی که با پیشوند داده‌شده شروع می‌شوند (جستجوی بازه‌ای روی ایندکس idx_ips_ip)"""
+        prefix = prefix.strip()
+        if parse_ip_prefix(prefix) is None:
+            return []
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        rows = self._query(
+            "SELECT ip, country_code FROM ips WHERE ip >= ? AND ip < ? ORDER BY ip LIMIT ?",
+            (prefix, upper, -1 if limit is None else limit))
+        return [(row['ip'], row['country_code']) for row in rows]
+
+    def search_ip_range(self,
+                        start: int,
+                        end: int,
+                        offset: int = 0,
+                        limit: Optional[int] = None) -> Tuple[int, List[Tuple[str, str]]]:
+        """آدرس‌های یک بازه عددی با جستجوی بازه‌ای روی ایندکس idx_ips_num"""
+        total = self._query_one("SELECT COUNT(*) FROM ips WHERE ip_num BETWEEN ? AND ?",
+                                (start, end))[0]
+        rows = self._query(
+            "SELECT ip, country_code FROM ips WHERE ip_num BETWEEN ? AND ? "
+            "ORDER BY ip_num LIMIT ? OFFSET ?",
+            (start, end, -1 if limit is None else limit, offset))
+        return total, [(row['ip'], row['country_code']) for row in rows]
+
+    def _resolve_country(self, conn, country_name: str) -> Tuple[str, str]:
+        """یافتن کلید و نام استاندارد کشور از طریق ایندکس norm_key (شناسه نام‌های مستعار)"""
+        # تشخیص خاص عربستان
+        if is_saudi_name(country_name):
+            return 'SA', 'Saudi Arabia'
+
+        group = country_group(country_name)
+        existing = conn.execute(
+            "SELECT code, name FROM countries WHERE norm_key = ? ORDER BY rowid LIMIT 1",
+            (group, )).fetchone()
+        if existing:
+            return existing['code'], existing['name']
+
+        # نام‌های مستعار شناخته‌شده (مانند UAE و KSA) از ابتدا با کد ISO ذخیره می‌شوند
+        if group == 'SA':
+            return 'SA', 'Saudi Arabia'
+        if normalize_country_key(country_name) in COUNTRY_ALIASES:
+            return group, country_name
+        return normalize_country_key(country_name), country_name
+
+    def add_ipv4_address(self, country_name: str, flag: str, ipv4: str) -> None:
+        with self._catalog_transaction() as conn:
+            country_code, standard_country_name = self._resolve_country(conn, country_name)
+            conn.execute(
+                "INSERT OR IGNORE INTO countries (code, name, flag, norm_key) VALUES (?, ?, ?, ?)",
+                (country_code, standard_country_name, flag, country_group(country_code)))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO ips (country_code, ip, ip_num) VALUES (?, ?, ?)",
+                (country_code, ipv4, ip_to_int(ipv4)))
+            if cursor.rowcount > 0:
+                # اضافه کردن به لیست آخرین IPهای اضافه شده
+                self._push_recent(conn, f"{flag} {standard_country_name}: {ipv4}")
+
+    def add_ipv4_addresses_bulk(self, ip_groups: Dict[str, list]) -> Dict[str, Dict]:
+        """افزودن یکجای آدرس‌ها در یک تراکنش (مانند DBManager.add_ipv4_addresses_bulk)"""
+        report = {}
+        recent_entries = []
+        with self._catalog_transaction() as conn:
+            for country_info, ip_list in ip_groups.items():
+                if not ip_list:
+                    continue
+                first = ip_list[0] if isinstance(ip_list[0], dict) else {}
+                country_name = first.get('country_name') or (
+                    country_info.split(" ", 1)[1] if " " in country_info else country_info)
+                flag = first.get('flag') or (country_info.split(" ")[0] if " " in country_info else "🏳️")
+                country_code, standard_country_name = self._resolve_country(conn, country_name)
+                conn.execute(
+                    "INSERT OR IGNORE INTO countries (code, name, flag, norm_key) VALUES (?, ?, ?, ?)",
+                    (country_code, standard_country_name, flag, country_group(country_code)))
+
+                stats = report.setdefault(country_code, {
+                    "name": standard_country_name,
+                    "flag": flag,
+                    "added": 0,
+                    "duplicates": 0
+                })
+                for ip_data in ip_list:
+                    ipv4 = ip_data["ip"] if isinstance(ip_data, dict) else ip_data
+                    cursor = conn.execute(
+                        "INSERT OR IGNORE INTO ips (country_code, ip, ip_num) VALUES (?, ?, ?)",
+                        (country_code, ipv4, ip_to_int(ipv4)))
+                    if cursor.rowcount > 0:
+                        stats["added"] += 1
+                        recent_entries.append(f"{flag} {standard_country_name}: {ipv4}")
+                    else:
+                        stats["duplicates"] += 1
+
+            if recent_entries:
+                conn.executemany("INSERT INTO recent_ips (entry) VALUES (?)",
+                                 [(entry, ) for entry in recent_entries[-RECENT_IPS_LIMIT:]])
+                conn.execute(
+                    "DELETE FROM recent_ips WHERE id NOT IN "
+                    "(SELECT id FROM recent_ips ORDER BY id DESC LIMIT ?)", (RECENT_IPS_LIMIT, ))
+        return report
+
+    def _push_recent(self, conn, entry: str) -> None:
+        conn.execute("INSERT INTO recent_ips (entry) VALUES (?)", (entry, ))
+        conn.execute(
+            "DELETE FROM recent_ips WHERE id NOT IN "
+            "(SELECT id FROM recent_ips ORDER BY id DESC LIMIT ?)", (RECENT_IPS_LIMIT, ))
+
+    def remove_country(self, country_code: str) -> bool:
+        """حذف کامل یک کشور و تمام آدرس‌های آن"""
+        with self._catalog_transaction() as conn:
+            cursor = conn.execute("DELETE FROM countries WHERE code = ?", (country_code, ))
+            return cursor.rowcount > 0
+
+    def remove_ipv4_address(self, country_code: str, ipv4: str) -> bool:
+        """حذف یک آدرس IP از پایگاه داده."""
+        with self._catalog_transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM ips WHERE country_code = ? AND ip = ?", (country_code, ipv4))
+            return cursor.rowcount > 0
+
+    def add_ipv6_address(self, country_name: str, flag: str,
+                         ipv6: str) -> None:
+        """اضافه کردن آدرس IPv6 به کشور"""
+        with self._catalog_transaction() as conn:
+            country_code, country_name = self._resolve_country(conn, country_name)
+            conn.execute(
+                "INSERT OR IGNORE INTO countries (code, name, flag, norm_key) VALUES (?, ?, ?, ?)",
+                (country_code, country_name, flag, country_group(country_code)))
+        # افزودن پشتیبانی IPv6 به ساختار داده
+        # به‌زودی پیاده‌سازی خواهد شد
+
+    # --- لوکیشن‌ها ---
+
+    def _location_state(self, conn, country_code: str) -> dict:
+        row = conn.execute("SELECT value FROM locations WHERE key = ?",
+                           (country_code, )).fetchone()
+        if row is None:
+            return {"ipv4": False, "ipv6": False}
+        value = json.loads(row[0])
+        if not isinstance(value, dict):
+            # تبدیل مقادیر قدیمی به فرمت جدید
+            return {"ipv4": value, "ipv6": value}
+        return value
+
+    def _set_location_state(self, conn, key: str, value) -> None:
+        conn.execute("INSERT OR REPLACE INTO locations (key, value) VALUES (?, ?)",
+                     (key, json.dumps(value)))
+
+    def disable_location(self,
+                         country_code: str,
+                         ip_type: str = "ipv4") -> bool:
+        """غیرفعال کردن یک لوکیشن"""
+        with self._catalog_transaction() as conn:
+            exists = conn.execute("SELECT 1 FROM countries WHERE code = ?",
+                                  (country_code, )).fetchone() is not None
+            if not exists and ip_type != "ipv6":
+                return False
+            state = self._location_state(conn, country_code)
+            state[ip_type] = True
+            self._set_location_state(conn, country_code, state)
+            return True
+
+    def enable_location(self,
+                        country_code: str,
+                        ip_type: str = "ipv4") -> bool:
+        """فعال کردن یک لوکیشن"""
+        with self._catalog_transaction() as conn:
+            if conn.execute("SELECT 1 FROM locations WHERE key = ?",
+                            (country_code, )).fetchone() is None:
+                return False
+            state = self._location_state(conn, country_code)
+            state[ip_type] = False
+            self._set_location_state(conn, country_code, state)
+            return True
+
+    def set_disabled_flag(self, key: str, disabled: bool) -> None:
+        """تنظیم یک پرچم ساده فعال/غیرفعال (مانند گزینه‌های تولید IPv6)"""
+        with self._catalog_transaction() as conn:
+            self._set_location_state(conn, key, disabled)
+
+    def is_location_disabled(self,
+                             country_code: str,
+                             ip_type: str = "ipv4") -> bool:
+        """بررسی اینکه آیا یک لوکیشن غیرفعال است"""
+        with self._lock:
+            return self._location_state(self._conn, country_code).get(ip_type, False)
+
+    def get_all_locations(self) -> Dict[str, Dict]:
+        """دریافت تمام لوکیشن‌ها با وضعیت فعال/غیرفعال"""
+        result = {}
+        for country_code, (name, flag, ips) in self.get_ipv4_countries().items():
+            result[country_code] = {
+                "name": name,
+                "flag": flag,
+                "ipv4_count": len(ips),
+                "ipv6_count": 0,
+                "ipv4_disabled": self.is_location_disabled(country_code, "ipv4"),
+                "ipv6_disabled": self.is_location_disabled(country_code, "ipv6")
+            }
+        return result
+
+    def get_stats(self) -> Dict[str, int]:
+        row = self._query_one(
+            "SELECT (SELECT COUNT(*) FROM users) AS users, "
+            "(SELECT COUNT(*) FROM disabled_users) AS disabled, "
+            "(SELECT COUNT(*) FROM delivery_state) AS unreachable, "
+            "(SELECT COUNT(*) FROM codes) AS codes, "
+            "(SELECT COUNT(*) FROM countries) AS countries, "
+            "(SELECT COUNT(*) FROM ips) AS ips")
+        return {
+            "کاربران فعال": row['users'] - row['disabled'],
+            "کاربران غیرفعال": row['disabled'],
+            "کاربران غیرقابل دسترس": row['unreachable'],
+            "کدهای فعال‌سازی": row['codes'],
+            "تعداد کشورها": row['countries'],
+            "تعداد کل IPv4": row['ips']
+        }
+
+    # --- انتقال داده ---
+
+    def restore_snapshot(self, path: str = DB_FILE, journal_path: Optional[str] = None) -> bool:
+        """
+        بازیابی داده‌ها از یک اسنپ‌شات DBManager (مثلاً بکاپ) در یک تراکنش و بدون راه‌اندازی مجدد.
+        رکوردهای journal_path (بکاپ افزایشی) پیش از انتقال روی اسنپ‌شات اعمال می‌شوند.
+
+        Returns:
+            bool: False اگر فایل معتبر نباشد (داده‌های فعلی دست نمی‌خورند)
+        """
+        try:
+            staged = DBManager(load=False).staged_copy(path, journal_path)
+        except Exception as e:
+            print(f"فایل اسنپ‌شات معتبر نیست: {e}")
+            return False
+        self.import_state(staged._snapshot_state())
+        return True
+
+    def export_state(self) -> dict:
+        """
+        وضعیت کامل پایگاه داده در قالب اسنپ‌شات DBManager (برای بکاپ‌گیری).
+
+        همه جدول‌ها زیر قفل اتصال مشترک خوانده می‌شوند تا وضعیت یکپارچه باشد؛ خروجی با
+        import_state دوباره قابل بارگذاری است.
+        """
+        with self._lock:
+            conn = self._conn
+            active_users = {
+                row['user_id']: {'type': row['type'], 'tokens': row['tokens'],
+                                 'joined_date': row['joined_date'],
+                                 'activation_code': row['activation_code']}
+                for row in conn.execute("SELECT * FROM users ORDER BY rowid")}
+            disabled_users = {row[0] for row in conn.execute("SELECT user_id FROM disabled_users")}
+            delivery_state = {
+                row['user_id']: {'status': row['status'], 'reason': row['reason'], 'since': row['since']}
+                for row in conn.execute("SELECT * FROM delivery_state")}
+
+            active_codes = {
+                row['code']: {'type': row['type'], 'tokens': row['tokens'],
+                              'used_count': row['used_count'], 'created_at': row['created_at'],
+                              'users': []}
+                for row in conn.execute("SELECT * FROM codes ORDER BY rowid")}
+            for row in conn.execute("SELECT code, user_id FROM code_users ORDER BY rowid"):
+                if row['code'] in active_codes:
+                    active_codes[row['code']]['users'].append(row['user_id'])
+
+            ipv4_data = {row['code']: (row['name'], row['flag'], [])
+                         for row in conn.execute("SELECT code, name, flag FROM countries ORDER BY rowid")}
+            for row in conn.execute("SELECT country_code, ip FROM ips ORDER BY id"):
+                ipv4_data[row['country_code']][2].append(row['ip'])
+
+            disabled_locations = {row['key']: json.loads(row['value'])
+                                  for row in conn.execute("SELECT key, value FROM locations ORDER BY rowid")}
+            wg_endpoints = [row[0] for row in conn.execute("SELECT endpoint FROM endpoints ORDER BY id")]
+            last_added_ips = deque(
+                (row[0] for row in conn.execute(
+                    "SELECT entry FROM recent_ips ORDER BY id DESC LIMIT ?", (RECENT_IPS_LIMIT, ))),
+                maxlen=RECENT_IPS_LIMIT)
+
+        return {
+            'active_codes': active_codes,
+            'active_users': active_users,
+            'ipv4_data': ipv4_data,
+            'disabled_users': disabled_users,
+            'delivery_state': delivery_state,
+            'disabled_locations': disabled_locations,
+            'wg_endpoints': wg_endpoints,
+            'last_added_ips': last_added_ips,
+            'journal_seq': 0
+        }
+
+    def import_state(self, state: dict) -> None:
+        """جایگزینی کامل داده‌ها با وضعیت یک اسنپ‌شات DBManager در یک تراکنش"""
+        with self._catalog_transaction() as conn:
+            for table in ('code_users', 'codes', 'disabled_users', 'delivery_state', 'users', 'ips',
+                          'countries', 'locations', 'endpoints', 'recent_ips'):
+                conn.execute(f"DELETE FROM {table}")
+
+            for user_id, user in state.get('active_users', {}).items():
+                conn.execute(
+                    "INSERT INTO users (user_id, type, tokens, joined_date, activation_code) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (user_id, user.get('type', 'token'), user.get('tokens', 0),
+                     user.get('joined_date', "نامشخص"), user.get('activation_code', "نامشخص")))
+            conn.executemany("INSERT OR IGNORE INTO disabled_users (user_id) VALUES (?)",
+                             [(user_id, ) for user_id in state.get('disabled_users', set())])
+            conn.executemany(
+                "INSERT INTO delivery_state (user_id, status, reason, since) VALUES (?, ?, ?, ?)",
+                [(user_id, entry.get('status', ''), entry.get('reason', ''), entry.get('since', time.time()))
+                 for user_id, entry in state.get('delivery_state', {}).items()])
+
+            for code, code_data in state.get('active_codes', {}).items():
+                conn.execute(
+                    "INSERT INTO codes (code, type, tokens, used_count, created_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (code, code_data.get('type', 'token'), code_data.get('tokens', 0),
+                     code_data.get('used_count', 0), code_data.get('created_at', time.time())))
+                conn.executemany("INSERT INTO code_users (code, user_id) VALUES (?, ?)",
+                                 [(code, user_id) for user_id in code_data.get('users', [])])
+
+            for country_code, (name, flag, ips) in state.get('ipv4_data', {}).items():
+                # کلیدهای قدیمی عربستان در SA ادغام می‌شوند
+                if country_code.lower() in SAUDI_KEYS:
+                    country_code = 'SA'
+                conn.execute(
+                    "INSERT OR IGNORE INTO countries (code, name, flag, norm_key) VALUES (?, ?, ?, ?)",
+                    (country_code, name, flag, country_group(country_code)))
+                conn.executemany(
+                    "INSERT OR IGNORE INTO ips (country_code, ip, ip_num) VALUES (?, ?, ?)",
+                    [(country_code, ip, ip_to_int(ip)) for ip in ips])
+
+            for key, value in state.get('disabled_locations', {}).items():
+                self._set_location_state(conn, key, value)
+            conn.executemany("INSERT OR IGNORE INTO endpoints (endpoint) VALUES (?)",
+                             [(endpoint, ) for endpoint in state.get('wg_endpoints', [])])
+            # deque آخرین IPها از جدید به قدیم است
+            conn.executemany("INSERT INTO recent_ips (entry) VALUES (?)",
+                             [(entry, ) for entry in reversed(list(state.get('last_added_ips', [])))])
+
+
+def migrate_pickle_to_sqlite(sqlite_path: str = SQLITE_FILE) -> SQLiteDBManager:
+    """
+    انتقال یک‌باره bot_database.pkl (به همراه ژورنال آن) به پایگاه داده SQLite.
+
+    Returns:
+        SQLiteDBManager: مدیر پایگاه داده جدید که داده‌ها در آن منتقل شده‌اند
+    """
+    source = DBManager(storage_mode="journal")
+    target = SQLiteDBManager(sqlite_path)
+    target.import_state(source._snapshot_state())
+    return target
+
+
+if __name__ == '__main__':
+    manager = migrate_pickle_to_sqlite()
+    for key, value in manager.get_stats().items():
+        print(f"{key}: {value}")
@@ -0,0 +1,14 @@
+import os
+import sys
+
+import pytest
+
+# ماژول‌های ربات در ریشه مخزن هستند
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """اجرای تست در پوشه موقت تا فایل‌های پایگاه داده و بکاپ واقعی دست نخورند"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,56 @@
+import json
+import os
+import shutil
+
+import pytest
+
+import backup_manager
+from backup_manager import BackupManager, PARTS_SUFFIX
+from snapshot_file import write_snapshot
+
+
+@pytest.fixture
+def manager(workdir):
+    write_snapshot(backup_manager.DB_SNAPSHOT_FILE, {'ipv4_data': {}, 'payload': os.urandom(4096).hex()})
+    return BackupManager()
+
+
+def write_parts_manifest(manager, manifest):
+    os.makedirs(manager.incoming_dir, exist_ok=True)
+    with open(os.path.join(manager.incoming_dir, 'upload' + PARTS_SUFFIX), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+
+def test_split_backup_is_reassembled_and_imported(manager):
+    backup_id = manager.create_backup()
+    parts = manager.split_archive(manager.export_backup(backup_id), part_size=2048)
+    os.makedirs(manager.incoming_dir, exist_ok=True)
+    for path in parts:
+        shutil.copy(path, manager.incoming_dir)
+
+    status = manager.assemble_upload()
+    assert status.archive is not None and status.received == status.total
+    assert manager.import_backup(status.archive)
+
+
+@pytest.mark.parametrize('name', ['../secret', '../../etc/passwd', '/etc/passwd', 'sub/part', '..', ''])
+def test_part_names_with_path_components_are_rejected(manager, workdir, name):
+    (workdir / 'secret').write_bytes(b'not a backup part')
+    write_parts_manifest(manager, {'name': 'backup.tar', 'sha256': '0' * 64,
+                                   'parts': [{'name': name, 'sha256': '0' * 64}]})
+    with pytest.raises(ValueError):
+        manager.assemble_upload()
+
+
+def test_archive_name_with_path_components_is_rejected(manager):
+    write_parts_manifest(manager, {'name': '../backup.tar', 'sha256': '0' * 64,
+                                   'parts': [{'name': 'part1', 'sha256': '0' * 64}]})
+    with pytest.raises(ValueError):
+        manager.assemble_upload()
+
+
+def test_archive_name_must_differ_from_part_names(manager):
+    write_parts_manifest(manager, {'name': 'part1', 'sha256': '0' * 64,
+                                   'parts': [{'name': 'part1', 'sha256': '0' * 64}]})
+    with pytest.raises(ValueError):
+        manager.assemble_upload()
@@ -0,0 +1,45 @@
+import pytest
+
+from db_manager import DBManager
+
+
+def country_key(db, name):
+    return next(code for code, (country, _, _) in db.ipv4_data.items() if country == name)
+
+
+@pytest.fixture(params=[False, True], ids=['list', 'compact'])
+def db(request, workdir):
+    return DBManager(compact_ips=request.param)
+
+
+@pytest.fixture
+def shared_ip(db):
+    db.add_ipv4_address('Germany', '🇩🇪', '1.2.3.4')
+    db.add_ipv4_address('France', '🇫🇷', '1.2.3.4')
+    return db
+
+
+def test_ip_in_two_countries_is_indexed_for_both(shared_ip):
+    db = shared_ip
+    assert db.has_ipv4_address('1.2.3.4', country_key(db, 'Germany'))
+    assert db.has_ipv4_address('1.2.3.4', country_key(db, 'France'))
+
+
+def test_removing_ip_from_one_country_keeps_the_other(shared_ip):
+    db = shared_ip
+    germany, france = country_key(db, 'Germany'), country_key(db, 'France')
+    assert db.remove_ipv4_address(france, '1.2.3.4')
+    assert db.has_ipv4_address('1.2.3.4')
+    assert db.find_ip_country('1.2.3.4') == germany
+
+    assert db.remove_ipv4_address(germany, '1.2.3.4')
+    assert not db.has_ipv4_address('1.2.3.4')
+    assert db.find_ip_country('1.2.3.4') is None
+
+
+def test_removing_country_keeps_ips_shared_with_other_countries(shared_ip):
+    db = shared_ip
+    germany, france = country_key(db, 'Germany'), country_key(db, 'France')
+    assert db.remove_country(germany)
+    assert db.find_ip_country('1.2.3.4') == france
+    assert not db.has_ipv4_address('1.2.3.4', germany)
@@ -0,0 +1,41 @@
+import pytest
+
+from db_manager import DBManager
+from ip_storage import ip_to_int
+
+
+@pytest.fixture(params=[False, True], ids=['list', 'compact'])
+def db(request, workdir):
+    return DBManager(compact_ips=request.param)
+
+
+def test_prefix_search_finds_ip_entered_with_leading_zeros(db):
+    db.add_ipv4_address('Germany', '🇩🇪', '5.2.3.04')
+    assert db.search_ip_prefix('5.2') == [('5.2.3.4', 'DE')]
+    assert db.has_ipv4_address('5.2.3.4')
+    assert db.remove_ipv4_address('DE', '5.2.3.4')
+    assert db.search_ip_prefix('5.2') == []
+
+
+def test_prefix_search_on_legacy_non_canonical_data(db):
+    # IPهای ذخیره‌شده پیش از استانداردسازی ورودی
+    db.ipv4_data['DE'] = ('Germany', '🇩🇪', db._make_ip_list(['5.2.3.04', '5.2.9.9']))
+    db.rebuild_indexes()
+    assert db.search_ip_prefix('5.2.') == [('5.2.3.4', 'DE'), ('5.2.9.9', 'DE')]
+    assert db.remove_ipv4_address('DE', '5.2.3.4')
+    assert list(db.get_ips_by_country('DE')) == ['5.2.9.9']
+
+
+def test_prefix_search_keeps_ip_still_held_by_another_country(db):
+    db.add_ipv4_address('Germany', '🇩🇪', '1.2.3.4')
+    db.add_ipv4_address('France', '🇫🇷', '1.2.3.4')
+    db.remove_ipv4_address('FR', '1.2.3.4')
+    assert db.search_ip_prefix('1.2') == [('1.2.3.4', 'DE')]
+
+
+def test_range_search_finds_ip_entered_with_leading_zeros(db):
+    db.add_ipv4_address('Germany', '🇩🇪', '5.2.3.04')
+    db.add_ipv4_address('France', '🇫🇷', '5.2.200.1')
+    total, results = db.search_ip_range(ip_to_int('5.2.0.0'), ip_to_int('5.2.255.255'))
+    assert total == 2
+    assert results == [('5.2.3.4', 'DE'), ('5.2.200.1', 'FR')]
@@ -0,0 +1,51 @@
+import base64
+
+import pytest
+
+import wg
+
+
+def test_x25519_rfc7748_scalar_multiplication():
+    # RFC 7748 بخش 5.2
+    scalar = bytes.fromhex('a546e36bf0527c9d3b16154b82465edd62144c0ac1fc5a18506a2244ba449ac4')
+    u = bytes.fromhex('e6db6867583030db3594c1a424b15f7c726624ec26b3353b10a903a6d0ab1c4c')
+    expected = 'c3da55379de9c6908e94ea4df28d084f32eccf03491c71f754b4075577a28552'
+    assert wg.x25519(scalar, u).hex() == expected
+
+
+def test_x25519_rfc7748_diffie_hellman():
+    # RFC 7748 بخش 6.1
+    alice = bytes.fromhex('77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a')
+    bob = bytes.fromhex('5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb')
+    alice_public = wg.x25519(alice, wg._BASE_POINT)
+    bob_public = wg.x25519(bob, wg._BASE_POINT)
+    assert alice_public.hex() == '8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a'
+    assert bob_public.hex() == 'de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f'
+    shared = '4a5d9d5ba4ce2de1728e3bf480350f25e07e21c947d19e3376f09b3c1e161742'
+    assert wg.x25519(alice, bob_public).hex() == shared
+    assert wg.x25519(bob, alice_public).hex() == shared
+
+
+def test_public_key_from_private_matches_rfc_vector():
+    alice = bytes.fromhex('77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a')
+    public_key = wg.public_key_from_private(base64.b64encode(alice).decode())
+    assert base64.b64decode(public_key).hex() == \
+        '8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a'
+
+
+def test_generated_keypair_is_consistent():
+    private_key, public_key = wg.generate_keypair()
+    assert len(base64.b64decode(private_key)) == 32
+    assert wg.public_key_from_private(private_key) == public_key
+
+
+def test_config_peer_uses_server_public_key():
+    _, server_public_key = wg.generate_keypair()
+    config, _ = wg.WireguardConfig(server_public_key=server_public_key).generate_config(
+        endpoint='1.2.3.4', port=51820)
+    assert f"PublicKey = {server_public_key}" in config
+
+
+def test_config_requires_server_public_key():
+    with pytest.raises(ValueError):
+        wg.WireguardConfig().generate_config()
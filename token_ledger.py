@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import namedtuple
+
+from save_scheduler import SaveScheduler
+
+TOKEN_LOG_FILE = 'token_ledger.log'
+
+# ok: whether the tokens were taken; balance: tokens left (None for unlimited users)
+ChargeResult = namedtuple('ChargeResult', 'ok balance')
+
+
+class TokenLedger:
+    def __init__(self, db, log_file=TOKEN_LOG_FILE, flush_interval=2.0):
+        """
+        Single entry point for spending and granting tokens.
+
+        Every change for a user runs under that user's lock, so checking the balance and
+        deducting from it is one atomic step even when several dispatcher workers handle
+        taps from the same user. Changes are applied in memory right away; the touched
+        balances are committed to the database and the entries of the append-only spend
+        log are written together, at most once per flush interval.
+
+        Args:
+            db: DBManager or SQLiteDBManager holding the balances
+            log_file (str): JSON-lines file receiving one entry per charge or grant
+            flush_interval (float): Maximum delay before changes reach the disk in seconds
+        """
+        self.db = db
+        self.log_file = log_file
+        self._user_locks = {}
+        self._locks_guard = threading.Lock()
+        self._pending_entries = []
+        self._pending_users = set()
+        self._pending_lock = threading.Lock()
+        self._scheduler = SaveScheduler(self.flush, interval=flush_interval)
+        self.logger = logging.getLogger('token_ledger')
+
+    def start(self):
+        """Start the background flusher."""
+        self._scheduler.start()
+
+    def stop(self):
+        """Stop the flusher and write everything that is still pending."""
+        self._scheduler.stop()
+
+    def _user_lock(self, user_id):
+        with self._locks_guard:
+            lock = self._user_locks.get(user_id)
+            if lock is None:
+                lock = self._user_locks[user_id] = threading.Lock()
+            return lock
+
+    def charge(self, user_id, amount, reason):
+        """
+        Take tokens for a feature.
+
+        Unlimited users are always charged successfully without changing a balance.
+
+        Args:
+            user_id (int): Telegram user id
+            amount (int): Tokens to take
+            reason (str): Feature name stored in the spend log (e.g. "wireguard")
+
+        Returns:
+            ChargeResult: (ok, balance); ok is False for inactive users or when the
+                balance is too low
+        """
+        with self._user_lock(user_id):
+            if not self.db.is_user_active(user_id):
+                return ChargeResult(False, 0)
+            if self.db.active_users[user_id].get('type') == 'unlimited':
+                return ChargeResult(True, None)
+            if not self.db.use_tokens(user_id, amount, commit=False):
+                return ChargeResult(False, self.db.get_tokens(user_id))
+            balance = self.db.get_tokens(user_id)
+            self._record(user_id, -amount, reason, balance)
+        return ChargeResult(True, balance)
+
+    def grant(self, user_id, amount, reason="grant"):
+        """
+        Add tokens to a user (admin grants).
+
+        Returns:
+            bool: False if the user does not exist
+        """
+        with self._user_lock(user_id):
+            if not self.db.grant_tokens(user_id, amount):
+                return False
+            self._record(user_id, amount, reason, self.db.get_tokens(user_id))
+        # Grants are rare, write them immediately
+        self._scheduler.flush()
+        return True
+
+    def _record(self, user_id, amount, reason, balance):
+        entry = {"ts": time.time(), "user_id": user_id, "amount": amount,
+                 "reason": reason, "balance": balance}
+        with self._pending_lock:
+            self._pending_entries.append(entry)
+            self._pending_users.add(user_id)
+        self._scheduler.mark_dirty()
+
+    def flush(self):
+        """
+        Commit the changed balances and append pending entries to the spend log.
+
+        Returns:
+            bool: True on success (failed entries are kept for the next attempt)
+        """
+        with self._pending_lock:
+            entries, self._pending_entries = self._pending_entries, []
+            users, self._pending_users = self._pending_users, set()
+        if not entries and not users:
+            return True
+        try:
+            self.db.commit_users(users)
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+                f.flush()
+                os.fsync(f.fileno())
+            return True
+        except Exception as e:
+            self.logger.error(f"Failed to flush token ledger: {e}")
+            with self._pending_lock:
+                self._pending_entries[:0] = entries
+                self._pending_users |= users
+            return False
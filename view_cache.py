@@ -0,0 +1,49 @@
+import threading
+
+
+class ViewCache:
+    def __init__(self, version_source):
+        """
+        Cache of rendered menus (message text and keyboard) keyed by view name.
+
+        Every entry remembers the data version it was built from. A view is rebuilt the
+        first time it is requested after the version changes; until then every tap reuses
+        the same prebuilt objects without touching the database.
+
+        Args:
+            version_source (callable): Returns the current data version
+                (e.g. ``lambda: db.catalog_version``)
+        """
+        self.version_source = version_source
+        self._entries = {}  # view -> (version, value)
+        self._lock = threading.Lock()
+
+    def get(self, view, builder, *args):
+        """
+        Return the cached value of a view, building it with builder(*args) when stale.
+
+        Args:
+            view (hashable): Cache key, e.g. 'ipv4_countries' or ('continent', 'AS')
+            builder (callable): Renders the view from the current data
+        """
+        version = self.version_source()
+        entry = self._entries.get(view)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        with self._lock:
+            # Another thread may have rebuilt the view while we were waiting
+            entry = self._entries.get(view)
+            if entry is not None and entry[0] == version:
+                return entry[1]
+            value = builder(*args)
+            self._entries[view] = (version, value)
+            return value
+
+    def invalidate(self, view=None):
+        """Drop one view, or every view when none is given."""
+        with self._lock:
+            if view is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(view, None)
@@ -1,27 +1,165 @@
 
 import random
 import os
+import io
 import ipaddress
 import base64
+import zipfile
+from itertools import cycle
+
+try:
+    from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+except ImportError:  # بدون کتابخانه cryptography از پیاده‌سازی پایتونی استفاده می‌شود
+    X25519PrivateKey = None
+
+# پارامترهای منحنی Curve25519 (RFC 7748)
+_P = 2 ** 255 - 19
+_A24 = 121665
+_BASE_POINT = (9).to_bytes(32, 'little')
+
+# شبکه پیش‌فرض برای تخصیص آدرس‌های یکتا در ساخت گروهی کانفیگ‌ها
+BATCH_NETWORK = "10.66.0.0/16"
+
+
+def _clamp(scalar: bytes) -> int:
+    k = bytearray(scalar)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return int.from_bytes(k, 'little')
+
+
+def x25519(scalar: bytes, u: bytes) -> bytes:
+    """
+    تابع X25519 (ضرب اسکالر روی منحنی Montgomery با نردبان RFC 7748).
+
+    این پیاده‌سازی پایتونی زمان ثابت نیست و فقط در نبود کتابخانه cryptography برای
+    تولید کلید در پس‌زمینه استفاده می‌شود.
+    """
+    k = _clamp(scalar)
+    x1 = int.from_bytes(u, 'little') & ((1 << 255) - 1)
+    x2, z2, x3, z3 = 1, 0, x1, 1
+    swap = 0
+    for t in range(254, -1, -1):
+        bit = (k >> t) & 1
+        if swap ^ bit:
+            x2, x3 = x3, x2
+            z2, z3 = z3, z2
+        swap = bit
+        a = x2 + z2
+        aa = a * a % _P
+        b = x2 - z2
+        bb = b * b % _P
+        e = aa - bb
+        da = (x3 - z3) * a % _P
+        cb = (x3 + z3) * b % _P
+        x3 = (da + cb) ** 2 % _P
+        z3 = x1 * (da - cb) ** 2 % _P
+        x2 = aa * bb % _P
+        z2 = e * (aa + _A24 * e) % _P
+    if swap:
+        x2, z2 = x3, z3
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, 'little')
+
+
+def public_key_from_private(private_key: str) -> str:
+    """کلید عمومی WireGuard (base64) متناظر با یک کلید خصوصی (base64)"""
+    private_bytes = base64.b64decode(private_key)
+    if X25519PrivateKey is not None:
+        public_bytes = X25519PrivateKey.from_private_bytes(private_bytes).public_key().public_bytes(
+            Encoding.Raw, PublicFormat.Raw)
+    else:
+        public_bytes = x25519(private_bytes, _BASE_POINT)
+    return base64.b64encode(public_bytes).decode('ascii')
+
+
+def generate_keypair():
+    """
+    تولید یک جفت کلید X25519 مانند `wg genkey | wg pubkey`.
+
+    Returns:
+        tuple: (کلید خصوصی، کلید عمومی) به صورت base64
+    """
+    private_bytes = bytearray(os.urandom(32))
+    private_bytes[0] &= 248
+    private_bytes[31] = (private_bytes[31] & 127) | 64
+    private_key = base64.b64encode(bytes(private_bytes)).decode('ascii')
+    return private_key, public_key_from_private(private_key)
+
+
+def check_public_key(public_key: str) -> str:
+    """
+    بررسی یک کلید عمومی WireGuard (base64 از ۳۲ بایت).
+
+    Raises:
+        ValueError: کلید معتبر نیست
+    """
+    try:
+        raw = base64.b64decode(public_key, validate=True)
+    except (ValueError, TypeError):
+        raw = b''
+    if len(raw) != 32:
+        raise ValueError("کلید عمومی سرور وایرگارد معتبر نیست")
+    return public_key
+
 
 class WireguardConfig:
-    def __init__(self):
+    def __init__(self, resolver=None, key_pool=None, server_public_key=None):
+        self.resolver = resolver  # GeoResolver مشترک برای تشخیص کشور سرور
+        self.key_pool = key_pool  # KeyPool از جفت کلیدهای آماده (generate_keypair)
+        # کلید عمومی سرور برای بخش [Peer]؛ بدون آن کانفیگ‌ها هرگز handshake نمی‌کنند
+        self.server_public_key = check_public_key(server_public_key) if server_public_key else None
         self.endpoint_ports = [53, 80, 443, 8080, 51820, 1194]
         self.dns_servers = ["1.1.1.1", "8.8.8.8", "9.9.9.9", "149.112.112.112"]
         self.mtu_options = [1280, 1380, 1420, 1480]
 
+    def generate_keypair(self):
+        """
+        یک جفت کلید (خصوصی، عمومی)؛ از استخر کلیدهای آماده در صورت وجود، بدون محاسبات
+        منحنی در مسیر درخواست.
+        """
+        if self.key_pool is not None:
+            return self.key_pool.get()
+        return generate_keypair()
+
     def generate_private_key(self):
         """تولید کلید خصوصی"""
-        key_chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
-        return base64.b64encode(os.urandom(32)).decode('utf-8')
-    
-    def generate_public_key(self):
-        """تولید کلید عمومی"""
-        key_chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
-        return base64.b64encode(os.urandom(32)).decode('utf-8')
+        return self.generate_keypair()[0]
+
+    def generate_public_key(self, private_key):
+        """کلید عمومی متناظر با کلید خصوصی"""
+        return public_key_from_private(private_key)
     
-    def generate_config(self, address=None, port=None, dns=None, mtu=None, endpoint=None, country=None, allowed_ips=None, keepalive=None, config_name=None):
-        """تولید پیکربندی وایرگارد با پارامترهای دلخواه"""
+    def generate_config(self, address=None, port=None, dns=None, mtu=None, endpoint=None, country=None, allowed_ips=None, keepalive=None, config_name=None,
+                        count=None, endpoints=None, network=BATCH_NETWORK, server_public_key=None):
+        """
+        تولید پیکربندی وایرگارد با پارامترهای دلخواه
+
+        کلید [Peer] کلید عمومی سرور است (server_public_key یا مقدار تنظیم‌شده در سازنده)؛
+        کلید عمومی کلاینت فقط در سمت سرور ثبت می‌شود.
+
+        حالت گروهی: با تعیین count، تعداد count کانفیگ در یک فراخوانی ساخته می‌شود؛
+        endpointها به نوبت از لیست endpoints (در صورت وجود) انتخاب می‌شوند و هر کانفیگ
+        آدرس /32 یکتایی از network و نام یکتا می‌گیرد. سایر پارامترها برای همه کانفیگ‌ها
+        مشترک هستند (مقادیر None برای هر کانفیگ جداگانه انتخاب می‌شوند).
+
+        Returns:
+            tuple: (کانفیگ، نام کانفیگ) یا در حالت گروهی لیستی از این تاپل‌ها
+
+        Raises:
+            ValueError: کلید عمومی سرور تنظیم نشده است
+        """
+        server_public_key = server_public_key or self.server_public_key
+        if not server_public_key:
+            raise ValueError("کلید عمومی سرور وایرگارد تنظیم نشده است")
+
+        if count is not None:
+            return list(self._generate_batch(count, endpoints, network, port=port, dns=dns, mtu=mtu,
+                                             country=country, allowed_ips=allowed_ips,
+                                             keepalive=keepalive,
+                                             server_public_key=server_public_key))
+
         # تنظیم مقادیر پیش‌فرض اگر پارامتری تعیین نشده باشد
         if address is None:
             address = random.choice([
@@ -53,9 +191,8 @@ class WireguardConfig:
             chars = string.ascii_letters + string.digits
             config_name = ''.join(random.choice(chars) for _ in range(6))
         
-        # تولید کلیدها
-        private_key = self.generate_private_key()
-        public_key = self.generate_public_key()
+        # تولید کلید کلاینت (کلید عمومی آن در کانفیگ کلاینت لازم نیست)
+        private_key, _ = self.generate_keypair()
         
         # تنظیم AllowedIPs و PersistentKeepalive
         if allowed_ips is None:
@@ -72,15 +209,50 @@ DNS = {dns}
 MTU = {mtu}
 
 [Peer]
-PublicKey = {public_key}
+PublicKey = {server_public_key}
 AllowedIPs = {allowed_ips}
 Endpoint = {endpoint}:{port}
 PersistentKeepalive = {keepalive}
 """
         return config, config_name
+
+    def _generate_batch(self, count, endpoints, network, port=None, **options):
+        """تولید تدریجی کانفیگ‌های حالت گروهی (endpoint چرخشی، آدرس و نام یکتا)"""
+        hosts = ipaddress.ip_network(network).hosts()
+        next(hosts, None)  # اولین آدرس شبکه برای سرور (gateway) کنار گذاشته می‌شود
+        addresses = [f"{host}/32" for _, host in zip(range(count), hosts)]
+        if len(addresses) < count:
+            raise ValueError(f"شبکه {network} برای {count} آدرس یکتا کافی نیست")
+
+        rotation = cycle(endpoints) if endpoints else None
+        for i, address in enumerate(addresses, 1):
+            endpoint, endpoint_port = None, port
+            if rotation is not None:
+                # endpointهای ثبت‌شده ممکن است پورت خود را داشته باشند (host:port)
+                endpoint, _, own_port = next(rotation).partition(':')
+                if own_port:
+                    endpoint_port = int(own_port)
+            config, name = self.generate_config(address=address, port=endpoint_port,
+                                                endpoint=endpoint, **options)
+            # پیشوند شماره‌دار نام فایل‌ها را در ZIP یکتا و مرتب نگه می‌دارد
+            yield config, f"wg{i:03d}_{name}"
     
     def get_server_info(self, endpoint):
         """دریافت اطلاعات سرور از آدرس Endpoint"""
+        if self.resolver is not None:
+            info = self.resolver.lookup(endpoint, with_isp=True)
+            if info:
+                return {
+                    "country": info["country_name"],
+                    "country_code": info["country_code"] or "XX",
+                    "isp": info["isp"]
+                }
+            return {
+                "country": "نامشخص",
+                "country_code": "XX",
+                "isp": "نامشخص"
+            }
+
         try:
             import requests
             response = requests.get(f"https://api.iplocation.net/?ip={endpoint}")
@@ -99,3 +271,21 @@ PersistentKeepalive = {keepalive}
             "country_code": "XX",
             "isp": "نامشخص"
         }
+
+
+def configs_to_zip(configs):
+    """
+    فشرده‌سازی کانفیگ‌ها در یک فایل ZIP در حافظه (هر کانفیگ یک فایل .conf)
+
+    Args:
+        configs: iterable از (کانفیگ، نام)؛ کانفیگ‌ها به محض تولید در ZIP نوشته می‌شوند
+
+    Returns:
+        io.BytesIO: محتوای ZIP آماده ارسال (از ابتدا)
+    """
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for config, name in configs:
+            archive.writestr(f"{name}.conf", config)
+    buffer.seek(0)
+    return buffer